@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+"""
+    A deterministic stand-in for the ``rrdtool`` executable, which
+    answers the commands used by thrush without touching any RRD file.
+
+    The size of the output of ``fetch`` is controlled by the following
+    environment variables:
+
+    ``THRUSH_FAKE_ROWS``
+        The number of rows (default: 1440).
+    ``THRUSH_FAKE_DS``
+        The number of datasources named ``ds0``, ``ds1``, ...
+        (default: 1).
+    ``THRUSH_FAKE_STEP``
+        The seconds between two rows (default: 60).
+
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import sys
+import shlex
+
+START = 1356994800
+
+# the pipe mode of rrdtool reads lines with fgets() into a buffer of
+# MAX_LENGTH (10000) bytes, thus longer lines are split into several
+# commands.
+MAX_LINE = 9998
+
+
+def _settings():
+    return (
+        int(os.environ.get("THRUSH_FAKE_ROWS", "1440")),
+        int(os.environ.get("THRUSH_FAKE_DS", "1")),
+        int(os.environ.get("THRUSH_FAKE_STEP", "60")),
+    )
+
+
+def dsnames(datasources):
+    """
+        The names of the datasources. They are zero padded, thus the
+        order of thrush (sorted by name) is the same as in the output.
+    """
+    return ["ds%02d" % i for i in range(datasources)]
+
+
+def _value(row, ds):
+    # every 17th value is unknown, all others are reproducible
+    if (row + ds) % 17 == 0:
+        return "nan"
+    return "%0.10e" % ((row * 31 + ds * 7) % 1000 / 10.0)
+
+
+def fetch_lines(rows, datasources, step=60):
+    """
+        Generates the output of ``rrdtool fetch`` line by line without
+        the trailing newline.
+    """
+    yield "".join("%20s" % name for name in dsnames(datasources))
+    yield ""
+    for row in range(rows):
+        yield "%d: %s" % (START + row * step, " ".join(
+            _value(row, ds) for ds in range(datasources)
+        ))
+
+
+def _lastupdate(rows, datasources, step):
+    yield "".join(" %s" % name for name in dsnames(datasources))
+    yield ""
+    yield "%d: %s" % (START + rows * step, " ".join(
+        "%d" % ds for ds in range(datasources)
+    ))
+
+
+def execute(arguments, out):
+    """
+        Executes a command and returns an error message or ``None``.
+    """
+    if len(arguments) < 2:
+        return "expected a command and a filename"
+
+    # rrdtool does not unquote arguments itself, thus quotes would end
+    # up in the names of consolidation functions or times
+    for argument in arguments:
+        if argument[:1] in ("'", '"'):
+            return "quoted argument %s" % argument
+
+    command = arguments[0]
+    if command == "fetch" and (len(arguments) < 3 or arguments[2] not in
+                               ("AVERAGE", "MIN", "MAX", "LAST")):
+        return "unknown consolidation function"
+    rows, datasources, step = _settings()
+    if command == "fetch":
+        lines = fetch_lines(rows, datasources, step)
+    elif command == "lastupdate":
+        lines = _lastupdate(rows, datasources, step)
+    elif command == "first":
+        lines = ["%d" % START]
+    elif command == "last":
+        lines = ["%d" % (START + rows * step)]
+    elif command in ("create", "update"):
+        lines = []
+    else:
+        return "unknown command '%s'" % command
+
+    for line in lines:
+        out.write(line + "\n")
+    return None
+
+
+def main():
+    if sys.argv[1:] == ["-"]:
+        for line in iter(lambda: sys.stdin.readline(MAX_LINE), ""):
+            error = execute(shlex.split(line), sys.stdout)
+            if error is None:
+                sys.stdout.write("OK u:0.00 s:0.00 r:0.00\n")
+            else:
+                sys.stdout.write("ERROR: %s\n" % error)
+            sys.stdout.flush()
+        return 0
+
+    error = execute(sys.argv[1:], sys.stdout)
+    if error is not None:
+        sys.stderr.write("ERROR: %s\n" % error)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
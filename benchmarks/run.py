@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+"""
+    Benchmarks for thrush. Run from the root of the source tree:
+
+    .. sourcecode:: sh
+
+        python benchmarks/run.py --rrdtool fake --output fake.json
+        python benchmarks/run.py --rrdtool real --output real.json
+
+    With ``--rrdtool fake`` all commands are executed by
+    ``benchmarks/fake_rrdtool.py``, which emits synthetic output of the
+    requested size. With ``--rrdtool real`` the ``rrdtool`` found in
+    ``PATH`` works on files in a temporary directory. The parse
+    benchmark always uses an in-process implementation, so that only
+    the cost of :py:class:`thrush.rrd.RRDFetchResult` is measured.
+
+    The results are written as JSON, a summary is printed to standard
+    error.
+
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import threading
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from thrush import rrd, pipe
+import fake_rrdtool
+
+try:
+    _clock = time.perf_counter
+except AttributeError:
+    _clock = time.time
+
+STEP = 60
+
+
+def _rrd_class(datasources, rows):
+    attrs = {
+        '__module__': __name__,
+        'rra': rrd.Average(xff=0.5, steps=1, rows=rows),
+    }
+    for name in fake_rrdtool.dsnames(datasources):
+        attrs[name] = rrd.Gauge(heartbeat=STEP * 2)
+    return rrd.RRDMeta("Bench%d" % datasources, (rrd.RRD,), attrs)
+
+
+def _statistics(latencies, seconds, operations=None):
+    # the percentiles are calculated like those of the
+    # InstrumentationRecorder, thus both can be compared
+    latencies = sorted(latencies)
+    operations = len(latencies) if operations is None else operations
+    return {
+        'operations': operations,
+        'seconds': seconds,
+        'ops_per_second': operations / seconds if seconds else None,
+        'latency': {
+            'min': latencies[0],
+            'mean': sum(latencies) / len(latencies),
+            'p50': rrd._percentile(latencies, 50),
+            'p90': rrd._percentile(latencies, 90),
+            'p99': rrd._percentile(latencies, 99),
+            'max': latencies[-1],
+        },
+    }
+
+
+def _measure(function, iterations):
+    latencies = []
+    total = _clock()
+    for i in range(iterations):
+        start = _clock()
+        function(i)
+        latencies.append(_clock() - start)
+    return _statistics(latencies, _clock() - total)
+
+
+class InProcessImplementation(object):
+    """
+        An implementation, that returns pregenerated ``fetch`` output
+        without starting any process.
+    """
+    def __init__(self, rows, datasources):
+        self.lines = list(fake_rrdtool.fetch_lines(rows, datasources, STEP))
+
+    def __call__(self, filename, command, options, wait=True):
+        return rrd.RRDLines(self.lines)
+
+
+class Environment(object):
+    """
+        Prepares the executable and the files for a benchmark run.
+    """
+    def __init__(self, mode, implementation):
+        self.mode = mode
+        self.implementation = implementation
+        self.directory = tempfile.mkdtemp(prefix="thrush-bench-")
+        self.binary = "rrdtool"
+        self._pipes = []
+
+        if mode == "fake":
+            self.binary = os.path.join(self.directory, "rrdtool")
+            with open(self.binary, "w") as f:
+                f.write('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (
+                    sys.executable, os.path.join(HERE, "fake_rrdtool.py")
+                ))
+            os.chmod(self.binary, 0o755)
+
+    def configure(self, rows, datasources):
+        os.environ["THRUSH_FAKE_ROWS"] = str(rows)
+        os.environ["THRUSH_FAKE_DS"] = str(datasources)
+        os.environ["THRUSH_FAKE_STEP"] = str(STEP)
+
+    def rrd_class(self, datasources, rows, processes=1):
+        # the implementations keep the environment, thus they are
+        # created after configure() for every class.
+        cls = _rrd_class(datasources, rows)
+        env = dict(os.environ)
+        if self.implementation == "pipe":
+            implementation = pipe.RRDToolPipe(
+                processes, binary=self.binary, env=env
+            )
+            self._pipes.append(implementation)
+        else:
+            implementation = rrd.RRDTool(self.binary, env)
+        cls.add_to_class('_impl', implementation)
+        return cls
+
+    def filename(self, name):
+        return os.path.join(self.directory, name + ".rrd")
+
+    def prepared(self, datasources, rows, processes=1):
+        """
+            Returns a RRD object containing *rows* rows starting at
+            ``fake_rrdtool.START``.
+        """
+        self.configure(rows, datasources)
+        cls = self.rrd_class(datasources, rows, processes)
+        obj = cls(self.filename("fetch-%d-%d" % (datasources, rows)))
+        obj.create(start=fake_rrdtool.START - STEP, step=STEP,
+                   overwrite=True)
+        names = fake_rrdtool.dsnames(datasources)
+        obj.update_many(
+            (fake_rrdtool.START + i * STEP,
+             dict((name, i % 100) for name in names))
+            for i in range(rows)
+        )
+        return obj
+
+    def close(self):
+        for implementation in self._pipes:
+            implementation.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _fetch_all(obj, rows):
+    start = fake_rrdtool.START
+    with obj.fetch("AVERAGE", start, start + (rows - 1) * STEP) as result:
+        for row in result:
+            pass
+
+
+def _fetch_rows(obj):
+    with obj.fetch("AVERAGE") as result:
+        for row in result.rows():
+            pass
+
+
+def bench_commands(env, options):
+    """
+        Latency and throughput of single create, update and fetch
+        commands.
+    """
+    datasources, rows = 4, options.rows
+    env.configure(rows, datasources)
+    cls = env.rrd_class(datasources, rows)
+    names = fake_rrdtool.dsnames(datasources)
+
+    def create(i):
+        cls(env.filename("create-%d" % i)).create(
+            start=fake_rrdtool.START - STEP, step=STEP, overwrite=True
+        )
+
+    obj = cls(env.filename("update"))
+    obj.create(start=fake_rrdtool.START - STEP, step=STEP, overwrite=True)
+
+    def update(i):
+        obj.update(fake_rrdtool.START + i * STEP,
+                   **dict((name, i) for name in names))
+
+    fetched = env.prepared(datasources, rows)
+
+    results = []
+    for command, function in (("create", create), ("update", update),
+                              ("fetch", lambda i: _fetch_all(fetched, rows))):
+        result = _measure(function, options.iterations)
+        result.update({
+            'benchmark': "commands",
+            'command': command,
+            'datasources': datasources,
+            'rows': rows if command == "fetch" else None,
+        })
+        results.append(result)
+    return results
+
+
+def bench_parse(env, options):
+    """
+        Cost of parsing the output of fetch depending on the number of
+        rows and datasources, without any process involved.
+    """
+    results = []
+    for datasources in options.datasources:
+        for rows in options.parse_rows:
+            cls = _rrd_class(datasources, rows)
+            cls.add_to_class(
+                '_impl', InProcessImplementation(rows, datasources)
+            )
+            obj = cls(env.filename("parse"))
+            iterations = max(3, options.iterations * 1000 // rows)
+
+            modes = [
+                ("iterate", lambda i: _fetch_all(obj, rows)),
+                ("rows", lambda i: _fetch_rows(obj)),
+            ]
+            if rrd.numpy is not None:
+                modes.append(
+                    ("to_arrays", lambda i: obj.fetch("AVERAGE").to_arrays())
+                )
+            for mode, function in modes:
+                result = _measure(function, iterations)
+                result.update({
+                    'benchmark': "parse",
+                    'mode': mode,
+                    'datasources': datasources,
+                    'rows': rows,
+                    'rows_per_second': rows * result['ops_per_second'],
+                })
+                results.append(result)
+    return results
+
+
+def bench_contention(env, options):
+    """
+        Throughput of fetch, when several threads share the same
+        implementation.
+    """
+    datasources, rows = 4, options.rows
+    results = []
+    for threads in options.threads:
+        obj = env.prepared(datasources, rows, processes=threads)
+        latencies = [[] for _ in range(threads)]
+        barrier = threading.Event()
+
+        def worker(latencies):
+            barrier.wait()
+            for _ in range(options.iterations):
+                start = _clock()
+                _fetch_all(obj, rows)
+                latencies.append(_clock() - start)
+
+        workers = [threading.Thread(target=worker, args=(latencies[i],))
+                   for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        start = _clock()
+        barrier.set()
+        for thread in workers:
+            thread.join()
+        seconds = _clock() - start
+
+        result = _statistics(sum(latencies, []), seconds)
+        result.update({
+            'benchmark': "contention",
+            'command': "fetch",
+            'threads': threads,
+            'datasources': datasources,
+            'rows': rows,
+        })
+        results.append(result)
+    return results
+
+
+BENCHMARKS = {
+    'commands': bench_commands,
+    'parse': bench_parse,
+    'contention': bench_contention,
+}
+
+
+def _numbers(value):
+    return [int(number) for number in value.split(",")]
+
+
+def _summary(result):
+    parameters = ", ".join(
+        "%s=%s" % (key, result[key])
+        for key in ("command", "mode", "threads", "datasources", "rows")
+        if result.get(key) is not None
+    )
+    return "%-10s %-48s %10.1f ops/s  p50 %8.3f ms  p99 %8.3f ms" % (
+        result['benchmark'], parameters, result['ops_per_second'] or 0,
+        result['latency']['p50'] * 1000, result['latency']['p99'] * 1000
+    )
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="thrush benchmarks")
+    parser.add_argument("--rrdtool", choices=["fake", "real"],
+                        default="fake",
+                        help="execute commands with the fake or the "
+                             "real rrdtool (default: fake)")
+    parser.add_argument("--implementation", choices=["default", "pipe"],
+                        default="default",
+                        help="use the default implementation or "
+                             "thrush.pipe.RRDToolPipe")
+    parser.add_argument("--output", default="-",
+                        help="file for the JSON results (default: stdout)")
+    parser.add_argument("--iterations", type=int, default=50,
+                        help="commands per benchmark and thread")
+    parser.add_argument("--rows", type=int, default=1440,
+                        help="rows fetched by the command benchmarks")
+    parser.add_argument("--parse-rows", type=_numbers,
+                        default=[100, 1000, 10000],
+                        help="comma separated row counts for 'parse'")
+    parser.add_argument("--datasources", type=_numbers, default=[1, 4, 16],
+                        help="comma separated datasource counts for "
+                             "'parse'")
+    parser.add_argument("--threads", type=_numbers, default=[1, 2, 4, 8],
+                        help="comma separated thread counts for "
+                             "'contention'")
+    parser.add_argument("benchmarks", nargs="*",
+                        help="the benchmarks to run: %s (default: all)" %
+                             ", ".join(sorted(BENCHMARKS)))
+    options = parser.parse_args(arguments)
+    for name in options.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark '%s'" % name)
+
+    env = Environment(options.rrdtool, options.implementation)
+    results = []
+    try:
+        for name in options.benchmarks or sorted(BENCHMARKS):
+            for result in BENCHMARKS[name](env, options):
+                sys.stderr.write(_summary(result) + "\n")
+                results.append(result)
+    finally:
+        env.close()
+
+    document = {
+        'meta': {
+            'time': int(time.time()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'rrdtool': options.rrdtool,
+            'implementation': options.implementation,
+            'numpy': rrd.numpy is not None,
+            'iterations': options.iterations,
+        },
+        'results': results,
+    }
+    if options.output == "-":
+        json.dump(document, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        with open(options.output, "w") as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
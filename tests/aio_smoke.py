@@ -0,0 +1,56 @@
+#-*- coding: utf-8 -*-
+
+"""
+    The asyncio part of ``test_smoke``, which requires Python 3.
+
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import asyncio
+
+from thrush import aio
+
+
+def fetch_rows(obj, binary, environ):
+    obj = aio.AsyncRRD(obj, aio.AsyncRRDTool(binary=binary, env=environ))
+
+    async def run():
+        await obj.create(start=1356994740, step=60)
+        await obj.update(1356994800, ds00=1.5)
+        async with await obj.fetch("AVERAGE") as result:
+            return [row async for row in result.rows()]
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+def cancel_slow(obj, binary):
+    # times out a command and drops a partially read result, both
+    # must return the only permit of the implementation.
+    implementation = aio.AsyncRRDTool(concurrency=1, binary=binary)
+    obj = aio.AsyncRRD(obj, implementation)
+
+    async def run():
+        try:
+            await asyncio.wait_for(obj.update(1356994800, ds00=1), 0.2)
+        except asyncio.TimeoutError:
+            pass
+        locked = [implementation._semaphore.locked()]
+
+        result = await obj.fetch("AVERAGE")
+        async for row in result:
+            break
+        del result, row
+        await asyncio.sleep(0.1)
+        locked.append(implementation._semaphore.locked())
+        return locked
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run())
+    finally:
+        loop.close()
@@ -0,0 +1,150 @@
+#-*- coding: utf-8 -*-
+
+"""
+    Runs :py:func:`thrush.aggregate.aggregate` on files of different
+    steps, whose rows are given by an in-process implementation.
+
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import sys
+import math
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from thrush import rrd, aggregate
+
+T = 1356994800
+NAN = float('nan')
+
+# two steps of 300 seconds. the second step of a.rrd has only three
+# of five known rows, c.rrd misses its first row.
+ROWS = {
+    "a.rrd": [(T + 60 * i, value) for i, value in enumerate(
+        [1, 2, 3, 4, 5, 6, NAN, NAN, 8, 10], 1)],
+    "b.rrd": [(T + 300, 10), (T + 600, 20)],
+    "c.rrd": [(T + 300, NAN), (T + 600, 30)],
+    "d.rrd": [(T + 300, 1), (T + 600, 2)],
+}
+
+
+class _Output(rrd.RRDLines):
+    def __init__(self, implementation, lines):
+        super(_Output, self).__init__(lines)
+        self.implementation = implementation
+        self.closed = False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.implementation.running -= 1
+        super(_Output, self).close()
+
+
+class _Fetcher(object):
+    # counts the results, that were fetched but not closed yet
+    def __init__(self, rows=ROWS):
+        self.rows = rows
+        self.fetched = []
+        self.running = self.most = 0
+
+    def __call__(self, filename, command, options, wait=True):
+        self.fetched.append(filename)
+        self.running += 1
+        self.most = max(self.most, self.running)
+        return _Output(self, ["ds00 ds01", ""] + [
+            "%d: %e 0" % row for row in self.rows[filename]
+        ])
+
+
+@unittest.skipIf(rrd.numpy is None, "aggregate() requires numpy")
+class AggregateTest(unittest.TestCase):
+    def setUp(self):
+        self.implementation = _Fetcher()
+        self.cls = cls = rrd.RRDMeta("Test", (rrd.RRD,), {
+            '__module__': __name__,
+            'ds00': rrd.Gauge(heartbeat=120),
+            'ds01': rrd.Gauge(heartbeat=120),
+            'rra': rrd.Average(xff=0.5, steps=1, rows=10),
+        })
+        cls.add_to_class('_impl', self.implementation)
+        self.rrds = [cls(filename) for filename in sorted(ROWS)]
+
+    def aggregate(self, **kwargs):
+        kwargs.setdefault('functions', ("sum", "count"))
+        return [
+            (timestamp, tuple(None if math.isnan(v) else v for v in values))
+            for timestamp, values in aggregate.aggregate(
+                self.rrds, "ds00", "AVERAGE", **kwargs)
+        ]
+
+    def test_grid(self):
+        # the grid has the largest step, rows are consolidated into
+        # the step ending at or after them
+        self.assertEqual(self.aggregate(functions=("sum", "avg", "p50")), [
+            (T + 300, (14.0, 14.0 / 3, 3.0)),
+            (T + 600, (60.0, 15.0, 14.0)),
+        ])
+        self.assertEqual(self.implementation.running, 0)
+
+        self.assertEqual(self.aggregate(step=600), [
+            (T + 600, (4.875 + 15.0 + 30.0 + 1.5, 4.0)),
+        ])
+        self.assertRaises(ValueError, list, aggregate.aggregate(
+            self.rrds, "ds00", "AVERAGE", step=420))
+
+    def test_xff(self):
+        self.assertEqual(self.aggregate(xff=0.5), [
+            (T + 300, (14.0, 3.0)), (T + 600, (60.0, 4.0)),
+        ])
+        # a.rrd has too many unknown rows in the second step
+        self.assertEqual(self.aggregate(xff=0.3), [
+            (T + 300, (14.0, 3.0)), (T + 600, (52.0, 3.0)),
+        ])
+        # a single unknown file is too much, every function is unknown
+        self.assertEqual(self.aggregate(xff=0.2), [
+            (T + 300, (None, None)), (T + 600, (None, None)),
+        ])
+
+    def test_window(self):
+        expected = self.aggregate()
+        self.assertEqual(self.implementation.most, 4)
+
+        # the batches are read completely, thus at most window files
+        # are fetched at the same time
+        for window in (1, 2, 3):
+            self.implementation.most = 0
+            self.assertEqual(self.aggregate(window=window), expected)
+            self.assertEqual(self.implementation.most, window)
+            self.assertEqual(self.implementation.running, 0)
+        self.assertEqual(self.implementation.fetched, sorted(ROWS) * 4)
+        self.assertRaises(ValueError, aggregate.aggregate, self.rrds,
+                          "ds00", "AVERAGE", window=0)
+
+    def test_chunk(self):
+        self.assertEqual(self.aggregate(chunk=1), self.aggregate())
+        self.assertEqual(self.aggregate(chunk=1, window=2),
+                         self.aggregate())
+
+    def test_trailing_unknown(self):
+        # unknown rows at the end are part of the result, like those
+        # in the middle, regardless of the chunks
+        rows = [(T + 60 * i, value) for i, value in enumerate(
+            [1, NAN, 3, NAN, NAN, NAN], 1)]
+        self.implementation.rows = {"a.rrd": rows, "b.rrd": rows}
+        self.rrds = [self.cls("a.rrd"), self.cls("b.rrd")]
+        expected = [
+            (T + 60, (2.0, 2.0)), (T + 120, (None, None)),
+            (T + 180, (6.0, 2.0)), (T + 240, (None, None)),
+            (T + 300, (None, None)), (T + 360, (None, None)),
+        ]
+        for chunk in (1, 2, 4, 6, 1024):
+            self.assertEqual(self.aggregate(chunk=chunk), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+#-*- coding: utf-8 -*-
+
+"""
+    Runs :py:class:`thrush.collection.RRDCollection` in a temporary
+    directory against an implementation, that creates empty files and
+    records the updates.
+
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from thrush import rrd, collection
+
+
+def _touch(filename):
+    with open(filename, "w"):
+        pass
+
+
+class _Files(object):
+    # files in racing are created by someone else just before rrdtool
+    # would create them, files in failing can neither be created nor
+    # updated
+    def __init__(self):
+        self.created = []
+        self.updates = []
+        self.racing = set()
+        self.failing = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, filename, command, options, wait=True):
+        name = os.path.basename(filename)
+        if name in self.failing:
+            raise rrd.RRDError(1, "opening '%s': Permission denied" % name)
+        with self._lock:
+            if command == "create":
+                _touch(filename)
+                if name in self.racing:
+                    raise rrd.RRDError(1, "creating '%s': File exists" % name)
+                self.created.append((name, list(options[:4])))
+            else:
+                samples = options[options.index("--") + 1:]
+                self.updates.append((name, len(samples)))
+        return rrd.RRDLines([])
+
+
+class CollectionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="thrush-test-")
+        self.implementation = _Files()
+        self.cls = rrd.RRDMeta("Test", (rrd.RRD,), {
+            '__module__': __name__,
+            'ds00': rrd.Gauge(heartbeat=120),
+            'rra': rrd.Average(xff=0.5, steps=1, rows=10),
+        })
+        self.cls.add_to_class('_impl', self.implementation)
+        self.collection = collection.RRDCollection(
+            self.cls, self.directory, step=60, concurrency=4)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_path(self):
+        digest = hashlib.md5(b"host1/cpu").hexdigest()
+        self.assertEqual(self.collection.path("host1/cpu"), os.path.join(
+            self.directory, digest[:2], digest[2:4], "host1%2Fcpu.rrd"))
+        self.assertEqual(os.path.basename(self.collection.path("a b%")),
+                         "a%20b%25.rrd")
+
+        flat = collection.RRDCollection(self.cls, self.directory, levels=0)
+        self.assertEqual(flat.path("a/b"),
+                         os.path.join(self.directory, "a%2Fb.rrd"))
+
+        # the keys are restored from the file names
+        for key in ("host1/cpu", "a b%"):
+            self.collection.update(key, 1356994800, ds00=1)
+        other = collection.RRDCollection(self.cls, self.directory)
+        self.assertEqual(other.keys(), ["a b%", "host1/cpu"])
+
+    def test_create(self):
+        self.collection.update("a", 1356994800, ds00=1)
+        self.collection.update("a", 1356994860, ds00=2)
+        self.assertEqual(self.implementation.created, [
+            ("a.rrd", ["--start", "1356994799", "--step", "60"])
+        ])
+        self.assertEqual(self.implementation.updates,
+                         [("a.rrd", 1), ("a.rrd", 1)])
+
+        # files of another process are not created again
+        os.makedirs(os.path.dirname(self.collection.path("b")))
+        _touch(self.collection.path("b"))
+        self.collection.update("b", "N", ds00=1)
+        self.assertEqual(len(self.implementation.created), 1)
+        self.assertEqual(self.implementation.updates[-1], ("b.rrd", 1))
+
+    def test_create_race(self):
+        # the file was created between the check and rrdtool
+        self.implementation.racing.add("a.rrd")
+        self.collection.update("a", 1356994800, ds00=1)
+        self.assertEqual(self.implementation.created, [])
+        self.assertEqual(self.implementation.updates, [("a.rrd", 1)])
+        self.assertEqual(self.collection.keys(), ["a"])
+
+        # a file, that could not be created, is still unknown
+        self.implementation.failing.add("b.rrd")
+        self.assertRaises(rrd.RRDError, self.collection.update, "b",
+                          1356994800, ds00=1)
+        self.assertFalse(os.path.exists(self.collection.path("b")))
+        self.assertEqual(self.collection.keys(), ["a"])
+
+    def test_keys(self):
+        self.assertEqual(self.collection.keys(), [])
+        for key in ("web01/load", "web02/load", "db01/load"):
+            self.collection.update(key, "N", ds00=1)
+        self.assertEqual(self.collection.keys("web*"),
+                         ["web01/load", "web02/load"])
+
+        # files of other processes are found after a refresh
+        path = self.collection.path("web03/load")
+        os.makedirs(os.path.dirname(path))
+        _touch(path)
+        self.assertEqual(len(self.collection.keys("web*")), 2)
+        self.collection.refresh()
+        self.assertEqual(self.collection.keys("web*"),
+                         ["web01/load", "web02/load", "web03/load"])
+
+    def test_update_many(self):
+        self.collection.update_many({
+            "a": [(1356994800, {'ds00': 1}), (1356994860, {'ds00': 2})],
+            "b": [(1356994800, {'ds00': 1})],
+            "c": [],
+        })
+        self.assertEqual(sorted(self.implementation.updates),
+                         [("a.rrd", 2), ("b.rrd", 1)])
+        self.assertEqual(self.collection.keys(), ["a", "b"])
+
+    def test_update_many_errors(self):
+        samples = dict(
+            (key, [(1356994800, {'ds00': 1})]) for key in "abcd"
+        )
+
+        # a single error is raised as it is
+        self.implementation.failing.add("b.rrd")
+        try:
+            self.collection.update_many(samples)
+        except rrd.RRDError as e:
+            self.assertTrue("Permission denied" in e.message)
+            self.assertFalse("files failed" in e.message)
+        else:
+            self.fail("no error raised")
+        self.assertEqual(sorted(self.implementation.updates),
+                         [("a.rrd", 1), ("c.rrd", 1), ("d.rrd", 1)])
+
+        # otherwise the message names every failed key
+        self.implementation.failing.add("d.rrd")
+        try:
+            self.collection.update_many(samples)
+        except rrd.RRDError as e:
+            self.assertTrue(e.message.startswith("2 of 4 files failed: "))
+            failed = sorted(part.split(":")[0] for part in
+                            e.message.split(": ", 1)[1].split("; "))
+            self.assertEqual(failed, ["b", "d"])
+        else:
+            self.fail("no error raised")
+        self.assertEqual(len(self.implementation.updates), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
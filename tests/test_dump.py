@@ -0,0 +1,227 @@
+#-*- coding: utf-8 -*-
+
+"""
+    Runs :py:mod:`thrush.dump` against an implementation, that answers
+    rrdinfo and rrddump like rrdtool 1.4 for a file given as lists.
+
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import sys
+import math
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from thrush import rrd, dump
+
+NAN = float('nan')
+
+# (cf, pdp_per_row, [(timestamp, values)]) of every archive
+ARCHIVES = [
+    ("AVERAGE", 1, [(1356994680 + 60 * i, (float(i), 10.0 * i))
+                    for i in range(3)]),
+    ("MAX", 2, [(1356994560, (NAN, 1.5)), (1356994680, (2.5, NAN))]),
+]
+
+
+def _value(value):
+    return "NaN" if math.isnan(value) else "%0.10e" % value
+
+
+def _info_lines(archives):
+    lines = [
+        'filename = "test.rrd"', 'rrd_version = "0003"', 'step = 60',
+        'last_update = 1356994800',
+    ]
+    for index, name in enumerate(["ds00", "ds01"]):
+        lines += [
+            'ds[%s].index = %d' % (name, index),
+            'ds[%s].type = "GAUGE"' % name,
+        ]
+    for index, (cf, pdp_per_row, rows) in enumerate(archives):
+        lines += [
+            'rra[%d].cf = "%s"' % (index, cf),
+            'rra[%d].rows = %d' % (index, len(rows)),
+            'rra[%d].pdp_per_row = %d' % (index, pdp_per_row),
+        ]
+    return lines
+
+
+def _dump_lines(archives):
+    lines = [
+        '<?xml version="1.0" encoding="utf-8"?>',
+        '<!DOCTYPE rrd SYSTEM "http://oss.oetiker.ch/rrdtool/rrdtool.dtd">',
+        '<!-- Round Robin Database Dump -->',
+        '<rrd>',
+        '\t<version>0003</version>',
+        '\t<step>60</step> <!-- Seconds -->',
+        '\t<lastupdate>1356994800</lastupdate> <!-- 2013-01-01 -->',
+    ]
+    for name in ("ds00", "ds01"):
+        lines += [
+            '\t<ds>', '\t\t<name> %s </name>' % name,
+            '\t\t<type> GAUGE </type>', '\t\t<last_ds> U </last_ds>',
+            '\t</ds>',
+        ]
+    for cf, pdp_per_row, rows in archives:
+        lines += [
+            '\t<rra>', '\t\t<cf>%s</cf>' % cf,
+            '\t\t<pdp_per_row>%d</pdp_per_row> <!-- %d seconds -->' % (
+                pdp_per_row, 60 * pdp_per_row),
+            '\t\t<params><xff>5.0000000000e-01</xff></params>',
+            '\t\t<cdp_prep><ds><value>NaN</value></ds>'
+            '<ds><value>NaN</value></ds></cdp_prep>',
+            '\t\t<database>',
+        ]
+        lines += [
+            '\t\t\t<!-- 2013-01-01 00:00:00 CET / %d --> <row>%s</row>' % (
+                timestamp, "".join("<v>%s</v>" % _value(v) for v in values))
+            for timestamp, values in rows
+        ]
+        lines += ['\t\t</database>', '\t</rra>']
+    lines.append('</rrd>')
+    return lines
+
+
+class _Dumper(object):
+    def __init__(self):
+        self.calls = []
+        self.info = ARCHIVES
+        self.dump = ARCHIVES
+
+    def __call__(self, filename, command, options, wait=True):
+        self.calls.append((filename, command, list(options)))
+        if command == "info":
+            return rrd.RRDLines(_info_lines(self.info))
+        return rrd.RRDLines(_dump_lines(self.dump))
+
+
+def _same(first, second):
+    return len(first) == len(second) and all(
+        a == b or (math.isnan(a) and math.isnan(b))
+        for a, b in zip(first, second)
+    )
+
+
+class DumpTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="thrush-test-")
+        self.implementation = _Dumper()
+        cls = rrd.RRDMeta("Test", (rrd.RRD,), {
+            '__module__': __name__,
+            'ds00': rrd.Gauge(heartbeat=120),
+            'ds01': rrd.Gauge(heartbeat=120),
+            'average': rrd.Average(xff=0.5, steps=1, rows=3),
+            'max': rrd.Max(xff=0.5, steps=2, rows=2),
+        })
+        cls.add_to_class('_impl', self.implementation)
+        self.obj = cls(os.path.join(self.directory, "test.rrd"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class RRDDumpTest(DumpTestCase):
+    def test_rows(self):
+        with self.obj.dump() as result:
+            rows = list(result.rows())
+            self.assertEqual(result.version, "0003")
+            self.assertEqual((result.step, result.last_update),
+                             (60, 1356994800))
+            self.assertEqual(result.dsnames, ["ds00", "ds01"])
+            self.assertEqual(result.rras, [
+                {'cf': "AVERAGE", 'pdp_per_row': 1, 'xff': 0.5},
+                {'cf': "MAX", 'pdp_per_row': 2, 'xff': 0.5},
+            ])
+
+        expected = [
+            (index, timestamp, values)
+            for index, (_, _, archive) in enumerate(ARCHIVES)
+            for timestamp, values in archive
+        ]
+        self.assertEqual(len(rows), len(expected))
+        for row, (index, timestamp, values) in zip(rows, expected):
+            self.assertEqual(row[:2], (index, timestamp))
+            self.assertTrue(_same(row[2], values))
+
+    def test_path(self):
+        path = os.path.join(self.directory, "test.xml")
+        self.assertEqual(self.obj.dump(path), None)
+        self.assertEqual(self.implementation.calls[-1],
+                         (self.obj.filename, "dump", [path]))
+
+    def test_invalid(self):
+        self.implementation.dump = [
+            ("AVERAGE", 1, [(1356994680, (1.0,))]),
+        ]
+        with self.obj.dump() as result:
+            self.assertRaises(rrd.RRDError, list, result.rows())
+
+        result = dump.RRDDump(rrd.RRDLines(["<rrd><step>60</rrd>"]))
+        self.assertRaises(rrd.RRDError, list, result.rows())
+
+
+class ColumnsTest(DumpTestCase):
+    def setUp(self):
+        super(ColumnsTest, self).setUp()
+        self.path = os.path.join(self.directory, "test.columns")
+
+    def test_round_trip(self):
+        for chunk in (1, 2, 4096):
+            self.obj.export_columns(self.path, chunk=chunk)
+            with dump.RRDColumns(self.path) as columns:
+                self.check_columns(columns)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ["test.columns"])
+
+    def check_columns(self, columns):
+        self.assertEqual((columns.step, columns.last_update),
+                         (60, 1356994800))
+        self.assertEqual(columns.dsnames, ["ds00", "ds01"])
+        self.assertEqual(
+            [(archive['cf'], archive['pdp_per_row'], archive['xff'],
+              archive['rows'], archive['start'], archive['step'])
+             for archive in columns.archives],
+            [("AVERAGE", 1, 0.5, 3, 1356994680, 60),
+             ("MAX", 2, 0.5, 2, 1356994560, 120)]
+        )
+
+        for index, (_, _, rows) in enumerate(ARCHIVES):
+            self.assertEqual(list(columns.timestamps(index)),
+                             [timestamp for timestamp, _ in rows])
+            for ds in range(2):
+                values = [values[ds] for _, values in rows]
+                self.assertTrue(_same(columns.column(index, ds), values))
+                self.assertTrue(_same(
+                    columns.column(index, "ds%02d" % ds), values))
+
+        if rrd.numpy is not None:
+            timestamps, values = columns.to_arrays(1)
+            self.assertEqual(list(timestamps), [1356994560, 1356994680])
+            self.assertTrue(_same(list(values["ds01"]), [1.5, NAN]))
+            del timestamps, values
+
+    def test_changed(self):
+        # rows were added to or removed from an archive between info
+        # and dump
+        for archives in ([ARCHIVES[0], ARCHIVES[0]], ARCHIVES[:1], [
+                ARCHIVES[0], ("MAX", 2, ARCHIVES[1][2][:1])]):
+            self.implementation.dump = archives
+            self.assertRaises(rrd.RRDError, self.obj.export_columns,
+                              self.path)
+            self.assertEqual(os.listdir(self.directory), [])
+
+    def test_invalid(self):
+        with open(self.path, "wb") as f:
+            f.write(b"THRUSHC1 but not a columns file")
+        self.assertRaises(ValueError, dump.RRDColumns, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+#-*- coding: utf-8 -*-
+
+"""
+    Runs ``fetch_many`` with threads and with processes against an
+    implementation, whose rows only depend on the file name. The class
+    and the implementation are defined at module level, thus they can
+    be passed to a process pool.
+
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import sys
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from thrush import rrd
+
+T = 1356994800
+
+
+class _Fetcher(object):
+    # files named fail*.rrd cannot be read, files named s*.rrd take
+    # a while
+    def __call__(self, filename, command, options, wait=True):
+        if filename.startswith("fail"):
+            raise rrd.RRDError(1, "opening '%s': No such file" % filename)
+        if filename.startswith("s"):
+            time.sleep(0.2)
+        number = int(filename.split(".")[0][1:])
+        return rrd.RRDLines(["ds00 ds01", ""] + [
+            "%d: %e %s" % (T + 60 * i, number * 10 + i,
+                           "nan" if i == 1 else "%e" % -i)
+            for i in range(number + 1)
+        ])
+
+
+Load = rrd.RRDMeta("Load", (rrd.RRD,), {
+    '__module__': __name__,
+    'ds00': rrd.Gauge(heartbeat=120),
+    'ds01': rrd.Gauge(heartbeat=120),
+    'rra': rrd.Average(xff=0.5, steps=1, rows=10),
+})
+Load.add_to_class('_impl', _Fetcher())
+
+
+def _segments():
+    # the shared memory segments of this process
+    prefix = "thrush-%d-" % os.getpid()
+    try:
+        return [name for name in os.listdir("/dev/shm")
+                if name.startswith(prefix)]
+    except OSError:
+        return []
+
+
+@unittest.skipIf(rrd.numpy is None, "fetch_many() requires numpy")
+class FetchManyTest(unittest.TestCase):
+    filenames = ["f%d.rrd" % i for i in range(5)] + ["f3.rrd"]
+
+    def fetch_many(self, filenames, **kwargs):
+        return sorted(
+            (filename, list(timestamps), dict(
+                (name, [None if v != v else v for v in column])
+                for name, column in values.items()))
+            for filename, timestamps, values in Load.fetch_many(
+                filenames, "AVERAGE", workers=2, **kwargs)
+        )
+
+    def test_threads(self):
+        results = self.fetch_many(self.filenames)
+        self.assertEqual([result[0] for result in results],
+                         sorted(self.filenames))
+        filename, timestamps, values = results[2]
+        self.assertEqual(filename, "f2.rrd")
+        self.assertEqual(timestamps, [T, T + 60, T + 120])
+        self.assertEqual(values, {
+            'ds00': [20.0, 21.0, 22.0], 'ds01': [-0.0, None, -2.0],
+        })
+
+    def test_processes(self):
+        expected = self.fetch_many(self.filenames)
+        self.assertEqual(self.fetch_many(self.filenames, processes=True),
+                         expected)
+        self.assertEqual(_segments(), [])
+
+        # results are pickled without shared memory
+        shared_memory = rrd.shared_memory
+        rrd.shared_memory = None
+        try:
+            self.assertEqual(
+                self.fetch_many(self.filenames, processes=True), expected)
+        finally:
+            rrd.shared_memory = shared_memory
+
+    def test_error(self):
+        filenames = self.filenames[:3] + ["fail.rrd"] + self.filenames[3:]
+        for processes in (False, True):
+            self.assertRaises(rrd.RRDError, self.fetch_many, filenames,
+                              processes=processes)
+
+        results = Load.fetch_many(
+            ["f1.rrd", "fail.rrd", "f2.rrd", "s3.rrd"], "AVERAGE",
+            workers=2, processes=True)
+        next(results)
+        # s3.rrd is fetched after the failure, but its result is never
+        # read
+        time.sleep(0.5)
+        try:
+            list(results)
+        except rrd.RRDError as e:
+            self.assertEqual((e.errorcode, e.message),
+                             (1, "opening 'fail.rrd': No such file"))
+        else:
+            self.fail("no error raised")
+        self.assertEqual(_segments(), [])
+
+
+    @unittest.skipIf(getattr(rrd.shared_memory, '_posixshmem', None) is None,
+                     "requires POSIX shared memory")
+    def test_release_empty(self):
+        # a worker terminated between creating and sizing its segment
+        # leaves an empty one, that cannot be mapped
+        posixshmem = rrd.shared_memory._posixshmem
+        segment = "thrush-%d-empty" % os.getpid()
+        os.close(posixshmem.shm_open("/" + segment,
+                                     os.O_CREAT | os.O_EXCL | os.O_RDWR,
+                                     mode=0o600))
+        self.assertEqual(_segments(), [segment])
+        rrd._release_segment(segment)
+        self.assertEqual(_segments(), [])
+        rrd._release_segment(segment)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+#-*- coding: utf-8 -*-
+
+"""
+    Runs :py:func:`thrush.follow.follow` against an implementation,
+    that answers rrdlastupdate and rrdfetch from rows in memory.
+
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import sys
+import tempfile
+import itertools
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from thrush import rrd, follow
+
+T = 1356994800
+
+
+class _Source(object):
+    # every file has a row per minute up to its last update. fetch also
+    # returns the unknown row after it, like rrdtool does for an end
+    # within the current step. with growing set, every lastupdate
+    # adds a row first.
+    def __init__(self):
+        self.last = {}
+        self.calls = []
+        self.growing = False
+
+    def __call__(self, filename, command, options, wait=True):
+        self.calls.append((filename, command))
+        last = self.last[filename]
+        if command == "lastupdate":
+            if self.growing:
+                last = self.last[filename] = last + 60
+            return rrd.RRDLines(["ds00", "", "%d: %d" % (last, last - T)])
+
+        start = int(options[options.index("--start") + 1])
+        start -= start % 60
+        return rrd.RRDLines(["ds00", ""] + [
+            "%d: %s" % (timestamp, "nan" if timestamp > last
+                        else "%e" % (timestamp - T))
+            for timestamp in range(start + 60, last + 120, 60)
+        ])
+
+
+class _Signatures(dict):
+    # a missing signature is a missing file
+    def __call__(self, filename):
+        try:
+            return self[filename]
+        except KeyError:
+            raise OSError(2, "No such file or directory")
+
+
+class FollowTest(unittest.TestCase):
+    def setUp(self):
+        self.implementation = _Source()
+        self.implementation.last["a.rrd"] = T
+        self.signatures = _Signatures({"a.rrd": 1})
+        self.cls = rrd.RRDMeta("Test", (rrd.RRD,), {
+            '__module__': __name__,
+            'ds00': rrd.Gauge(heartbeat=120),
+            'rra': rrd.Average(xff=0.5, steps=1, rows=10),
+        })
+        self.cls.add_to_class('_impl', self.implementation)
+
+    def follower(self, filename="a.rrd", start=None, signature=None):
+        return follow._Follower(self.cls(filename), "AVERAGE", None, start,
+                                None, signature or self.signatures)
+
+    def advance(self, filename="a.rrd", rows=1):
+        self.implementation.last[filename] += 60 * rows
+        self.signatures[filename] = self.signatures.get(filename, 0) + 1
+
+    def test_position(self):
+        follower = self.follower()
+        # the first poll only finds the current position
+        self.assertEqual(follower.poll(), [])
+        self.assertEqual(follower.position, T)
+
+        self.advance(rows=2)
+        self.assertEqual(follower.poll(),
+                         [(T + 60, (60.0,)), (T + 120, (120.0,))])
+        self.assertEqual(follower.position, T + 120)
+        self.advance()
+        self.assertEqual(follower.poll(), [(T + 180, (180.0,))])
+
+        follower = self.follower(start=T - 120)
+        self.assertEqual([timestamp for timestamp, _ in follower.poll()],
+                         [T - 60, T, T + 60, T + 120, T + 180])
+
+    def test_unchanged(self):
+        follower = self.follower()
+        follower.poll()
+        self.advance()
+        follower.poll()
+        calls = len(self.implementation.calls)
+
+        # the file did not change, rrdtool is not executed
+        self.assertEqual(follower.poll(), [])
+        self.assertEqual(len(self.implementation.calls), calls)
+
+        # the file changed, but not its last update
+        self.signatures["a.rrd"] += 1
+        self.assertEqual(follower.poll(), [])
+        self.assertEqual(self.implementation.calls[calls:],
+                         [("a.rrd", "lastupdate")])
+
+    def test_missing(self):
+        follower = self.follower("b.rrd")
+        self.assertEqual(follower.poll(), [])
+        self.implementation.last["b.rrd"] = T
+        self.advance("b.rrd")
+        self.assertEqual(follower.poll(), [])
+        self.advance("b.rrd")
+        self.assertEqual(follower.poll(), [(T + 120, (120.0,))])
+
+        # without signatures the existence of the file is checked and
+        # the last update is read on every poll
+        follower = follow._Follower(self.cls("c.rrd"), "AVERAGE", None,
+                                    None, None, None)
+        calls = len(self.implementation.calls)
+        self.assertEqual(follower.poll(), [])
+        self.assertEqual(len(self.implementation.calls), calls)
+
+        with tempfile.NamedTemporaryFile(suffix=".rrd") as f:
+            self.implementation.last[f.name] = T
+            follower = follow._Follower(self.cls(f.name), "AVERAGE", None,
+                                        None, None, None)
+            for _ in range(3):
+                self.assertEqual(follower.poll(), [])
+            self.assertEqual(self.implementation.calls[calls:],
+                             [(f.name, "lastupdate")] * 3)
+
+    def test_stop(self):
+        self.implementation.last["b.rrd"] = T
+        self.implementation.growing = True
+        signature = lambda filename: len(self.implementation.calls)
+        rows = follow.follow([self.cls("a.rrd"), self.cls("b.rrd")],
+                             "AVERAGE", interval=0.01, signature=signature)
+        first = [(obj.filename, timestamp, values)
+                 for obj, timestamp, values in itertools.islice(rows, 6)]
+
+        # every row is returned once, in the order of the polls
+        self.assertEqual(first, [
+            (filename, T + 60 * i, (60.0 * i,))
+            for i in (2, 3, 4) for filename in ("a.rrd", "b.rrd")
+        ])
+
+        # stopping the iteration stops the polls
+        rows.close()
+        calls = len(self.implementation.calls)
+        self.assertRaises(StopIteration, next, rows)
+        self.assertEqual(len(self.implementation.calls), calls)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+#-*- coding: utf-8 -*-
+
+"""
+    Renders graphs with an implementation, that records the arguments
+    of rrdgraph and writes them into the image.
+
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from thrush import rrd, graphcache
+
+
+class _Renderer(object):
+    def __init__(self):
+        self.calls = []
+        self.event = threading.Event()
+        self.event.set()
+        self._lock = threading.Lock()
+
+    def __call__(self, filename, command, options, wait=True):
+        with self._lock:
+            self.calls.append((filename, command, list(options)))
+        self.event.wait()
+        with open(filename, "w") as f:
+            f.write(" ".join(options))
+        return rrd.RRDLines([])
+
+
+class GraphTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="thrush-test-")
+        self.implementation = _Renderer()
+        self.cls = rrd.RRDMeta("Load", (rrd.RRD,), {
+            '__module__': __name__,
+            'ds00': rrd.Gauge(heartbeat=120),
+            'ds01': rrd.Gauge(heartbeat=120),
+            'rra': rrd.Average(xff=0.5, steps=1, rows=10),
+        })
+        self.cls.add_to_class('_impl', self.implementation)
+        self.obj = self.cls("host:1.rrd")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class GraphTest(GraphTestCase):
+    def test_elements(self):
+        path = os.path.join(self.directory, "load.png")
+        cls = self.cls
+        self.assertEqual(self.obj.graph(path, [
+            rrd.Line(cls.ds00, "#ff0000", width=2, legend="load: 1m"),
+            rrd.Area(cls.ds01, "#00ff00"),
+            rrd.Area(cls.ds00, "#0000ff", legend="again", stack=True),
+        ], cf=cls.rra, start=1356991200, end=1356994800, title="Load",
+            arguments=["--lower-limit", 0]), path)
+
+        filename, command, options = self.implementation.calls[0]
+        self.assertEqual((filename, command), (path, "graph"))
+        self.assertEqual(options, [
+            "--start", "1356991200", "--end", "1356994800",
+            "--imgformat", "PNG", "--title", "Load", "--lower-limit", "0",
+            "DEF:ds00=host\\:1.rrd:ds00:AVERAGE",
+            "DEF:ds01=host\\:1.rrd:ds01:AVERAGE",
+            "LINE2:ds00#ff0000:load\\: 1m",
+            "AREA:ds01#00ff00",
+            "AREA:ds00#0000ff:again:STACK",
+        ])
+
+    def test_defaults(self):
+        self.obj.graph(os.path.join(self.directory, "load.svg"), cf="MAX",
+                       width=400, height=100, imgformat="SVG")
+        options = self.implementation.calls[0][2]
+        self.assertEqual(options[:10], [
+            "--start", "end-1day", "--end", "now", "--imgformat", "SVG",
+            "--width", "400", "--height", "100",
+        ])
+        self.assertEqual(options[10:], [
+            "DEF:ds00=host\\:1.rrd:ds00:MAX",
+            "DEF:ds01=host\\:1.rrd:ds01:MAX",
+            "LINE1:ds00#0000ff", "LINE1:ds01#00aa00",
+        ])
+
+    def test_invalid(self):
+        other = rrd.Gauge(heartbeat=120)
+        other.name = "other"
+        self.assertRaises(ValueError, self.obj.graph, "load.png",
+                          [rrd.Line(other)])
+        # without a cache the image has to be written somewhere
+        self.assertRaises(ValueError, self.obj.graph)
+        self.assertEqual(self.implementation.calls, [])
+
+
+class GraphCacheTest(GraphTestCase):
+    def setUp(self):
+        super(GraphCacheTest, self).setUp()
+        self.signatures = {self.obj.filename: 1}
+        self.cache = graphcache.GraphCache(
+            os.path.join(self.directory, "cache"), entries=2,
+            signature=self.signatures.get
+        )
+        os.mkdir(self.cache.directory)
+        self.cls.add_to_class('_graph_cache', self.cache)
+
+    def test_hit_and_invalidation(self):
+        path = self.obj.graph(start="end-1h")
+        self.assertEqual(os.path.dirname(path), self.cache.directory)
+        self.assertTrue(path.endswith(".png"))
+        self.assertEqual(self.obj.graph(start="end-1h"), path)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(len(self.implementation.calls), 1)
+
+        # the image is copied to the requested file
+        copy = os.path.join(self.directory, "copy.png")
+        self.assertEqual(self.obj.graph(copy, start="end-1h"), copy)
+        with open(copy) as f:
+            self.assertTrue("DEF:ds00" in f.read())
+        self.assertEqual(self.cache.hits, 2)
+
+        self.signatures[self.obj.filename] = 2
+        self.assertNotEqual(self.obj.graph(start="end-1h"), path)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+        self.cache.clear()
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    def test_concurrent(self):
+        self.implementation.event.clear()
+        paths = []
+
+        def graph():
+            paths.append(self.obj.graph(title="shared"))
+        threads = [threading.Thread(target=graph) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        deadline = time.time() + 5
+        while not self.implementation.calls and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        self.implementation.event.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(self.implementation.calls), 1)
+        self.assertEqual(len(set(paths)), 1)
+        self.assertEqual(len(paths), 5)
+        self.assertEqual((self.cache.hits, self.cache.misses), (4, 1))
+
+    def test_eviction(self):
+        first = self.obj.graph(title="first")
+        second = self.obj.graph(title="second")
+        # the mtime tells the last use
+        os.utime(first, (1000, 1000))
+        os.utime(second, (2000, 2000))
+        third = self.obj.graph(title="third")
+        self.assertEqual(sorted(os.listdir(self.cache.directory)), sorted(
+            os.path.basename(path) for path in (second, third)))
+
+        # a hit counts as use
+        os.utime(third, (3000, 3000))
+        self.obj.graph(title="second")
+        self.obj.graph(title="fourth")
+        self.assertFalse(os.path.exists(third))
+        self.assertTrue(os.path.exists(second))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+#-*- coding: utf-8 -*-
+
+"""
+    Runs :py:mod:`thrush.info` against an implementation, that answers
+    like rrdinfo 1.4 for files in a temporary directory.
+
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import sys
+import math
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from thrush import rrd, info
+
+INFO = [
+    'filename = "test.rrd"',
+    'rrd_version = "0003"',
+    'step = 60',
+    'last_update = 1356994800',
+    'header_size = 1412',
+    'ds[ds00].index = 0',
+    'ds[ds00].type = "GAUGE"',
+    'ds[ds00].minimal_heartbeat = 120',
+    'ds[ds00].min = NaN',
+    'ds[ds00].max = 1.0000000000e+02',
+    'ds[ds00].last_ds = "U"',
+    'ds[ds00].value = 0.0000000000e+00',
+    'ds[ds00].unknown_sec = 0',
+    'ds[ds01].index = 1',
+    'ds[ds01].type = "COUNTER"',
+    'ds[ds01].minimal_heartbeat = 120',
+    'ds[ds01].min = 0.0000000000e+00',
+    'ds[ds01].max = NaN',
+    'rra[0].cf = "AVERAGE"',
+    'rra[0].rows = 10',
+    'rra[0].cur_row = 3',
+    'rra[0].pdp_per_row = 1',
+    'rra[0].xff = 5.0000000000e-01',
+    'rra[0].cdp_prep[0].value = NaN',
+    'rra[0].cdp_prep[0].unknown_datapoints = 0',
+    'rra[0].cdp_prep[1].value = 1.5000000000e+00',
+    'rra[0].cdp_prep[1].unknown_datapoints = 2',
+    'rra[1].cf = "MAX"',
+    'rra[1].rows = 24',
+    'rra[1].cur_row = 0',
+    'rra[1].pdp_per_row = 60',
+    'rra[1].xff = 5.0000000000e-01',
+]
+
+
+class _Info(object):
+    def __init__(self):
+        self.lines = INFO
+        self.calls = 0
+
+    def __call__(self, filename, command, options, wait=True):
+        self.calls += 1
+        return rrd.RRDLines(self.lines)
+
+
+class InfoTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="thrush-test-")
+        self.implementation = _Info()
+        self.cls = rrd.RRDMeta("Test", (rrd.RRD,), {
+            '__module__': __name__,
+            'ds00': rrd.Gauge(heartbeat=120, max=100),
+            'ds01': rrd.Counter(heartbeat=120, min=0),
+            'average': rrd.Average(xff=0.5, steps=1, rows=10),
+            'max': rrd.Max(xff=0.5, steps=60, rows=24),
+        })
+        self.cls.add_to_class('_impl', self.implementation)
+        self.path = os.path.join(self.directory, "test.rrd")
+        with open(self.path, "w"):
+            pass
+        info._info_cache.clear()
+
+    def tearDown(self):
+        info._info_cache.clear()
+        shutil.rmtree(self.directory)
+
+    def test_parse(self):
+        result = self.cls(self.path).info()
+        self.assertEqual((result.version, result.step, result.last_update,
+                          result.header_size), ("0003", 60, 1356994800, 1412))
+        self.assertEqual(result.dsnames, ["ds00", "ds01"])
+
+        ds00 = result.datasources["ds00"]
+        self.assertEqual((ds00['type'], ds00['minimal_heartbeat'],
+                          ds00['max'], ds00['last_ds']),
+                         ("GAUGE", 120, 100.0, "U"))
+        self.assertTrue(math.isnan(ds00['min']))
+
+        self.assertEqual([(rra['cf'], rra['rows'], rra['pdp_per_row'])
+                          for rra in result.rras],
+                         [("AVERAGE", 10, 1), ("MAX", 24, 60)])
+        cdp_prep = result.rras[0]['cdp_prep']
+        self.assertTrue(math.isnan(cdp_prep[0]['value']))
+        self.assertEqual(cdp_prep[1], {'value': 1.5,
+                                       'unknown_datapoints': 2})
+        self.assertEqual(result.values['rra']['1']['xff'], 0.5)
+
+    def test_indexes(self):
+        # archives are ordered by the number of their index, lines
+        # without a value are skipped
+        result = info.RRDInfo(info._parse_info([
+            'rra[10].cf = "MAX"', 'rra[2].cf = "MIN"', '',
+            'rra[0].cf = "AVERAGE"',
+        ]))
+        self.assertEqual([rra['cf'] for rra in result.rras],
+                         ["AVERAGE", "MIN", "MAX"])
+
+    def test_verify(self):
+        obj = self.cls(self.path)
+        self.assertTrue(obj.verify() is obj.info())
+        self.assertEqual(self.implementation.calls, 1)
+
+        class Other(rrd.RRD):
+            ds00 = rrd.Gauge(heartbeat=300, max=100)
+            ds02 = rrd.Gauge(heartbeat=120)
+            average = rrd.Min(xff=0.5, steps=1, rows=10)
+        Other.add_to_class('_impl', self.implementation)
+
+        try:
+            Other(self.path).verify()
+        except rrd.RRDSchemaError as e:
+            self.assertEqual(e.differences, [
+                "minimal_heartbeat of datasource 'ds00' is 120 instead "
+                "of 300",
+                "datasource 'ds02' is missing",
+                "datasource 'ds01' is not declared",
+                "file has 2 archives instead of 1",
+                "cf of archive 0 is AVERAGE instead of MIN",
+            ])
+            self.assertTrue(self.path in e.message)
+        else:
+            self.fail("no error raised")
+
+    def test_cache(self):
+        obj = self.cls(self.path)
+        first = obj.info()
+        self.assertTrue(obj.info() is first)
+        self.assertTrue(self.cls(self.path).info() is first)
+        self.assertEqual(self.implementation.calls, 1)
+
+        # the file was written
+        os.utime(self.path, (1356994860, 1356994860))
+        second = obj.info()
+        self.assertFalse(second is first)
+        self.assertEqual(self.implementation.calls, 2)
+        self.assertTrue(obj.info() is second)
+
+        # files that cannot be found are never cached
+        missing = self.cls(os.path.join(self.directory, "missing.rrd"))
+        missing.info()
+        missing.info()
+        self.assertEqual(self.implementation.calls, 4)
+        self.assertFalse(missing.filename in info._info_cache)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,366 @@
+#-*- coding: utf-8 -*-
+
+"""
+    Reads RRD files, that are built byte by byte like rrdcreate and
+    rrdupdate write them on the common platforms, with
+    :py:mod:`thrush.native`.
+
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import sys
+import math
+import shutil
+import struct
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from thrush import rrd, native
+
+# (byte order, alignment of doubles, size of long)
+X86_64 = ('<', 8, 8)
+I386 = ('<', 4, 4)
+PPC64 = ('>', 8, 8)
+
+LAST_UPDATE = 1356994830
+
+
+class _Image(object):
+    # writes the structs of rrd_format.h, padding every field to its
+    # natural alignment like the compiler does
+    def __init__(self, layout):
+        self.order, self.alignment, self.word = layout
+        self.data = bytearray()
+        self.offsets = {}
+
+    def pad(self, alignment):
+        self.data += b'\0' * (-len(self.data) % alignment)
+
+    def mark(self, name):
+        self.offsets.setdefault(name, []).append(len(self.data))
+
+    def chars(self, text, size):
+        self.data += text.encode('ascii').ljust(size, b'\0')
+
+    def long(self, value):
+        self.pad(self.word)
+        self.data += struct.pack(
+            self.order + ('Q' if self.word == 8 else 'I'), value
+        )
+
+    def double(self, value):
+        self.pad(self.alignment)
+        self.data += struct.pack(self.order + 'd', value)
+
+    def unival(self, count=10, values=()):
+        # an array of unions of unsigned long and double
+        self.pad(self.alignment)
+        for i in range(count):
+            start = len(self.data)
+            if i < len(values):
+                kind, value = values[i]
+                if kind == 'd':
+                    self.double(value)
+                else:
+                    self.long(value)
+            self.data += b'\0' * (start + 8 - len(self.data))
+        self.pad(self.alignment)
+
+
+def build(layout=X86_64, version="0003", step=60, last_update=LAST_UPDATE,
+          rras=(("AVERAGE", 1, 5, 2), ("AVERAGE", 5, 4, 0),
+                ("MAX", 1, 5, 4))):
+    """
+        Returns the image of a file with the datasources ``a`` and
+        ``b`` and the given archives ``(cf, pdp_per_row, rows,
+        cur_row)``. Row *i* of an archive holds the values ``(i + 1,
+        10 * (i + 1))``.
+    """
+    image = _Image(layout)
+    image.chars("RRD", 4)
+    image.chars(version, 5)
+    image.double(native._FLOAT_COOKIE)
+    image.long(2)
+    image.long(len(rras))
+    image.long(step)
+    image.unival()
+
+    for name, minimum in (("a", float('nan')), ("b", 0.0)):
+        image.chars(name, 20)
+        image.chars("GAUGE", 20)
+        image.unival(values=[('L', 2 * step), ('d', minimum),
+                             ('d', float('nan'))])
+
+    for cf, pdp_per_row, rows, cur_row in rras:
+        image.chars(cf, 20)
+        image.long(rows)
+        image.long(pdp_per_row)
+        image.unival(values=[('d', 0.5)])
+
+    image.mark('live_head')
+    image.long(last_update)
+    if version >= "0003":
+        image.long(0)
+
+    for last_ds in ("1.5", "U"):
+        image.mark('pdp_prep')
+        image.chars(last_ds, 30)
+        image.unival(values=[('L', last_update % step)])
+
+    for r in range(len(rras)):
+        for i in range(2):
+            image.mark('cdp_prep')
+            image.unival(values=[('d', r + i / 10.0), ('L', 0)])
+
+    for cf, pdp_per_row, rows, cur_row in rras:
+        image.mark('rra_ptr')
+        image.long(cur_row)
+
+    for cf, pdp_per_row, rows, cur_row in rras:
+        for i in range(rows):
+            image.double(i + 1)
+            image.double(10 * (i + 1))
+    return image
+
+
+class NativeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="thrush-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, image, name="test.rrd"):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(bytes(image.data))
+        return path
+
+
+class RRDFileTest(NativeTestCase):
+    def check_header(self, layout, version="0003"):
+        path = self.write(build(layout, version))
+        with native.RRDFile(path) as f:
+            self.assertEqual(f._layout_info, layout)
+            self.assertEqual(f.version, int(version))
+            self.assertEqual((f.ds_cnt, f.rra_cnt, f.pdp_step), (2, 3, 60))
+            self.assertEqual(f.dsnames, ["a", "b"])
+            self.assertEqual(f.datasources[0]['type'], "GAUGE")
+            self.assertEqual(f.datasources[1]['minimal_heartbeat'], 120)
+            self.assertTrue(math.isnan(f.datasources[0]['min']))
+            self.assertEqual(f.datasources[1]['min'], 0.0)
+            self.assertEqual(
+                [(r['cf'], r['pdp_per_row'], r['rows'], r['cur_row'])
+                 for r in f.rras],
+                [("AVERAGE", 1, 5, 2), ("AVERAGE", 5, 4, 0),
+                 ("MAX", 1, 5, 4)]
+            )
+            self.assertEqual(f.rras[0]['xff'], 0.5)
+            self.assertEqual(f.rras[2]['cdp_prep'], [2.0, 2.1])
+            self.assertEqual(f.last_update, LAST_UPDATE)
+            self.assertEqual(f.last_ds, ["1.5", "U"])
+            self.assertEqual(f.header_size, len(build(layout, version).data)
+                             - (5 + 4 + 5) * 16)
+
+    def test_x86_64(self):
+        self.check_header(X86_64)
+
+    def test_i386(self):
+        self.check_header(I386)
+
+    def test_big_endian(self):
+        self.check_header(PPC64)
+
+    def test_version_1(self):
+        self.check_header(X86_64, "0001")
+        self.check_header(I386, "0001")
+
+    def test_invalid(self):
+        image = build()
+        image.data[0:3] = b"XYZ"
+        self.assertRaises(rrd.RRDError, native.RRDFile, self.write(image))
+
+        image = build()
+        del image.data[-8:]
+        self.assertRaises(rrd.RRDError, native.RRDFile, self.write(image))
+
+    def test_first(self):
+        with native.RRDFile(self.write(build())) as f:
+            # the last update is aligned to the step of each archive
+            self.assertEqual(f.first(0), 1356994800 - 4 * 60)
+            self.assertEqual(f.first(1), 1356994800 - 3 * 300)
+            self.assertRaises(rrd.RRDError, f.first, 3)
+
+    def test_row(self):
+        with native.RRDFile(self.write(build())) as f:
+            # cur_row 2 is the newest row, the one after it the oldest
+            self.assertEqual(f.row(0, 1356994800), (3.0, 30.0))
+            self.assertEqual(f.row(0, 1356994740), (2.0, 20.0))
+            self.assertEqual(f.row(0, 1356994680), (1.0, 10.0))
+            self.assertEqual(f.row(0, 1356994620), (5.0, 50.0))
+            self.assertEqual(f.row(0, 1356994560), (4.0, 40.0))
+            self.assertEqual(f.row(0, 1356994500), None)
+            self.assertEqual(f.row(0, 1356994860), None)
+            self.assertEqual(f.row(0, 1356994790), None)
+            self.assertEqual(f.row(1, 1356994800), (1.0, 10.0))
+            self.assertEqual(f.row(1, 1356994500), (4.0, 40.0))
+            self.assertEqual(f.row(2, 1356994800), (5.0, 50.0))
+
+    def test_choose(self):
+        with native.RRDFile(self.write(build())) as f:
+            self.assertEqual(f.choose("AVERAGE", 1356994560, 1356994800), 0)
+            # the step closest to the resolution
+            self.assertEqual(
+                f.choose("AVERAGE", 1356994560, 1356994800, 300), 1
+            )
+            # only the second archive covers the range
+            self.assertEqual(f.choose("AVERAGE", 1356993700, 1356994800), 1)
+            # neither covers it, the second covers more of it
+            self.assertEqual(f.choose("AVERAGE", 1356990000, 1356994800), 1)
+            # equal parts are decided by the resolution
+            self.assertEqual(f.choose("AVERAGE", 1356995000, 1356995100), 0)
+            self.assertEqual(
+                f.choose("AVERAGE", 1356995000, 1356995100, 300), 1
+            )
+            self.assertEqual(f.choose("MAX", 1356994560, 1356994800), 2)
+            self.assertRaises(rrd.RRDError, f.choose, "MIN", 0, 1)
+
+    def test_fetch(self):
+        with native.RRDFile(self.write(build())) as f:
+            start, end, step, rows = f.fetch("average", 1356994570,
+                                             1356994790)
+            self.assertEqual((start, end, step), (1356994560, 1356994800, 60))
+            self.assertEqual(list(rows), [
+                (1356994620, (5.0, 50.0)), (1356994680, (1.0, 10.0)),
+                (1356994740, (2.0, 20.0)), (1356994800, (3.0, 30.0)),
+            ])
+
+            # rrdfetch extends an aligned end by one step, rows that
+            # are not covered by the archive are unknown
+            start, end, step, rows = f.fetch("AVERAGE", 1356994500,
+                                             1356994800)
+            rows = list(rows)
+            self.assertEqual((start, end), (1356994500, 1356994860))
+            self.assertEqual([row[0] for row in rows],
+                             list(range(1356994560, 1356994920, 60)))
+            self.assertEqual(rows[0][1], (4.0, 40.0))
+            self.assertTrue(all(math.isnan(v) for v in rows[-1][1]))
+
+            start, end, step, rows = f.fetch("AVERAGE", 1356993600,
+                                             1356994800)
+            self.assertEqual(step, 300)
+            self.assertEqual(list(rows)[:2], [
+                (1356993900, (2.0, 20.0)), (1356994200, (3.0, 30.0)),
+            ])
+            self.assertRaises(rrd.RRDError, f.fetch, "AVERAGE", 2, 1)
+
+
+class Template(rrd.RRD):
+    a = rrd.Gauge(heartbeat=120)
+    b = rrd.Gauge(heartbeat=120, min=0)
+    rra = rrd.Average(xff=0.5, steps=1, rows=5)
+
+
+class CloneTest(NativeTestCase):
+    # create_many() clones the template of the class, that is usually
+    # created by rrdtool, and patches its header
+    def setUp(self):
+        super(CloneTest, self).setUp()
+        self.image = build()
+        rrd._templates[(Template, 60)] = self.write(self.image, "template")
+
+    def tearDown(self):
+        rrd._templates.pop((Template, 60), None)
+        super(CloneTest, self).tearDown()
+
+    def read_long(self, f, offset):
+        return struct.unpack_from("<Q", f._map, offset)[0]
+
+    def test_patches(self):
+        paths = [os.path.join(self.directory, "%d.rrd" % i)
+                 for i in range(20)]
+        Template.create_many(paths, start=1356994950, step=60)
+
+        rows = set()
+        for path in paths:
+            with native.RRDFile(path) as f:
+                self.assertEqual(f.last_update, 1356994950)
+                self.assertEqual(
+                    self.read_long(f, self.image.offsets['live_head'][0] + 8),
+                    0
+                )
+                # the seconds of the current step before the start
+                for offset in self.image.offsets['pdp_prep']:
+                    self.assertEqual(self.read_long(f, offset + 32), 30)
+                # the steps of the current row of each archive before
+                # the start, which is 1356994920 - 120 for 5 steps
+                self.assertEqual([
+                    self.read_long(f, offset + 8)
+                    for offset in self.image.offsets['cdp_prep']
+                ], [0, 0, 2, 2, 0, 0])
+                for rra in f.rras:
+                    self.assertTrue(0 <= rra['cur_row'] < rra['rows'])
+                rows.add(tuple(rra['cur_row'] for rra in f.rras))
+        # every file starts at a random row
+        self.assertTrue(len(rows) > 1)
+
+    def test_overwrite(self):
+        existing = os.path.join(self.directory, "existing.rrd")
+        created = os.path.join(self.directory, "created.rrd")
+        with open(existing, "wb") as f:
+            f.write(b"existing")
+
+        self.assertRaises(rrd.RRDError, Template.create_many,
+                          [existing, created], start=1356994950, step=60)
+        with open(existing, "rb") as f:
+            self.assertEqual(f.read(), b"existing")
+        with native.RRDFile(created) as f:
+            self.assertEqual(f.last_update, 1356994950)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ["created.rrd", "existing.rrd", "template"])
+
+        Template.create_many([existing], start=1356994950, step=60,
+                             overwrite=True)
+        with native.RRDFile(existing) as f:
+            self.assertEqual(f.last_update, 1356994950)
+
+
+class NativeReaderTest(NativeTestCase):
+    def setUp(self):
+        super(NativeReaderTest, self).setUp()
+        self.path = self.write(build())
+        self.reader = native.NativeReader(fallback=None)
+
+    def test_fetch(self):
+        lines = list(self.reader(self.path, "fetch", [
+            "AVERAGE", "--start", "1356994680", "--end", "1356994740"
+        ]))
+        self.assertEqual(lines, [
+            "%20s%20s" % ("a", "b"), "",
+            "1356994740: 2.0000000000e+00 2.0000000000e+01",
+            "1356994800: 3.0000000000e+00 3.0000000000e+01",
+        ])
+
+    def test_first_and_last(self):
+        output = self.reader(self.path, "first", ["--rraindex", "1"])
+        self.assertEqual(output.readline(), "1356993900\n")
+        output = self.reader(self.path, "last", [])
+        self.assertEqual(output.readline(), "%d\n" % LAST_UPDATE)
+        self.assertEqual(list(self.reader(self.path, "lastupdate", [])), [
+            " a b", "", "%d: 1.5 U" % LAST_UPDATE
+        ])
+
+    def test_unsupported(self):
+        self.assertRaises(rrd.RRDError, self.reader, self.path, "fetch",
+                          ["AVERAGE", "--align-start"])
+        self.assertRaises(rrd.RRDError, self.reader, self.path, "update",
+                          ["N:1:2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,745 @@
+#-*- coding: utf-8 -*-
+
+"""
+    Tests the parts of :py:mod:`thrush.rrd`, that do not depend on the
+    output of rrdtool, with implementations that record their calls.
+
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import sys
+import time
+import math
+import array
+import datetime
+import shutil
+import locale
+import tempfile
+import threading
+import subprocess
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from thrush import rrd, xport
+
+
+class _Recorder(object):
+    # answers every fetch with two rows of the requested range
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, filename, command, options, wait=True):
+        self.calls.append((filename, command, list(options)))
+        end = options[options.index("--end") + 1]
+        end = int(end) if end.isdigit() else 1356994800
+        return rrd.RRDLines([
+            "                ds00", "",
+            "%d: 1.0000000000e+00" % (end - 60),
+            "%d: 2.0000000000e+00" % end,
+        ])
+
+
+class _Writer(object):
+    # records the samples of every update. updates of the files in
+    # failing are rejected, all updates wait for the event.
+    def __init__(self):
+        self.updates = []
+        self.failing = set()
+        self.event = threading.Event()
+        self.event.set()
+
+    def __call__(self, filename, command, options, wait=True):
+        self.event.wait()
+        if filename in self.failing:
+            raise rrd.RRDError(1, "illegal attempt to update")
+        samples = options[options.index("--") + 1:]
+        self.updates.append((filename, [int(s.split(":")[0])
+                                        for s in samples]))
+        return rrd.RRDLines([])
+
+
+class _Commands(object):
+    # answers update, fetch and xport, every other command fails
+    def __call__(self, filename, command, options, wait=True):
+        if command == "update":
+            return rrd.RRDLines([])
+        if command == "fetch":
+            return rrd.RRDLines([
+                "ds00", "", "1356994740: 1.0e+00", "1356994800: 2.0e+00",
+                "1356994860: nan",
+            ])
+        if command == "xport":
+            return rrd.RRDLines([
+                "<xport><meta><start>1356994800</start><step>60</step>",
+                "<end>1356994800</end><legend><entry>a</entry></legend>",
+                "</meta><data><row><t>1356994800</t><v>1.0e+00</v></row>",
+                "</data></xport>",
+            ])
+        raise rrd.RRDError(1, "unknown command '%s'" % command)
+
+
+class _Updates(object):
+    # records the options of every update, the updates whose index is
+    # in failing are rejected
+    def __init__(self):
+        self.calls = []
+        self.failing = set()
+        self.max_line = None
+
+    def __call__(self, filename, command, options, wait=True):
+        self.calls.append(list(options))
+        if len(self.calls) - 1 in self.failing:
+            raise rrd.RRDError(1, "illegal attempt to update")
+        return rrd.RRDLines([])
+
+
+# rrdtool prints unknown values as nan or -nan depending on the
+# platform
+FETCH = [
+    "                ds00                ds01", "",
+    "1356994740: 1.0000000000e+00 -nan",
+    "1356994800: 2.5000000000e+00 3.0000000000e+00",
+    "1356994860: nan nan",
+]
+
+
+def _wait_for(condition, seconds=5.0):
+    deadline = time.time() + seconds
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def _rrd_class(implementation, cache=None):
+    cls = rrd.RRDMeta("Test", (rrd.RRD,), {
+        '__module__': __name__,
+        'ds00': rrd.Gauge(heartbeat=120),
+        'rra': rrd.Average(xff=0.5, steps=1, rows=10),
+    })
+    cls.add_to_class('_impl', implementation)
+    if cache is not None:
+        cls.add_to_class('_cache', cache)
+    return cls
+
+
+class ArgumentLimitTest(unittest.TestCase):
+    def test_environment(self):
+        # the environment of the implementation is passed to rrdtool
+        default = rrd._argument_limit(rrd.RRDTool(env={}))
+        limit = rrd._argument_limit(rrd.RRDTool(env={'X': 'x' * 20000}))
+        self.assertEqual(default - limit, 20003 + rrd._POINTER_SIZE)
+        self.assertEqual(rrd._argument_limit(rrd.RRDTool()),
+                         rrd._argument_limit(None))
+
+    def test_max_line(self):
+        implementation = _Recorder()
+        implementation.max_line = 100
+        self.assertEqual(rrd._argument_limit(implementation), 100)
+
+
+class UpdateManyTest(unittest.TestCase):
+    def setUp(self):
+        self.implementation = _Updates()
+        self.calls = self.implementation.calls
+        self.cls = _rrd_class(self.implementation)
+        self.samples = [
+            (1356994800 + 60 * i, {'ds00': i}) for i in range(7)
+        ]
+
+    def limit(self, samples):
+        # the length of a command line with this number of samples,
+        # every sample has the same length
+        obj = self.cls("a.rrd")
+        return rrd._arguments_length(
+            ["rrdtool", "update", obj.filename] +
+            obj._meta['encoder'].update(*self.samples[0]) +
+            ["1356994800:0"] * (samples - 1)
+        )
+
+    def test_chunks(self):
+        self.implementation.max_line = self.limit(3)
+        self.assertEqual(self.cls("a.rrd").update_many(self.samples), 7)
+        self.assertEqual([len(options) - 3 for options in self.calls],
+                         [3, 3, 1])
+        self.assertEqual(self.calls[0][:3], ["--template", "ds00", "--"])
+        self.assertEqual(self.calls[2][3:], ["1356995160:6"])
+        self.assertEqual(sum([options[3:] for options in self.calls], []), [
+            "%d:%d" % (timestamp, values['ds00'])
+            for timestamp, values in self.samples
+        ])
+
+        # a single sample longer than the limit is sent anyway
+        self.implementation.max_line = self.limit(1) - 1
+        del self.calls[:]
+        self.assertEqual(self.cls("a.rrd").update_many(self.samples[:2]), 2)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_failed_chunk(self):
+        self.implementation.max_line = self.limit(3)
+        self.implementation.failing.add(1)
+        try:
+            self.cls("a.rrd").update_many(self.samples)
+        except rrd.RRDUpdateError as e:
+            self.assertEqual((e.chunk, e.committed), (1, 3))
+            self.assertEqual(e.samples, self.samples[3:6])
+            self.assertEqual(e.message, "illegal attempt to update")
+        else:
+            self.fail("no error raised")
+        # the following chunks are not sent
+        self.assertEqual(len(self.calls), 2)
+
+    def test_invalid_sample(self):
+        self.implementation.max_line = self.limit(3)
+        samples = list(self.samples)
+        samples[4] = (samples[4][0], {'ds01': 1})
+        try:
+            self.cls("a.rrd").update_many(samples)
+        except rrd.RRDUpdateError as e:
+            self.assertEqual((e.errorcode, e.chunk, e.committed), (-1, 1, 3))
+            self.assertEqual(e.samples, samples[3:5])
+        else:
+            self.fail("no error raised")
+        self.assertEqual(len(self.calls), 1)
+
+
+class ReadLinesTest(unittest.TestCase):
+    def read(self, data, chunk_size):
+        # the whole data is in the pipe, thus every read returns a
+        # complete chunk
+        read, write = os.pipe()
+        os.write(write, data)
+        os.close(write)
+        counter = [0, 0.0]
+        with os.fdopen(read, "rb") as stream:
+            lines = list(rrd._read_lines(stream, chunk_size, counter))
+        self.assertEqual(counter[0], len(data))
+        return lines
+
+    def test_terminators(self):
+        data = b"a\r\nbb\rccc\n\r\ndddd\r\n"
+        for chunk_size in range(1, len(data) + 1):
+            self.assertEqual(self.read(data, chunk_size),
+                             ["a", "bb", "ccc", "", "dddd"])
+
+    def test_split_terminator(self):
+        # '\r' ends the first chunk and '\n' starts the second
+        self.assertEqual(self.read(b"a\r\nb\n", 2), ["a", "b"])
+        self.assertEqual(self.read(b"a\r\r\nb\n", 2), ["a", "", "b"])
+        self.assertEqual(self.read(b"a\r", 2), ["a"])
+
+    def test_final_line(self):
+        for chunk_size in (1, 3, 1024):
+            self.assertEqual(self.read(b"a\nbc", chunk_size), ["a", "bc"])
+            self.assertEqual(self.read(b"a\n\n", chunk_size), ["a", ""])
+        self.assertEqual(self.read(b"", 1024), [])
+
+
+class RRDOutputTest(unittest.TestCase):
+    def output(self, script):
+        process = subprocess.Popen(
+            [sys.executable, "-c", "import sys, time\n" + script],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        output = rrd._RRDOutput(process, "fetch")
+        self.addCleanup(output.close)
+        return output
+
+    def test_lines(self):
+        output = self.output(
+            "sys.stdout.write('a\\r\\nb\\n' + 'c' * 100000)"
+        )
+        self.assertEqual(output.readline(), "a\n")
+        self.assertEqual(list(output), ["b", "c" * 100000])
+        self.assertEqual(output.readline(), "")
+
+    def test_error(self):
+        # the error is raised after the lines written before it
+        output = self.output(
+            "sys.stdout.write('a\\nb\\n')\n"
+            "sys.stdout.flush()\n"
+            "sys.stderr.write('ERROR: opening a.rrd\\n')\n"
+            "sys.exit(1)"
+        )
+        lines = []
+        try:
+            for line in output:
+                lines.append(line)
+        except rrd.RRDError as e:
+            self.assertEqual((e.errorcode, e.message),
+                             (1, "ERROR: opening a.rrd"))
+        else:
+            self.fail("no error raised")
+        self.assertEqual(lines, ["a", "b"])
+
+    def test_error_while_writing(self):
+        # the process fails, while the output is read
+        output = self.output(
+            "for i in range(3):\n"
+            "    sys.stdout.write('%d\\n' % i)\n"
+            "    sys.stdout.flush()\n"
+            "    time.sleep(0.05)\n"
+            "sys.stderr.write('ERROR: fetching cdp from rra')\n"
+            "sys.stderr.flush()\n"
+            "time.sleep(0.1)\n"
+            "sys.stdout.write('partial')\n"
+            "sys.exit(2)"
+        )
+        self.assertRaises(rrd.RRDError, output.wait)
+
+        output = self.output("sys.exit(3)")
+        try:
+            output.readline()
+        except rrd.RRDError as e:
+            self.assertEqual(e.errorcode, 3)
+        else:
+            self.fail("no error raised")
+
+
+class InstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        self.recorder = rrd.InstrumentationRecorder()
+        previous = rrd.set_instrumentation(self.recorder)
+        self.addCleanup(rrd.set_instrumentation, previous)
+
+    def test_commands(self):
+        obj = _rrd_class(_Commands())("a.rrd")
+        for timestamp in (1356994740, 1356994800, 1356994860):
+            obj.update(timestamp, ds00=1)
+        with obj.fetch("AVERAGE", 1356994680, 1356994860) as result:
+            self.assertEqual(len(list(result)), 3)
+        xport.xport([("a", obj, "ds00", "AVERAGE")], start=1356994740,
+                    end=1356994800)
+        self.assertRaises(rrd.RRDError, obj.first)
+
+        summary = self.recorder.summary()
+        self.assertEqual(sorted(summary), ["executed", "failed", "parsed"])
+        self.assertEqual(dict(
+            (command, entry['count'])
+            for command, entry in summary['executed'].items()
+        ), {'update': 3, 'fetch': 1, 'xport': 1, 'first': 1})
+        self.assertEqual(list(summary['failed']), ["first"])
+        parsed = summary['parsed'][None]
+        self.assertEqual((parsed['count'], parsed['amount']), (1, 3))
+
+        update = summary['executed']['update']
+        durations = sorted(self.recorder._entries['executed']['update'][
+            'durations'])
+        self.assertEqual(update['seconds'], sum(durations))
+        self.assertEqual((update['p50'], update['max']),
+                         (durations[1], durations[2]))
+
+    def test_percentiles(self):
+        recorder = rrd.InstrumentationRecorder(samples=100)
+        for seconds in range(200, 0, -1):
+            recorder.executed("fetch", float(seconds))
+        # only the last 100 durations are kept, the sums are complete
+        entry = recorder.summary()['executed']['fetch']
+        self.assertEqual((entry['count'], entry['seconds']),
+                         (200, 200 * 201 / 2.0))
+        self.assertEqual(
+            (entry['p50'], entry['p90'], entry['p99'], entry['max']),
+            (50.0, 90.0, 99.0, 100.0)
+        )
+        self.assertEqual(recorder.percentile("executed", "fetch", 1), 1.0)
+        self.assertEqual(recorder.percentile("executed", "update", 50),
+                         None)
+        recorder.clear()
+        self.assertEqual(recorder.summary(), {})
+
+    def test_processes(self):
+        directory = tempfile.mkdtemp(prefix="thrush-test-")
+        self.addCleanup(shutil.rmtree, directory)
+        binary = os.path.join(directory, "rrdtool")
+        with open(binary, "w") as f:
+            f.write(
+                "#!/bin/sh\n"
+                "case \"$1\" in\n"
+                "fetch) printf 'ds00\\n\\n1356994800: 1.0e+00\\n';;\n"
+                "update) ;;\n"
+                "*) echo \"ERROR: unknown command '$1'\" >&2; exit 1;;\n"
+                "esac\n"
+            )
+        os.chmod(binary, 0o755)
+        obj = _rrd_class(rrd.RRDTool(binary))("a.rrd")
+
+        obj.update(1356994800, ds00=1)
+        with obj.fetch("AVERAGE") as result:
+            self.assertEqual(len(list(result)), 1)
+        self.assertRaises(rrd.RRDError, obj.first)
+
+        summary = self.recorder.summary()
+        self.assertEqual(sorted(summary['spawned']),
+                         ["fetch", "first", "update"])
+        # the output of fetch is streamed
+        self.assertEqual(sorted(summary['waited']), ["first", "update"])
+        self.assertEqual(summary['read']['fetch']['amount'], 26)
+        # a failure is recorded once
+        self.assertEqual(dict(
+            (command, entry['count'])
+            for command, entry in summary['failed'].items()
+        ), {'first': 1})
+
+
+class FetchCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.signatures = {}
+        self.implementation = _Recorder()
+
+    def cache(self, **kwargs):
+        cache = rrd.FetchCache(signature=self.signatures.get, **kwargs)
+        self.cls = _rrd_class(self.implementation, cache)
+        return cache
+
+    def fetch(self, filename, start=1356991200, end=1356994800):
+        self.signatures.setdefault(filename, 1)
+        with self.cls(filename).fetch("AVERAGE", start, end) as result:
+            return list(result.rows())
+
+    def test_hit_and_invalidation(self):
+        cache = self.cache()
+        rows = self.fetch("a.rrd")
+        self.assertEqual(rows, [(1356994740, (1.0,)), (1356994800, (2.0,))])
+        self.assertEqual(self.fetch("a.rrd"), rows)
+        self.assertEqual(len(self.implementation.calls), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # another range is another entry
+        self.fetch("a.rrd", end=1356994860)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+        self.signatures["a.rrd"] = 2
+        self.assertEqual(self.fetch("a.rrd"), rows)
+        self.assertEqual(len(self.implementation.calls), 3)
+        self.assertEqual((cache.hits, cache.misses, cache.invalidations),
+                         (1, 3, 1))
+        self.fetch("a.rrd")
+        self.assertEqual(cache.hits, 2)
+
+    def test_entries(self):
+        cache = self.cache(entries=2)
+        self.fetch("a.rrd")
+        self.fetch("b.rrd")
+        self.fetch("a.rrd")
+        # b.rrd is the least recently used entry
+        self.fetch("c.rrd")
+        self.assertEqual(cache.evictions, 1)
+        self.fetch("a.rrd")
+        self.assertEqual(cache.hits, 2)
+        self.fetch("b.rrd")
+        self.assertEqual((cache.misses, cache.evictions), (4, 2))
+
+    def test_size(self):
+        # the output of a fetch is 80 bytes including the newlines
+        cache = self.cache(size=200)
+        self.fetch("a.rrd")
+        self.fetch("b.rrd")
+        self.assertEqual((cache._size, cache.evictions), (160, 0))
+        self.fetch("c.rrd")
+        self.assertEqual((cache._size, cache.evictions), (160, 1))
+
+        # results larger than the cache are not stored at all
+        cache = self.cache(size=60)
+        self.fetch("a.rrd")
+        self.fetch("a.rrd")
+        self.assertEqual((cache._size, cache.hits, cache.misses), (0, 0, 2))
+
+        cache.clear()
+        self.assertEqual(cache._size, 0)
+
+    def test_alignment(self):
+        self.cache(granularity=86400)
+        # epochs and offsets to them are fetched exactly
+        self.fetch("a.rrd", "end-1h", 1356994830)
+        self.assertEqual(self.implementation.calls[-1][2], [
+            "AVERAGE", "--start", "1356991230", "--end", "1356994830"
+        ])
+        self.fetch("a.rrd", 1356991230, 1356994830)
+        self.assertEqual(len(self.implementation.calls), 1)
+
+        # times relative to now are aligned
+        now = int(time.time())
+        self.fetch("a.rrd", "end-1h", "now")
+        end = now - now % 86400
+        self.assertEqual(self.implementation.calls[-1][2], [
+            "AVERAGE", "--start", str(end - 86400), "--end", str(end)
+        ])
+        self.fetch("a.rrd", "now-1d", "now")
+        self.assertEqual(len(self.implementation.calls), 2)
+
+        # times that cannot be resolved bypass the cache
+        self.fetch("a.rrd", "midnight", "now")
+        self.fetch("a.rrd", "midnight", "now")
+        self.assertEqual(self.implementation.calls[-1][2][1:3],
+                         ["--start", "midnight"])
+        self.assertEqual(len(self.implementation.calls), 4)
+
+
+class UpdateBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.writer = _Writer()
+        self.cls = _rrd_class(self.writer)
+        self.errors = []
+
+    def buffer(self, **kwargs):
+        kwargs.setdefault('on_error', lambda *args: self.errors.append(args))
+        buffer = rrd.UpdateBuffer(**kwargs)
+        self.addCleanup(buffer.close)
+        self.addCleanup(self.writer.event.set)
+        return buffer
+
+    def test_order(self):
+        buffer = self.buffer(count=100, age=60)
+        for timestamp in (3, 1, 2):
+            buffer.update(self.cls("a.rrd"), timestamp, ds00=timestamp)
+        buffer.update(self.cls("b.rrd"), 5, ds00=1)
+        self.assertEqual(self.writer.updates, [])
+        buffer.flush()
+        self.assertEqual(sorted(self.writer.updates),
+                         [("a.rrd", [1, 2, 3]), ("b.rrd", [5])])
+
+        buffer.update(self.cls("a.rrd"), 4, ds00=4)
+        buffer.close()
+        self.assertEqual(self.writer.updates[-1], ("a.rrd", [4]))
+        self.assertRaises(ValueError, buffer.update, self.cls("a.rrd"), 5)
+
+    def test_count(self):
+        buffer = self.buffer(count=2, age=60)
+        buffer.update(self.cls("a.rrd"), 1, ds00=1)
+        buffer.update(self.cls("b.rrd"), 1, ds00=1)
+        time.sleep(0.1)
+        self.assertEqual(self.writer.updates, [])
+        buffer.update(self.cls("a.rrd"), 2, ds00=2)
+        self.assertTrue(_wait_for(lambda: self.writer.updates))
+        self.assertEqual(self.writer.updates, [("a.rrd", [1, 2])])
+
+    def test_age(self):
+        buffer = self.buffer(count=100, age=0.1)
+        buffer.update(self.cls("a.rrd"), 1, ds00=1)
+        self.assertTrue(_wait_for(lambda: self.writer.updates))
+        self.assertEqual(self.writer.updates, [("a.rrd", [1])])
+
+    def test_size(self):
+        buffer = self.buffer(size=2, count=100, age=60)
+        self.writer.event.clear()
+        buffer.update(self.cls("a.rrd"), 1, ds00=1)
+        buffer.update(self.cls("b.rrd"), 1, ds00=1)
+
+        # the full buffer is written, but the writes are blocked
+        thread = threading.Thread(
+            target=buffer.update, args=(self.cls("a.rrd"), 2), kwargs={
+                'ds00': 2}
+        )
+        thread.start()
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+
+        self.writer.event.set()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        buffer.flush()
+        self.assertEqual(sorted(self.writer.updates), [
+            ("a.rrd", [1]), ("a.rrd", [2]), ("b.rrd", [1])
+        ])
+
+    def test_close_while_full(self):
+        buffer = self.buffer(size=2, count=100, age=60)
+        self.writer.event.clear()
+        buffer.update(self.cls("a.rrd"), 1, ds00=1)
+        buffer.update(self.cls("b.rrd"), 1, ds00=1)
+
+        errors = []
+
+        def update():
+            try:
+                buffer.update(self.cls("a.rrd"), 2, ds00=2)
+            except ValueError as e:
+                errors.append(e)
+        producer = threading.Thread(target=update)
+        producer.start()
+        producer.join(0.2)
+        self.assertTrue(producer.is_alive())
+
+        # the blocked sample must not be queued after close() has
+        # written the buffer
+        closer = threading.Thread(target=buffer.close)
+        closer.start()
+        self.assertTrue(_wait_for(lambda: buffer._closed))
+        self.writer.event.set()
+        producer.join(5)
+        closer.join(5)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(sorted(self.writer.updates),
+                         [("a.rrd", [1]), ("b.rrd", [1])])
+        self.assertEqual(buffer._pending, {})
+
+    def test_error(self):
+        buffer = self.buffer(count=100, age=60)
+        self.writer.failing.add("a.rrd")
+        buffer.update(self.cls("a.rrd"), 1, ds00=1)
+        buffer.update(self.cls("b.rrd"), 1, ds00=1)
+        buffer.flush()
+        self.assertEqual(self.writer.updates, [("b.rrd", [1])])
+        filename, e, samples = self.errors[0]
+        self.assertEqual(filename, "a.rrd")
+        self.assertTrue(isinstance(e, rrd.RRDUpdateError))
+        self.assertEqual(samples, [(1, {'ds00': 1})])
+
+        # the samples of a failing on_error are released anyway
+        def on_error(filename, e, samples):
+            raise RuntimeError()
+        buffer = self.buffer(count=100, age=60, on_error=on_error)
+        buffer.update(self.cls("a.rrd"), 1, ds00=1)
+        buffer.update(self.cls("c.rrd"), 1, ds00=1)
+        self.assertRaises(RuntimeError, buffer.flush)
+        self.assertEqual(buffer._queued, 0)
+
+    def test_default_errors(self):
+        buffer = rrd.UpdateBuffer()
+        self.writer.failing.add("a.rrd")
+        buffer.update(self.cls("a.rrd"), 1, ds00=1)
+        buffer.close()
+        self.assertEqual([error[0] for error in buffer.errors], ["a.rrd"])
+        self.assertFalse(buffer in rrd._open_buffers)
+
+
+class FetchResultTest(unittest.TestCase):
+    def result(self, lines=FETCH, unknown=None):
+        return rrd.RRDFetchResult(rrd.RRDLines(list(lines)),
+                                  ["ds00", "ds01"], unknown)
+
+    def values(self, column):
+        return [None if math.isnan(v) else v for v in column]
+
+    @unittest.skipIf(rrd.numpy is None, "to_arrays() requires numpy")
+    def test_to_arrays(self):
+        timestamps, values = self.result().to_arrays()
+        self.assertEqual(timestamps.dtype, rrd.numpy.int64)
+        self.assertEqual(list(timestamps),
+                         [1356994740, 1356994800, 1356994860])
+        self.assertEqual(sorted(values), ["ds00", "ds01"])
+        self.assertEqual(self.values(values['ds00']), [1.0, 2.5, None])
+        self.assertEqual(self.values(values['ds01']), [None, 3.0, None])
+        self.assertTrue(values['ds01'].flags['C_CONTIGUOUS'])
+
+        # unknown values are NaN regardless of unknown
+        timestamps, values = self.result(unknown=0.0).to_arrays()
+        self.assertEqual(self.values(values['ds01']), [None, 3.0, None])
+
+        # lastupdate reports a single row with U for unknown
+        timestamps, values = self.result(
+            ["ds00 ds01", "", "1356994800: 1 U", ""]).to_arrays()
+        self.assertEqual(list(timestamps), [1356994800])
+        self.assertEqual(self.values(values['ds01']), [None])
+
+        timestamps, values = self.result(FETCH[:2]).to_arrays()
+        self.assertEqual((len(timestamps), len(values['ds00'])), (0, 0))
+        self.assertRaises(ValueError, self.result(
+            FETCH[:2] + ["1356994740: 1.0"]).to_arrays)
+
+    def test_rows(self):
+        rows = list(self.result().rows())
+        self.assertEqual([timestamp for timestamp, _ in rows],
+                         [1356994740, 1356994800, 1356994860])
+        self.assertEqual([self.values(values) for _, values in rows],
+                         [[1.0, None], [2.5, 3.0], [None, None]])
+
+        self.assertEqual(list(self.result(unknown=-1.0).rows()), [
+            (1356994740, (1.0, -1.0)), (1356994800, (2.5, 3.0)),
+            (1356994860, (-1.0, -1.0)),
+        ])
+        self.assertEqual(list(self.result(
+            ["ds00 ds01", "", "1356994800: 1 U"], unknown=0).rows()),
+            [(1356994800, (1.0, 0))])
+
+    def test_decimal_point(self):
+        # rrdtool formats the values with the decimal point of the
+        # locale, which is replaced here for the test
+        localeconv = locale.localeconv
+        locale.localeconv = lambda: dict(localeconv(), decimal_point=",")
+        self.addCleanup(setattr, locale, "localeconv", localeconv)
+
+        lines = [line.replace(".", ",") for line in FETCH]
+        self.assertEqual(list(self.result(lines, unknown=0.0).rows()), [
+            (1356994740, (1.0, 0.0)), (1356994800, (2.5, 3.0)),
+            (1356994860, (0.0, 0.0)),
+        ])
+        if rrd.numpy is not None:
+            timestamps, values = self.result(lines).to_arrays()
+            self.assertEqual(self.values(values['ds00']), [1.0, 2.5, None])
+
+class SeriesTest(unittest.TestCase):
+    def setUp(self):
+        # five rows of two datasources every 60 seconds
+        self.series = rrd.RRDSeries(1356994800, 60, ["ds00", "ds01"],
+                                    array.array('d', range(10)))
+
+    def timestamps(self, series):
+        return [timestamp for timestamp, _ in series]
+
+    def test_rows(self):
+        series = self.series
+        self.assertEqual((len(series), series.end), (5, 1356995040))
+        self.assertEqual(series[1], (1356994860, (2.0, 3.0)))
+        self.assertEqual(series[-1], (1356995040, (8.0, 9.0)))
+        self.assertRaises(IndexError, lambda: series[5])
+        self.assertEqual(list(series.column("ds01")), [1, 3, 5, 7, 9])
+
+        with rrd.RRDFetchResult(rrd.RRDLines(list(FETCH)),
+                                ["ds00", "ds01"]) as result:
+            series = result.materialize()
+        self.assertEqual((series.start, series.step, len(series)),
+                         (1356994740, 60, 3))
+        self.assertRaises(ValueError, rrd.RRDFetchResult(
+            rrd.RRDLines(FETCH[:4] + ["1356994900: 1 2"]),
+            ["ds00", "ds01"]).materialize)
+
+    def test_slices(self):
+        part = self.series[1:3]
+        self.assertTrue(isinstance(part, rrd.RRDSeries))
+        self.assertEqual(list(part), [
+            (1356994860, (2.0, 3.0)), (1356994920, (4.0, 5.0))
+        ])
+        self.assertEqual((part.start, part.step), (1356994860, 60))
+        # the values are copied
+        part.values[0] = -1.0
+        self.assertEqual(self.series[1], (1356994860, (2.0, 3.0)))
+
+        self.assertEqual(self.timestamps(self.series[-2:]),
+                         [1356994980, 1356995040])
+        for empty in (self.series[3:1], self.series[7:]):
+            self.assertEqual((len(empty), empty.end), (0, None))
+        self.assertRaises(ValueError, lambda: self.series[::2])
+
+    def test_between(self):
+        series = self.series
+        self.assertEqual(self.timestamps(series.between()),
+                         self.timestamps(series))
+        self.assertEqual(self.timestamps(series.between(1356994860,
+                                                        1356994920)),
+                         [1356994860, 1356994920])
+        # times between rows select the rows within the range
+        self.assertEqual(self.timestamps(series.between(1356994861,
+                                                        1356994979)),
+                         [1356994920])
+        self.assertEqual(self.timestamps(series.between(end=1356994800)),
+                         [1356994800])
+        self.assertEqual(self.timestamps(series.between(start=1356995000)),
+                         [1356995040])
+        self.assertEqual(len(series.between(1356990000, 1356990060)), 0)
+        self.assertEqual(len(series.between(start=1356999999)), 0)
+        self.assertEqual(len(series.between(1356994920, 1356994860)), 0)
+
+        start = datetime.datetime.fromtimestamp(1356994980)
+        self.assertEqual(self.timestamps(series.between(start)),
+                         [1356994980, 1356995040])
+
+        empty = rrd.RRDSeries(None, None, ["ds00"])
+        self.assertEqual(len(empty.between(1356994800, 1356995040)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,209 @@
+#-*- coding: utf-8 -*-
+
+"""
+    Runs :py:mod:`thrush.rrdcached` against a stand-in for rrdcached,
+    that listens on a unix socket and records the commands it gets.
+
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from thrush import rrd, rrdcached
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # answers like rrdcached. an UPDATE fails, if its values contain
+    # "fail".
+    def _update(self, fields):
+        if any("fail" in value for value in fields[2:]):
+            return "-1 illegal attempt to update using time %s" % (
+                fields[2].split(":")[0])
+        return "0 errors, enqueued %d value(s)." % (len(fields) - 2)
+
+    def _answer(self, fields):
+        command = fields[0]
+        if command == "UPDATE":
+            return self._update(fields)
+        if command == "FIRST":
+            return "0 1356994800"
+        if command == "FETCH":
+            return "\n".join([
+                "6 Success", "FlushVersion: 1", "Start: 1356994800",
+                "Step: 60", "DSCount: 2", "DSName: ds00 ds01",
+                "1356994860: 1.0000000000e+00 nan",
+            ])
+        return "-1 Unknown command: %s" % command
+
+    def handle(self):
+        for line in iter(self.rfile.readline, b""):
+            line = line.decode('utf-8').rstrip("\n")
+            fields = _split(line)
+            self.server.commands.append(fields)
+            if fields[0] == "BATCH":
+                self._write("0 Go ahead.  End with dot '.' on its own line.")
+                errors = []
+                for number, line in enumerate(
+                        iter(self.rfile.readline, b".\n")):
+                    fields = _split(line.decode('utf-8').rstrip("\n"))
+                    self.server.commands.append(fields)
+                    answer = self._answer(fields)
+                    if answer.startswith("-"):
+                        errors.append("%d %s" % (
+                            number + 1, answer.split(" ", 1)[1]))
+                self._write("\n".join(
+                    ["%d errors" % len(errors)] + errors))
+            else:
+                self._write(self._answer(fields))
+
+    def _write(self, text):
+        self.wfile.write((text + "\n").encode('utf-8'))
+        self.wfile.flush()
+
+
+def _split(line):
+    # the inverse of the escaping of thrush.rrdcached
+    fields, field, escaped = [], [], False
+    for character in line:
+        if escaped:
+            field.append(character)
+            escaped = False
+        elif character == "\\":
+            escaped = True
+        elif character == " ":
+            fields.append("".join(field))
+            field = []
+        else:
+            field.append(character)
+    fields.append("".join(field))
+    return fields
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Fallback(object):
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, filename, command, options, wait=True):
+        self.calls.append((filename, command, list(options)))
+        return rrd.RRDLines([])
+
+
+class RRDCachedTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="thrush-test-")
+        self.address = os.path.join(self.directory, "rrdcached.sock")
+        self.server = _Server(self.address, _Handler)
+        self.server.commands = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.fallback = _Fallback()
+        self.implementation = rrdcached.RRDCached(
+            "unix:" + self.address, fallback=self.fallback
+        )
+        cls = rrd.RRDMeta("Cached", (rrd.RRD,), {
+            '__module__': __name__,
+            'ds00': rrd.Gauge(heartbeat=120),
+            'ds01': rrd.Gauge(heartbeat=120),
+            'rra': rrd.Average(xff=0.5, steps=1, rows=10),
+        })
+        cls.add_to_class('_impl', self.implementation)
+        self.path = os.path.join(self.directory, "with space.rrd")
+        open(self.path, "w").close()
+        self.obj = cls(self.path)
+
+    def tearDown(self):
+        self.implementation.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_update(self):
+        self.obj.update(1356994860, ds00=1.5)
+        self.assertEqual(self.server.commands, [
+            ["UPDATE", os.path.realpath(self.path), "1356994860:1.5:U"]
+        ])
+
+    def test_relative_path(self):
+        cwd = os.getcwd()
+        os.chdir(self.directory)
+        try:
+            self.obj.filename = "with space.rrd"
+            self.obj.update(1356994860, ds00=1)
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(self.server.commands[0][1],
+                         os.path.realpath(self.path))
+
+    def test_missing_file(self):
+        self.obj.filename = os.path.join(self.directory, "missing.rrd")
+        self.assertRaises(rrd.RRDError, self.obj.update, 1, ds00=1)
+        self.assertEqual(self.server.commands, [])
+
+    def test_batch(self):
+        self.obj.update_many([
+            (1356994860, {'ds00': 1}), (1356994920, {'ds00': 2}),
+        ])
+        self.assertEqual([fields[0] for fields in self.server.commands],
+                         ["BATCH", "UPDATE", "UPDATE"])
+
+        try:
+            self.obj.update_many([
+                (1356994980, {'ds00': 3}), (1356995040, {'ds00': 'fail'}),
+                (1356995100, {'ds00': 4}),
+            ])
+        except rrd.RRDUpdateError as e:
+            self.assertTrue("1356995040:fail:U" in str(e))
+        else:
+            self.fail("the failed update was not reported")
+        self.assertEqual(len(self.server.commands), 7)
+
+    def test_fetch_and_first(self):
+        with self.obj.fetch("AVERAGE", 1356994800, 1356994860) as result:
+            rows = list(result.rows())
+        self.assertEqual(rows[0][0], 1356994860)
+        self.assertEqual(rows[0][1][0], 1.0)
+        self.assertEqual(self.server.commands[0][:2],
+                         ["FETCH", os.path.realpath(self.path)])
+        self.assertEqual(self.obj.first().year,
+                         rrd._convert_from_timestamp("1356994800").year)
+
+    def test_fallback(self):
+        self.obj.create(start=1356994740, step=60)
+        self.assertEqual(self.server.commands, [])
+        filename, command, options = self.fallback.calls[0]
+        self.assertEqual((filename, command), (self.path, "create"))
+        self.assertEqual(options[:2], ["--daemon", "unix:" + self.address])
+
+        self.obj.restore("dump.xml")
+        filename, command, options = self.fallback.calls[1]
+        self.assertEqual((filename, command), ("dump.xml", "restore"))
+        self.assertEqual(options, [self.path])
+
+    def test_remote_path(self):
+        client = rrdcached.RRDCachedClient("localhost:1")
+        self.assertEqual(client.path("a/b.rrd"), "a/b.rrd")
+        self.assertRaises(rrd.RRDError, client.path, "/a/b.rrd")
+
+
+if __name__ == "__main__":
+    unittest.main()
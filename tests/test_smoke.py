@@ -0,0 +1,117 @@
+#-*- coding: utf-8 -*-
+
+"""
+    Imports every module and runs the basic commands against the fake
+    rrdtool of the benchmarks. Runs on Python 2 and 3:
+
+    .. sourcecode:: sh
+
+        python -m unittest discover -s tests
+
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import sys
+import datetime
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from thrush import rrd, pipe, native, rrdcached, collection, xport, \
+    graphcache, info, aggregate, follow, dump
+
+FAKE = os.path.join(ROOT, "benchmarks", "fake_rrdtool.py")
+
+
+class Load(rrd.RRD):
+    ds00 = rrd.Gauge(heartbeat=120)
+    ds01 = rrd.Counter(heartbeat=120, min=0)
+    rra = rrd.Average(xff=0.5, steps=1, rows=10)
+
+
+class SmokeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="thrush-test-")
+        self.binary = os.path.join(self.directory, "rrdtool")
+        with open(self.binary, "w") as f:
+            f.write('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (
+                sys.executable, FAKE))
+        os.chmod(self.binary, 0o755)
+        self.environ = dict(os.environ, THRUSH_FAKE_ROWS="5",
+                            THRUSH_FAKE_DS="2", THRUSH_FAKE_STEP="60")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def rrd_class(self, implementation):
+        cls = rrd.RRDMeta("Fake", (rrd.RRD,), {
+            '__module__': __name__,
+            'ds00': rrd.Gauge(heartbeat=120),
+            'ds01': rrd.Gauge(heartbeat=120),
+            'rra': rrd.Average(xff=0.5, steps=1, rows=10),
+        })
+        cls.add_to_class('_impl', implementation)
+        return cls(os.path.join(self.directory, "fake.rrd"))
+
+    def check_commands(self, obj):
+        obj.create(start=1356994740, step=60)
+        obj.update(1356994800, ds00=1.5, ds01=2)
+        self.assertEqual(obj.update_many([(1356994860, {'ds00': 1})]), 1)
+        with obj.fetch("AVERAGE", 1356994800, 1356995040) as result:
+            rows = list(result.rows())
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0][0], 1356994800)
+        self.assertEqual(len(rows[0][1]), 2)
+        series = obj.fetch("AVERAGE").materialize()
+        self.assertEqual((len(series), series.step), (5, 60))
+        self.assertEqual(
+            obj.first(), datetime.datetime.fromtimestamp(1356994800)
+        )
+
+    def test_class(self):
+        self.assertEqual(Load._meta['datasources_list'], ['ds00', 'ds01'])
+        self.assertEqual((Load.ds00.index, Load.ds01.index), (0, 1))
+        self.assertEqual(Load.rra.index, 0)
+        self.assertEqual(
+            Load._meta['encoder'].update(1, {'ds01': 2}),
+            ["--template", "ds00:ds01", "--", "1:U:2"]
+        )
+
+    def test_rrdtool(self):
+        self.check_commands(self.rrd_class(
+            rrd.RRDTool(self.binary, self.environ)
+        ))
+
+    def test_pipe(self):
+        implementation = pipe.RRDToolPipe(binary=self.binary,
+                                          env=self.environ)
+        try:
+            self.check_commands(self.rrd_class(implementation))
+        finally:
+            implementation.close()
+
+    @unittest.skipIf(sys.version_info < (3, 5), "asyncio requires Python 3")
+    def test_aio(self):
+        # the coroutines are a syntax error on Python 2
+        from aio_smoke import fetch_rows
+        rows = fetch_rows(self.rrd_class(None), self.binary, self.environ)
+        self.assertEqual(len(rows), 5)
+
+    @unittest.skipIf(sys.version_info < (3, 5), "asyncio requires Python 3")
+    def test_aio_cancel(self):
+        from aio_smoke import cancel_slow
+        binary = os.path.join(self.directory, "slow")
+        with open(binary, "w") as f:
+            f.write("#!/bin/sh\necho 1356994800: 1 2\nexec sleep 10\n")
+        os.chmod(binary, 0o755)
+        self.assertEqual(cancel_slow(self.rrd_class(None), binary),
+                         [False, False])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+#-*- coding: utf-8 -*-
+
+"""
+    Runs :py:func:`thrush.xport.xport` against an implementation, that
+    answers like rrdxport and only accepts short command lines.
+
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from thrush import rrd, xport
+
+START, END = 1356991200, 1356994800
+
+
+def _value(name, timestamp):
+    return float(sum(ord(c) for c in name) + timestamp % 3600)
+
+
+class _Xport(object):
+    # consolidates to 300 seconds unless a step is requested. the
+    # value of a column only depends on its name and time.
+    max_line = 250
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, filename, command, options, wait=True):
+        self.calls.append((filename, list(options)))
+        arguments = dict(zip(options[0::2], options[1::2]))
+        step = int(arguments.get("--step", 300))
+        start = int(arguments["--start"])
+        start += step - start % step
+        end = int(arguments["--end"])
+        end -= end % step
+        legend = [
+            option.split(":")[2] for option in options
+            if option.startswith("XPORT:")
+        ]
+
+        lines = [
+            "<xport><meta>",
+            "<start>%d</start><step>%d</step><end>%d</end>" % (
+                start, step, end),
+            "<legend>%s</legend>" % "".join(
+                "<entry>%s</entry>" % name for name in legend),
+            "</meta><data>",
+        ]
+        for timestamp in range(start, end + step, step):
+            lines.append("<row><t>%d</t>%s</row>" % (timestamp, "".join(
+                "<v>%e</v>" % _value(name, timestamp) for name in legend
+            )))
+        lines.append("</data></xport>")
+        return rrd.RRDLines(lines)
+
+
+class XportTest(unittest.TestCase):
+    def setUp(self):
+        self.implementation = _Xport()
+        cls = rrd.RRDMeta("Test", (rrd.RRD,), {
+            '__module__': __name__,
+            'ds00': rrd.Gauge(heartbeat=120),
+            'rra': rrd.Average(xff=0.5, steps=1, rows=10),
+        })
+        cls.add_to_class('_impl', self.implementation)
+        self.defs = [
+            (name, cls("%s.rrd" % name), "ds00", "AVERAGE")
+            for name in "abcd"
+        ]
+        self.cdefs = [("total", "a,b,+")]
+
+    def test_groups(self):
+        statements = dict(
+            (vname, xport._xport_definition(vname, obj, ds, cf))
+            for vname, obj, ds, cf in self.defs
+        )
+        statements["total"] = "CDEF:total=a,b,+"
+        dependencies = dict((vname, []) for vname in "abcd")
+        dependencies["total"] = ["a", "b"]
+        order = ["a", "b", "c", "d", "total"]
+
+        # the definitions of the columns and the cdef do not fit
+        # together, the cdef brings its definitions along
+        self.assertEqual(
+            xport._xport_groups(statements, dependencies, order, order, 110),
+            [(["a", "b"], ["a", "b"]), (["c", "d"], ["c", "d"]),
+             (["total"], ["a", "b", "total"])]
+        )
+        self.assertEqual(
+            xport._xport_groups(statements, dependencies, order,
+                                ["total", "a", "c"], 200),
+            [(["total", "a", "c"], ["a", "b", "c", "total"])]
+        )
+
+    def test_split(self):
+        result = xport.xport(self.defs, self.cdefs, start=START, end=END)
+
+        calls = self.implementation.calls
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(calls[0][0], "DEF:a=a.rrd:ds00:AVERAGE")
+        self.assertEqual(calls[0][1], [
+            "--start", str(START), "--end", str(END),
+            "DEF:b=b.rrd:ds00:AVERAGE", "XPORT:a:a", "XPORT:b:b",
+        ])
+        # the further commands continue on the grid of the first one
+        self.assertEqual(calls[1][1][:6], [
+            "--start", str(START), "--end", str(END), "--step", "300"
+        ])
+        self.assertEqual(calls[2][0], "DEF:a=a.rrd:ds00:AVERAGE")
+        self.assertEqual(calls[2][1][6:], [
+            "DEF:b=b.rrd:ds00:AVERAGE", "CDEF:total=a,b,+",
+            "XPORT:total:total",
+        ])
+        for filename, options in calls:
+            self.assertTrue(len(" ".join([filename] + options)) < 250)
+
+        self.assertEqual((result.start, result.end, result.step),
+                         (START + 300, END, 300))
+        self.assertEqual(result.legend, ["a", "b", "c", "d", "total"])
+        self.assertEqual(list(result.timestamps),
+                         list(range(START + 300, END + 300, 300)))
+        for name in result.legend:
+            self.assertEqual(list(result.columns[name]), [
+                _value(name, timestamp) for timestamp in result.timestamps
+            ])
+
+    def test_single(self):
+        self.implementation.max_line = None
+        result = xport.xport(self.defs, self.cdefs, columns=["total"],
+                             start=START, end=END, step=600)
+        self.assertEqual(self.implementation.calls, [(
+            "DEF:a=a.rrd:ds00:AVERAGE", [
+                "--start", str(START), "--end", str(END), "--step", "600",
+                "DEF:b=b.rrd:ds00:AVERAGE", "CDEF:total=a,b,+",
+                "XPORT:total:total",
+            ]
+        )])
+        self.assertEqual((result.step, result.legend), (600, ["total"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,272 @@
+#-*- coding: utf-8 -*-
+
+"""
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import array
+import warnings
+
+from thrush.rrd import DataSource, numpy, _TIMESTAMP_TYPECODE, \
+    _convert_to_dsname
+
+try:
+    range = xrange
+except NameError:
+    pass
+
+
+def _aggregate_column(rrd, ds):
+    # the index of a datasource given by attribute name or object
+    dsname = ds.name if isinstance(ds, DataSource) else _convert_to_dsname(ds)
+    for name, value in rrd._meta['datasources'].items():
+        if value.name == dsname:
+            return rrd._meta['datasources_index'][name]
+    raise ValueError("unknown datasource '%s' of %s" % (
+        dsname, type(rrd).__name__))
+
+
+class _AggregateSource(object):
+    # the (timestamp, value) rows of a single column of one file, read
+    # ahead by at most two rows to determine the step of the file
+    def __init__(self, rows, result=None):
+        self.result = result
+        self._rows = rows
+        self.pending = []
+        for _ in range(2):
+            row = next(self._rows, None)
+            if row is not None:
+                self.pending.append(row)
+        self.step = None
+        if len(self.pending) == 2:
+            self.step = self.pending[1][0] - self.pending[0][0]
+
+    def peek(self):
+        if not self.pending:
+            row = next(self._rows, None)
+            if row is None:
+                return None
+            self.pending.append(row)
+        return self.pending[0]
+
+    def pop(self):
+        return self.pending.pop(0)
+
+    def close(self):
+        if self.result is not None:
+            self.result.close()
+
+
+def _aggregate_streamed(result, column):
+    return _AggregateSource(
+        ((row[0], row[1][column]) for row in result.rows()), result
+    )
+
+
+def _aggregate_buffered(result, column):
+    # reads the column completely, thus the rrdtool process terminates
+    timestamps = array.array(_TIMESTAMP_TYPECODE)
+    values = array.array('d')
+    try:
+        for timestamp, row in result.rows():
+            timestamps.append(timestamp)
+            values.append(row[column])
+    finally:
+        result.close()
+    return _AggregateSource(iter(zip(timestamps, values)))
+
+
+def _aggregate_function(name):
+    if name == "sum":
+        return lambda block: numpy.nansum(block, axis=0)
+    if name in ("avg", "mean"):
+        return lambda block: numpy.nanmean(block, axis=0)
+    if name == "min":
+        return lambda block: numpy.nanmin(block, axis=0)
+    if name == "max":
+        return lambda block: numpy.nanmax(block, axis=0)
+    if name == "count":
+        return lambda block: (~numpy.isnan(block)).sum(axis=0).astype(float)
+    if name[:1] == "p" and name[1:].replace(".", "", 1).isdigit():
+        percent = float(name[1:])
+        if percent <= 100:
+            return lambda block: numpy.nanpercentile(block, percent, axis=0)
+    raise ValueError("unknown aggregation function '%s'" % name)
+
+
+def aggregate(rrds, ds, cf, start="end-1day", end="now", resolution=None,
+              functions=("sum", "avg"), step=None, xff=0.5, chunk=1024,
+              window=32):
+    """
+        .. versionadded:: 0.4
+
+        Aggregates a datasource across many RRD files and returns the
+        result row by row. This requires NumPy_.
+
+        Up to *window* files are fetched at the same time and read in
+        chunks of *chunk* rows. The rows of every file are consolidated
+        onto a common grid of *step* seconds, which defaults to the
+        largest step of all files. Thus the memory needed depends on
+        the number of files and *chunk*, but not on the length of the
+        time range. If there are more files, they are fetched in
+        batches of *window* files, and their rows are kept in memory
+        until all files have been read.
+
+        The *xff* is applied twice, like the xfiles factor of a RRA:
+        the consolidated value of a file is unknown if more than that
+        fraction of its rows within a grid step is unknown, and an
+        aggregated value is unknown if the values of more than that
+        fraction of the files are unknown.
+
+        :param rrds: An iterable of RRD objects, which may be of
+                     different classes.
+        :param ds: The datasource either by its attribute name or as
+                   object.
+        :param cf: See ``fetch``.
+        :param start: See ``fetch``.
+        :param end: See ``fetch``.
+        :param resolution: See ``fetch``.
+        :param functions: The names of the aggregation functions:
+                          ``sum``, ``avg``, ``min``, ``max``, ``count``
+                          or a percentile like ``p95``.
+        :param step: The seconds between two rows of the result. Has
+                     to be a multiple of the step of every file.
+        :param xff: The fraction of unknown values allowed.
+        :param chunk: The number of grid steps processed at once.
+        :param window: The maximum number of files fetched at the same
+                       time, i.e. of running rrdtool processes.
+
+        :returns: A generator of ``(timestamp, values)`` tuples, where
+                  *timestamp* are the seconds since the epoch and
+                  *values* a tuple containing the result of every
+                  function. Unknown results are NaN.
+
+        :raises: :py:class:`thrush.rrd.RRDError`
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            from thrush.aggregate import aggregate
+
+            hosts = [MyRRD(name) for name in glob.glob("hosts/*.rrd")]
+            for timestamp, (total, p95) in aggregate(
+                    hosts, "ds", "AVERAGE", functions=("sum", "p95")):
+                print timestamp, total, p95
+
+        .. _NumPy: http://www.numpy.org
+    """
+    if numpy is None:
+        raise ImportError("aggregate() requires numpy")
+    if window < 1:
+        raise ValueError("window must be at least 1")
+    reducers = [_aggregate_function(name) for name in functions]
+    rrds = list(rrds)
+    columns = [_aggregate_column(rrd, ds) for rrd in rrds]
+    fetch = (cf, start, end, resolution)
+    return _aggregate(rrds, columns, fetch, reducers, step, xff, chunk,
+                      window)
+
+
+def _aggregate(rrds, columns, fetch, reducers, step, xff, chunk, window):
+    # invalid arguments are reported by aggregate() right away, the
+    # files are only fetched once the generator is used.
+    read = _aggregate_streamed
+    if len(rrds) > window:
+        read = _aggregate_buffered
+
+    sources = []
+    try:
+        for first in range(0, len(rrds), window):
+            # the batch is fetched at once, thus the processes run
+            # concurrently while the first of them is read
+            batch = []
+            try:
+                for i in range(first, min(first + window, len(rrds))):
+                    batch.append((rrds[i].fetch(*fetch), columns[i]))
+                while batch:
+                    sources.append(read(*batch.pop(0)))
+            finally:
+                for result, _ in batch:
+                    result.close()
+        for row in _aggregate_rows(sources, reducers, step, xff, chunk):
+            yield row
+    finally:
+        for source in sources:
+            source.close()
+
+
+def _aggregate_rows(sources, reducers, step, xff, chunk):
+    steps = [source.step for source in sources if source.step]
+    if step is None:
+        step = max(steps) if steps else 1
+    for source_step in steps:
+        if step % source_step:
+            raise ValueError("step %d is not a multiple of %d" % (
+                step, source_step))
+
+    # a row covers the time up to its timestamp, thus it belongs to
+    # the grid step ending at or after it
+    def bucket(timestamp):
+        return -(-timestamp // step) * step
+
+    heads = [source.peek() for source in sources]
+    if not any(heads):
+        return
+    current = min(bucket(head[0]) for head in heads if head is not None)
+
+    files = len(sources)
+    while True:
+        last = current + (chunk - 1) * step
+        sums = numpy.zeros((files, chunk))
+        known = numpy.zeros((files, chunk))
+        expected = numpy.ones((files, 1))
+        remaining = False
+        read = -1
+        for i, source in enumerate(sources):
+            if source.step:
+                expected[i, 0] = step // source.step
+            while True:
+                head = source.peek()
+                if head is None:
+                    break
+                timestamp, value = head
+                if timestamp > last:
+                    remaining = True
+                    break
+                source.pop()
+                position = (bucket(timestamp) - current) // step
+                read = max(read, position)
+                if position >= 0 and value == value:
+                    sums[i, position] += value
+                    known[i, position] += 1
+
+        results = _aggregate_block(sums, known, expected, reducers, xff)
+        rows = chunk
+        if not remaining:
+            # the last chunk ends with the last row of any file, even
+            # if its values are unknown
+            rows = read + 1
+        for position in range(rows):
+            yield current + position * step, tuple(
+                float(result[position]) for result in results
+            )
+        if not remaining:
+            return
+        current = last + step
+
+
+def _aggregate_block(sums, known, expected, reducers, xff):
+    # columns without any known value are NaN, which numpy warns about
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            block = sums / known
+            block[known < expected * (1 - xff)] = numpy.nan
+            missing = numpy.isnan(block).sum(axis=0)
+            unknown = (missing > len(block) * xff) | (missing == len(block))
+            results = [reducer(block) for reducer in reducers]
+    for result in results:
+        result[unknown] = numpy.nan
+    return results
@@ -0,0 +1,296 @@
+#-*- coding: utf-8 -*-
+
+"""
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import asyncio
+import locale
+from asyncio.subprocess import PIPE
+
+from thrush.rrd import RRDError, RRDFetchResult, RRDSeries, numpy, \
+    _convert_from_timestamp, _create_options, _update_options, \
+    _fetch_options, _first_options
+
+
+class _AsyncOutput(object):
+    """
+        Wraps the output streams of a rrdtool process started by
+        :py:class:`AsyncRRDTool`. Standard error is read by a separate
+        task, errors are raised as soon as the process has terminated.
+    """
+    def __init__(self, process, release):
+        self.process = process
+        self._release = release
+        self._lines = None
+        self._stderr = asyncio.ensure_future(process.stderr.read())
+        self._encoding = locale.getpreferredencoding(False)
+
+    def _done(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+    async def _check_error(self):
+        try:
+            code = await self.process.wait()
+            stderr = await self._stderr
+        finally:
+            self._done()
+        if code != 0:
+            raise RRDError(code, stderr.decode(self._encoding, 'replace')
+                                       .strip())
+
+    async def _unbuffered(self):
+        try:
+            async for line in self.process.stdout:
+                if self._stderr.done() and self.process.returncode:
+                    await self._check_error()
+                yield line.decode(self._encoding, 'replace').rstrip('\r\n')
+            await self._check_error()
+        except BaseException:
+            # cancelled, or the iterator was dropped before the output
+            # has been read completely.
+            await self.close()
+            raise
+
+    def _stream(self):
+        if self._lines is None:
+            self._lines = self._unbuffered()
+        return self._lines
+
+    async def _replay(self, lines):
+        for line in lines:
+            yield line
+
+    async def wait(self):
+        """
+            Reads the complete output and waits for the process to
+            terminate.
+        """
+        lines = [line async for line in self._stream()]
+        self._lines = self._replay(lines)
+
+    def __aiter__(self):
+        return self._stream()
+
+    async def readline(self):
+        try:
+            return await self._stream().__anext__() + "\n"
+        except StopAsyncIteration:
+            return ""
+
+    async def close(self):
+        if self.process.returncode is None:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+        try:
+            await self.process.wait()
+            await self._stderr
+        finally:
+            self._done()
+
+
+class AsyncRRDTool(object):
+    """
+        .. versionadded:: 0.4
+
+        Runs rrdtool commands without blocking the event loop. At
+        most *concurrency* rrdtool processes are running at the same
+        time, further commands wait until a process has terminated.
+        A process started by ``fetch`` or ``last`` counts until its
+        result has been read completely or closed. If a command is
+        cancelled, e.g. by :py:func:`asyncio.wait_for`, or an
+        iterator over its output is dropped, the process is killed.
+
+        An instance must only be used within a single event loop.
+
+        :param concurrency: The maximum number of concurrently running
+                            rrdtool processes.
+        :param binary: The name or path of the ``rrdtool`` executable.
+        :param env: The environment for the processes. Defaults to
+                    the environment of the current process.
+    """
+    def __init__(self, concurrency=16, binary="rrdtool", env=None):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.concurrency = concurrency
+        self.binary = binary
+        self.env = env
+        self._semaphore = None
+
+    async def __call__(self, filename, command, options, wait=True):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        await self._semaphore.acquire()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.binary, command, filename, *options,
+                stdout=PIPE, stderr=PIPE, env=self.env
+            )
+        except OSError as e:
+            self._semaphore.release()
+            raise RRDError(-1, "cannot execute rrdtool: %s" % e)
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+        output = _AsyncOutput(process, self._semaphore.release)
+        if wait:
+            try:
+                await output.wait()
+            except BaseException:
+                await output.close()
+                raise
+        return output
+
+
+class AsyncRRDFetchResult(RRDFetchResult):
+    """
+        .. versionadded:: 0.4
+
+        The asynchronous counterpart of
+        :py:class:`thrush.rrd.RRDFetchResult`, which has to be used
+        with ``async for`` and ``async with``. Dropping an iterator
+        before the end of the output closes the result.
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            async with await AsyncRRD(myrrd).fetch("MAX") as result:
+                async for timestamp, values in result:
+                    print(timestamp, values)
+    """
+    def __iter__(self):
+        raise TypeError("use 'async for' to iterate over the result")
+
+    async def _rows(self):
+        try:
+            async for line in self.stdout:
+                row = self._parse_line(line)
+                if row is not None:
+                    yield row
+        except GeneratorExit:
+            # the iterator was dropped before the end of the output
+            await self.close()
+            raise
+
+    def __aiter__(self):
+        return self._rows()
+
+    async def rows(self):
+        """
+            See :py:meth:`thrush.rrd.RRDFetchResult.rows`.
+        """
+        parse = self._row_parser()
+        try:
+            async for line in self.stdout:
+                row = parse(line)
+                if row is not None:
+                    yield row
+        except GeneratorExit:
+            await self.close()
+            raise
+
+    async def materialize(self):
+        """
+            See :py:meth:`thrush.rrd.RRDFetchResult.materialize`.
+        """
+        try:
+            series = RRDSeries(None, None, self.dsnames)
+            async for timestamp, values in self.rows():
+                series._append(timestamp, values)
+            return series
+        finally:
+            await self.close()
+
+    async def to_arrays(self):
+        """
+            See :py:meth:`thrush.rrd.RRDFetchResult.to_arrays`.
+        """
+        if numpy is None:
+            raise ImportError("to_arrays() requires numpy")
+        return self._arrays([line async for line in self.stdout])
+
+    async def close(self):
+        """
+            Terminates the rrdtool process if the output was not
+            read completely.
+        """
+        await self.stdout.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
+
+
+_default = AsyncRRDTool()
+
+
+class AsyncRRD(object):
+    """
+        .. versionadded:: 0.4
+
+        Provides awaitable versions of the methods of a RRD object.
+        They take the same arguments as their counterparts.
+
+        :param rrd: An instance of a :py:class:`thrush.rrd.RRD` class.
+        :param implementation: An :py:class:`AsyncRRDTool` instance.
+                               All objects without an explicit
+                               implementation share the same instance,
+                               and thus its concurrency limit.
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            from thrush import aio
+
+            myrrd = aio.AsyncRRD(MyRRD("my.rrd"))
+            await myrrd.update(1234, ds1=5.4, ds2=3)
+            print(await myrrd.first())
+    """
+    def __init__(self, rrd, implementation=None):
+        self.rrd = rrd
+        self.implementation = implementation or _default
+
+    async def _execute(self, command, options, wait=True):
+        return await self.implementation(
+            self.rrd.filename, command, options, wait=wait
+        )
+
+    async def create(self, start='N', step=300, overwrite=False):
+        await self._execute(
+            "create", _create_options(self.rrd, start, step, overwrite)
+        )
+
+    async def update(self, timestamp, **kwargs):
+        await self._execute(
+            "update", _update_options(self.rrd, timestamp, kwargs)
+        )
+
+    async def fetch(self, cf, start="end-1day", end="now", resolution=None,
+                    unknown=None):
+        stdout = await self._execute(
+            "fetch", _fetch_options(cf, start, end, resolution), wait=False
+        )
+        return AsyncRRDFetchResult(
+            stdout, self.rrd._meta['datasources_list'], unknown
+        )
+
+    async def last(self):
+        stdout = await self._execute("lastupdate", [], wait=False)
+        return AsyncRRDFetchResult(
+            stdout, self.rrd._meta['datasources_list']
+        )
+
+    async def first(self, index=0):
+        stdout = await self._execute("first", _first_options(index))
+        return _convert_from_timestamp((await stdout.readline())[:-1])
@@ -0,0 +1,258 @@
+#-*- coding: utf-8 -*-
+
+"""
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import time
+import errno
+import fnmatch
+import hashlib
+import threading
+import collections
+import multiprocessing.pool
+
+try:
+    from urllib.parse import quote, unquote
+except ImportError:
+    from urllib import quote, unquote
+
+from thrush.rrd import RRDError, _convert_to_timestamp, _parse_time, \
+    _Unsupported
+
+
+class RRDCollection(object):
+    """
+        .. versionadded:: 0.4
+
+        Manages many RRD files of the same class, which are addressed
+        by string keys like ``"host1/cpu"``. The files are spread over
+        subdirectories by the hash of their key, thus no directory
+        grows too large.
+
+        A file is created on its first update. All known keys are kept
+        in memory: they are read from the directory once, when a key
+        pattern is used for the first time, and updated whenever the
+        collection creates a file. Updates to known keys do not touch
+        the file system besides rrdtool itself.
+
+        At most *concurrency* operations are executed at the same time,
+        which limits the number of rrdtool processes and the file
+        descriptors they hold. Further operations wait until one has
+        finished.
+
+        :param cls: The RRD class of all files.
+        :param directory: The root directory of the collection.
+        :param step: The step of newly created files.
+        :param levels: The number of subdirectory levels. Each level
+                       has up to 256 subdirectories.
+        :param concurrency: The maximum number of concurrent operations.
+        :param instances: The maximum number of cached RRD objects.
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            from thrush import rrd, collection
+
+            class Load(rrd.RRD):
+                load = rrd.Gauge(heartbeat=120)
+                rra = rrd.Average(xff=0.5, steps=1, rows=1440)
+
+            loads = collection.RRDCollection(Load, "/var/lib/rrd", step=60)
+            loads.update("web01/load", "N", load=0.7)
+            for key, rows in loads.fetch("web*/load", "AVERAGE"):
+                print key, rows[-1]
+    """
+    def __init__(self, cls, directory, step=300, levels=2, concurrency=16,
+                 instances=1024):
+        self.cls = cls
+        self.directory = directory
+        self.step = step
+        self.levels = levels
+        self.concurrency = concurrency
+        self.instances = instances
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._cache = collections.OrderedDict()
+        self._known = set()
+        self._indexed = False
+
+    def path(self, key):
+        """
+            :returns: The path of the file of the given key.
+        """
+        data = key if isinstance(key, bytes) else key.encode('utf-8')
+        digest = hashlib.md5(data).hexdigest()
+        shards = [digest[2 * i:2 * i + 2] for i in range(self.levels)]
+        return os.path.join(
+            self.directory, *(shards + [quote(key, safe="") + ".rrd"])
+        )
+
+    def get(self, key):
+        """
+            :returns: The RRD object of the given key. The file does
+                      not need to exist.
+        """
+        with self._lock:
+            rrd = self._cache.pop(key, None)
+            if rrd is None:
+                rrd = self.cls(self.path(key))
+                while len(self._cache) >= self.instances:
+                    self._cache.popitem(last=False)
+            self._cache[key] = rrd
+        return rrd
+
+    def _index(self):
+        # a single walk over the directory, which happens only once
+        keys = set()
+        for root, directories, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".rrd"):
+                    keys.add(unquote(name[:-4]))
+        with self._lock:
+            self._known |= keys
+            self._indexed = True
+
+    def refresh(self):
+        """
+            Reads the keys from the directory again, e.g. after files
+            have been created by another process.
+        """
+        self._index()
+
+    def keys(self, pattern="*"):
+        """
+            :param pattern: A shell-style wildcard pattern as used by
+                            :py:mod:`fnmatch`.
+
+            :returns: A sorted list of all keys of existing files that
+                      match the pattern.
+        """
+        if not self._indexed:
+            self._index()
+        with self._lock:
+            keys = list(self._known)
+        return sorted(fnmatch.filter(keys, pattern))
+
+    def _ensure(self, key, rrd, timestamp):
+        # creates the file before its first update
+        if key in self._known:
+            return
+        if not os.path.isfile(rrd.filename):
+            try:
+                start = _parse_time(_convert_to_timestamp(timestamp),
+                                    {'n': int(time.time())}) - 1
+            except _Unsupported:
+                start = "now-10s"
+
+            try:
+                os.makedirs(os.path.dirname(rrd.filename))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise RRDError(1, "creating '%s': %s" % (
+                        rrd.filename, e.strerror))
+            try:
+                rrd.create(start=start, step=self.step)
+            except RRDError:
+                # another thread or process might have been faster
+                if not os.path.isfile(rrd.filename):
+                    raise
+        with self._lock:
+            self._known.add(key)
+
+    def update(self, key, timestamp, **kwargs):
+        """
+            Updates the file of the key and creates it if necessary.
+            Takes the same arguments as ``update`` of the RRD class.
+        """
+        rrd = self.get(key)
+        with self._slots:
+            self._ensure(key, rrd, timestamp)
+            rrd.update(timestamp, **kwargs)
+
+    def _update_many(self, item):
+        key, samples = item
+        samples = list(samples)
+        if not samples:
+            return None
+        rrd = self.get(key)
+        try:
+            with self._slots:
+                self._ensure(key, rrd, samples[0][0])
+                rrd.update_many(samples)
+        except RRDError as e:
+            return key, e
+        return None
+
+    def update_many(self, samples):
+        """
+            Updates many files concurrently.
+
+            :param samples: Either a dictionary or an iterable of
+                            ``(key, samples)`` tuples, where *samples*
+                            are passed to ``update_many`` of the RRD
+                            class.
+
+            :raises: :py:class:`thrush.rrd.RRDError` after all other
+                     files have been updated, if any of them failed.
+                     If more than one file failed, the message names
+                     every failed key.
+        """
+        if isinstance(samples, dict):
+            samples = samples.items()
+        results = self._map(self._update_many, samples)
+        errors = [result for result in results if result is not None]
+        if len(errors) == 1:
+            raise errors[0][1]
+        if errors:
+            raise RRDError(1, "%d of %d files failed: %s" % (
+                len(errors), len(results),
+                "; ".join("%s: %s" % (key, e.message) for key, e in errors)))
+
+    def _fetch(self, arguments):
+        key, cf, start, end, resolution, unknown = arguments
+        with self._slots:
+            with self.get(key).fetch(cf, start, end, resolution,
+                                     unknown) as result:
+                return key, list(result.rows())
+
+    def fetch(self, pattern, cf, start="end-1day", end="now",
+              resolution=None, unknown=None):
+        """
+            Fetches all files whose keys match the pattern
+            concurrently.
+
+            :param pattern: See :py:meth:`keys`.
+
+            The other parameters are the same as for ``fetch`` of the
+            RRD class.
+
+            :returns: A generator of ``(key, rows)`` tuples in the order
+                      the fetches complete, where *rows* is a list as
+                      returned by
+                      :py:meth:`thrush.rrd.RRDFetchResult.rows`.
+
+            :raises: :py:class:`thrush.rrd.RRDError`
+        """
+        tasks = [
+            (key, cf, start, end, resolution, unknown)
+            for key in self.keys(pattern)
+        ]
+        pool = multiprocessing.pool.ThreadPool(self.concurrency)
+        try:
+            for result in pool.imap_unordered(self._fetch, tasks):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _map(self, function, items):
+        pool = multiprocessing.pool.ThreadPool(self.concurrency)
+        try:
+            return list(pool.imap_unordered(function, items))
+        finally:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,420 @@
+#-*- coding: utf-8 -*-
+
+"""
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import sys
+import json
+import mmap
+import array
+import locale
+import struct
+import threading
+from xml.etree import ElementTree
+
+from thrush.rrd import RRDError, numpy, _TIMESTAMP_TYPECODE, _execute, \
+    _float_or_nan, _convert_to_dsname
+
+try:
+    range = xrange
+except NameError:
+    pass
+
+
+class RRDDump(object):
+    """
+        .. versionadded:: 0.4
+
+        The output of rrddump_, which is parsed while it is read. The
+        header attributes are available as soon as the first row has
+        been returned by :py:meth:`rows`.
+
+        .. attribute:: version
+
+            The version of the file format as string.
+
+        .. attribute:: step
+
+            The seconds between two primary data points.
+
+        .. attribute:: last_update
+
+            The seconds since the epoch of the last update.
+
+        .. attribute:: dsnames
+
+            The names of the datasources in the order of the file.
+
+        .. attribute:: rras
+
+            A list containing a dictionary with the fields ``cf``,
+            ``pdp_per_row`` and ``xff`` for every archive.
+
+        .. _rrddump: http://oss.oetiker.ch/rrdtool/doc/rrddump.en.html
+    """
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.version = None
+        self.step = None
+        self.last_update = None
+        self.dsnames = []
+        self.rras = []
+
+    def rows(self):
+        """
+            Iterates over the rows of all archives. Only the rows of a
+            single line of the output are kept in memory.
+
+            :returns: An iterator over tuples ``(index, timestamp,
+                      values)``, where *index* is the index of the
+                      archive, *timestamp* the seconds since the epoch
+                      and *values* a tuple of floats in the order of
+                      :py:attr:`dsnames`. Unknown values are NaN.
+
+            :raises: :py:class:`thrush.rrd.RRDError`
+        """
+        target = _DumpParser(self)
+        parser = ElementTree.XMLParser(target=target)
+        try:
+            for line in self.stdout:
+                parser.feed(line + "\n")
+                if target.rows:
+                    for row in target.rows:
+                        yield row
+                    del target.rows[:]
+            parser.close()
+        except ElementTree.ParseError as e:
+            raise RRDError(-1, "unexpected output of dump: %s" % e)
+
+    def close(self):
+        self.stdout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class _DumpParser(object):
+    # a target for ElementTree.XMLParser, that fills the header of a
+    # RRDDump and collects the rows, until they are taken by rows().
+    # the time of a row is only written in the comment before it.
+    def __init__(self, dump):
+        self.dump = dump
+        self.rows = []
+        self._path = []
+        self._text = []
+        self._row = []
+        self._timestamp = None
+        self._decimal_point = locale.localeconv()['decimal_point']
+
+    def start(self, tag, attrib):
+        self._path.append(tag)
+        self._text = []
+        if tag == "row":
+            self._row = []
+        elif self._path == ["rrd", "rra"]:
+            self.dump.rras.append({})
+
+    def data(self, data):
+        self._text.append(data)
+
+    def comment(self, text):
+        _, separator, timestamp = text.rpartition("/")
+        if separator and timestamp.strip().isdigit():
+            self._timestamp = int(timestamp)
+
+    def end(self, tag):
+        path, dump = self._path, self.dump
+        text = "".join(self._text).strip()
+        if tag == "v":
+            if self._decimal_point != ".":
+                text = text.replace(self._decimal_point, ".")
+            self._row.append(_float_or_nan(text))
+        elif tag == "row":
+            if len(self._row) != len(dump.dsnames):
+                raise RRDError(-1, "unexpected output of dump")
+            self.rows.append(
+                (len(dump.rras) - 1, self._timestamp, tuple(self._row))
+            )
+        elif path == ["rrd", "version"]:
+            dump.version = text
+        elif path == ["rrd", "step"]:
+            dump.step = int(text)
+        elif path == ["rrd", "lastupdate"]:
+            dump.last_update = int(text)
+        elif path == ["rrd", "ds", "name"]:
+            dump.dsnames.append(text)
+        elif path[:2] == ["rrd", "rra"] and \
+                tag in ("cf", "pdp_per_row", "xff"):
+            if tag == "cf":
+                value = text
+            elif tag == "pdp_per_row":
+                value = int(text)
+            else:
+                value = _float_or_nan(text.replace(self._decimal_point, "."))
+            dump.rras[-1][tag] = value
+        path.pop()
+
+    def close(self):
+        return self.dump
+
+
+def dump(rrd, path=None):
+    """
+        Dumps the file of a RRD object, see ``dump``.
+    """
+    if path is not None:
+        _execute(rrd, "dump", [path])
+        return None
+    return RRDDump(_execute(rrd, "dump", [], wait=False))
+
+
+_COLUMNS_MAGIC = b"THRUSHC1"
+
+
+def export_columns(rrd, path, chunk):
+    """
+        Exports the file of a RRD object into a columnar file, see
+        ``export_columns``.
+    """
+    # the number of rows of every archive is needed in advance, to
+    # place the columns.
+    info = rrd.info()
+    width = len(info.datasources)
+    archives, offset = [], len(_COLUMNS_MAGIC)
+    for rra in info.rras:
+        rows = rra['rows']
+        archives.append({
+            'rows': rows, 'start': None, 'timestamps': offset,
+            'columns': [offset + (i + 1) * rows * 8 for i in range(width)],
+        })
+        offset += (width + 1) * rows * 8
+
+    temporary = "%s.%d.%d.tmp" % (
+        path, os.getpid(), threading.current_thread().ident
+    )
+    try:
+        with open(temporary, "wb") as f:
+            f.write(_COLUMNS_MAGIC)
+            with rrd.dump() as dump:
+                footer = _export_rows(f, dump, archives, width, chunk)
+            f.seek(offset)
+            f.write(footer)
+            f.write(struct.pack("<Q", len(footer)))
+            f.write(_COLUMNS_MAGIC)
+        os.rename(temporary, path)
+    except (IOError, OSError) as e:
+        raise RRDError(1, "writing '%s': %s" % (
+            path, getattr(e, 'strerror', None) or e))
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def _export_rows(f, dump, archives, width, chunk):
+    # rows are buffered per archive and written to every column at
+    # once, when the buffer is full.
+    written = [0] * len(archives)
+    counts = [0] * len(archives)
+    buffers = [None] * len(archives)
+
+    def flush(index):
+        timestamps, columns = buffers[index]
+        archive, position = archives[index], written[index]
+        f.seek(archive['timestamps'] + position * 8)
+        f.write(struct.pack("<%dq" % len(timestamps), *timestamps))
+        for offset, column in zip(archive['columns'], columns):
+            if sys.byteorder != "little":
+                column.byteswap()
+            f.seek(offset + position * 8)
+            column.tofile(f)
+        written[index] += len(timestamps)
+        buffers[index] = None
+
+    for index, timestamp, values in dump.rows():
+        if index >= len(archives) or len(values) != width or \
+                counts[index] >= archives[index]['rows']:
+            raise RRDError(-1, "file changed during export")
+        counts[index] += 1
+        if buffers[index] is None:
+            buffers[index] = ([], [array.array('d') for _ in values])
+        if archives[index]['start'] is None:
+            archives[index]['start'] = timestamp
+        timestamps, columns = buffers[index]
+        timestamps.append(timestamp)
+        for column, value in zip(columns, values):
+            column.append(value)
+        if len(timestamps) >= chunk:
+            flush(index)
+    for index in range(len(archives)):
+        if buffers[index] is not None:
+            flush(index)
+
+    if len(dump.rras) != len(archives) or [
+            archive['rows'] for archive in archives] != written:
+        raise RRDError(-1, "file changed during export")
+    for archive, rra in zip(archives, dump.rras):
+        archive.update(rra)
+        archive['step'] = dump.step * rra['pdp_per_row']
+    return json.dumps({
+        'version': 1,
+        'step': dump.step,
+        'last_update': dump.last_update,
+        'dsnames': dump.dsnames,
+        'archives': archives,
+    }, sort_keys=True).encode('utf-8')
+
+
+class RRDColumns(object):
+    """
+        .. versionadded:: 0.4
+
+        A file written by ``export_columns``. The file is memory mapped,
+        thus opening it does not read the values and
+        :py:meth:`to_arrays` does not copy them.
+
+        .. attribute:: step
+
+            The seconds between two primary data points.
+
+        .. attribute:: last_update
+
+            The seconds since the epoch of the last update.
+
+        .. attribute:: dsnames
+
+            The names of the datasources in the order of the columns.
+
+        .. attribute:: archives
+
+            A list containing a dictionary for every archive in the
+            order of their indexes. It contains the fields ``cf``,
+            ``pdp_per_row``, ``xff``, ``rows``, ``start`` (the seconds
+            since the epoch of the first row) and ``step`` (the seconds
+            between two rows).
+
+        :param path: The file to open.
+
+        :raises: :py:class:`ValueError` if it is not such a file.
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            from thrush.dump import RRDColumns
+
+            myrrd.export_columns("my.columns")
+            with RRDColumns("my.columns") as columns:
+                timestamps, values = columns.to_arrays(myrrd.rra.index)
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        except (mmap.error, ValueError):
+            self._file.close()
+            raise ValueError("'%s' is not a thrush columns file" % path)
+
+        magic = len(_COLUMNS_MAGIC)
+        data = self._map
+        size = len(data)
+        if size < 2 * magic + 8 or data[:magic] != _COLUMNS_MAGIC or \
+                data[size - magic:] != _COLUMNS_MAGIC:
+            self.close()
+            raise ValueError("'%s' is not a thrush columns file" % path)
+        length, = struct.unpack("<Q", data[size - magic - 8:size - magic])
+        footer = json.loads(
+            data[size - magic - 8 - length:size - magic - 8].decode('utf-8')
+        )
+
+        self.step = footer['step']
+        self.last_update = footer['last_update']
+        self.dsnames = [str(name) for name in footer['dsnames']]
+        self.archives = [
+            dict((str(key), value) for key, value in archive.items())
+            for archive in footer['archives']
+        ]
+        for archive in self.archives:
+            archive['cf'] = str(archive['cf'])
+
+    def _archive(self, index):
+        archive = self.archives[index]
+        return archive, archive['rows']
+
+    def timestamps(self, index):
+        """
+            :param index: The index of the archive.
+
+            :returns: An ``array`` containing the seconds since the
+                      epoch of every row.
+        """
+        archive, rows = self._archive(index)
+        return array.array(_TIMESTAMP_TYPECODE, struct.unpack_from(
+            "<%dq" % rows, self._map, archive['timestamps']
+        ))
+
+    def column(self, index, ds):
+        """
+            :param index: The index of the archive.
+            :param ds: The index or name of a datasource.
+
+            :returns: An ``array`` containing the values of the
+                      datasource. Unknown values are NaN.
+        """
+        archive, rows = self._archive(index)
+        if not isinstance(ds, int):
+            ds = self.dsnames.index(_convert_to_dsname(ds))
+        offset = archive['columns'][ds]
+        values = array.array('d')
+        data = self._map[offset:offset + rows * 8]
+        if hasattr(values, 'frombytes'):
+            values.frombytes(data)
+        else:
+            values.fromstring(data)
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values
+
+    def to_arrays(self, index):
+        """
+            Returns the archive as arrays like
+            :py:meth:`thrush.rrd.RRDFetchResult.to_arrays`. The arrays
+            are read-only views of the mapped file. This requires
+            NumPy_.
+
+            :param index: The index of the archive.
+
+            .. _NumPy: http://www.numpy.org
+        """
+        if numpy is None:
+            raise ImportError("to_arrays() requires numpy")
+        archive, rows = self._archive(index)
+        return numpy.frombuffer(
+            self._map, dtype='<i8', count=rows, offset=archive['timestamps']
+        ), dict(
+            (name, numpy.frombuffer(self._map, dtype='<f8', count=rows,
+                                    offset=offset))
+            for name, offset in zip(self.dsnames, archive['columns'])
+        )
+
+    def close(self):
+        """
+            Unmaps and closes the file. Arrays returned by
+            :py:meth:`to_arrays` have to be deleted before.
+        """
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,141 @@
+#-*- coding: utf-8 -*-
+
+"""
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import time
+
+from thrush.rrd import RRDError, _file_signature
+
+
+class _Follower(object):
+    # the state of a single file followed by follow()
+    def __init__(self, rrd, cf, resolution, start, unknown, signature):
+        self.rrd = rrd
+        self.cf = cf
+        self.resolution = resolution
+        self.start = start
+        self.unknown = unknown
+        self.file_signature = signature
+        self.signature = None
+        self.position = None
+
+    def _last_update(self):
+        with self.rrd.last() as result:
+            for timestamp, values in result.rows():
+                return timestamp
+        raise RRDError(-1, "unexpected output of rrdtool lastupdate")
+
+    def poll(self):
+        # nothing changed since the last poll, thus there are no new
+        # rows. a missing file might still be created later.
+        if self.file_signature is None:
+            if not self.rrd.exists():
+                return []
+        else:
+            try:
+                signature = self.file_signature(self.rrd.filename)
+            except OSError:
+                return []
+            if signature == self.signature:
+                return []
+            self.signature = signature
+
+        last_update = self._last_update()
+        position = self.position
+        if position is None and self.start is None:
+            self.position = last_update
+            return []
+        if position is not None and last_update <= position:
+            return []
+
+        # rows after the last update are not consolidated yet and are
+        # returned by a later poll.
+        rows = []
+        start = self.start if position is None else position
+        with self.rrd.fetch(self.cf, start, last_update, self.resolution,
+                            self.unknown) as result:
+            for timestamp, values in result.rows():
+                if timestamp > last_update:
+                    break
+                if position is None or timestamp > position:
+                    rows.append((timestamp, values))
+        self.position = last_update
+        return rows
+
+
+def follow(rrds, cf, resolution=None, interval=5.0, start=None,
+           unknown=None, signature=_file_signature):
+    """
+        .. versionadded:: 0.4
+
+        Follows many RRD files like ``tail -f`` in a single loop and
+        returns every consolidated row once, as soon as it is complete.
+
+        Each file is checked every *interval* seconds. Only if its
+        signature has changed, its last update is read and the rows
+        since the last returned one are fetched. Rows later than the
+        last update are returned by a later poll, after they have been
+        consolidated. Files that do not exist yet are skipped until
+        they are created.
+
+        By default the signature consists of the mtime, size and inode
+        of the file. If the file is written by rrdcached, it only
+        changes when the daemon writes the queued values to disk, thus
+        new rows are returned late. With *signature* set to ``None``
+        the last update is read on every poll instead, which always
+        finds new rows, but executes a command per file and poll.
+
+        The generator never ends by itself, thus stop iterating over it
+        to stop following the files.
+
+        :param rrds: An iterable of RRD objects, which may be of
+                     different classes.
+        :param cf: See ``fetch``.
+        :param resolution: See ``fetch``.
+        :param interval: The seconds between two polls.
+        :param start: The time of the first rows to return in any format
+                      accepted by ``fetch``. Relative times like
+                      ``end-1h`` are relative to the last update. If
+                      ``None`` only rows added after the first poll
+                      are returned.
+        :param unknown: See ``fetch``.
+        :param signature: See :py:class:`thrush.rrd.FetchCache`, or
+                          ``None`` to read the last update of every
+                          file on every poll.
+
+        :returns: A generator of ``(rrd, timestamp, values)`` tuples,
+                  where *timestamp* and *values* are the same as in
+                  :py:meth:`thrush.rrd.RRDFetchResult.rows`.
+
+        :raises: :py:class:`thrush.rrd.RRDError`
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            from thrush.follow import follow
+
+            hosts = [MyRRD(name) for name in glob.glob("hosts/*.rrd")]
+            for host, timestamp, values in follow(hosts, "AVERAGE"):
+                if values[host.load.index] > 10:
+                    print "high load on", host.filename
+    """
+    followers = [
+        _Follower(rrd, cf, resolution, start, unknown, signature)
+        for rrd in rrds
+    ]
+    deadline = time.time()
+    while True:
+        for follower in followers:
+            for timestamp, values in follower.poll():
+                yield follower.rrd, timestamp, values
+        deadline += interval
+        delay = deadline - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            # the polls took longer than the interval
+            deadline = time.time()
@@ -0,0 +1,157 @@
+#-*- coding: utf-8 -*-
+
+"""
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import hashlib
+import threading
+
+from thrush.rrd import _execute, _file_signature
+
+
+class GraphCache(object):
+    """
+        .. versionadded:: 0.4
+
+        A cache for the images rendered by ``graph`` within
+        *directory*. It is enabled for a RRD class by setting it as the
+        ``_graph_cache`` attribute and can be shared among several
+        classes and processes.
+
+        Images are stored under the hash of the arguments of the graph
+        and the signature of the RRD file. Thus an image is reused
+        until the file has been updated, even if the time window is
+        relative to now. Identical graphs requested at the same time
+        are rendered only once.
+
+        :param directory: The directory of the images. It has to
+                          exist.
+        :param entries: The maximum number of images. The least
+                        recently used images are removed first.
+        :param renders: The maximum number of concurrently rendered
+                        graphs. Further requests wait for a render to
+                        finish.
+        :param signature: See :py:class:`thrush.rrd.FetchCache`.
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            from thrush import rrd, graphcache
+
+            class MyRRD(rrd.RRD):
+                _graph_cache = graphcache.GraphCache("/var/cache/graphs")
+
+                ds = rrd.Gauge(heartbeat=600)
+                rra = rrd.Max(xff=0.5, steps=1, rows=24)
+
+        .. attribute:: hits
+
+            The number of graphs served by the cache.
+
+        .. attribute:: misses
+
+            The number of graphs that had to be rendered.
+    """
+    def __init__(self, directory, entries=1000, renders=4,
+                 signature=_file_signature):
+        self.directory = directory
+        self.entries = entries
+        self.signature = signature
+        self.hits = self.misses = 0
+        self._renders = threading.BoundedSemaphore(renders)
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def _path(self, rrd, options):
+        try:
+            signature = self.signature(rrd.filename)
+        except OSError:
+            signature = None
+        digest = hashlib.sha1()
+        for argument in [repr(signature)] + options:
+            if not isinstance(argument, bytes):
+                argument = argument.encode('utf-8')
+            digest.update(argument + b"\0")
+        extension = options[options.index("--imgformat") + 1].lower()
+        return os.path.join(
+            self.directory, "%s.%s" % (digest.hexdigest(), extension)
+        )
+
+    def _images(self):
+        images = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp") or not os.path.isfile(path):
+                continue
+            try:
+                images.append((os.stat(path).st_mtime, path))
+            except OSError:
+                pass
+        return images
+
+    def _evict(self):
+        images = self._images()
+        if len(images) <= self.entries:
+            return
+        images.sort()
+        for _, path in images[:len(images) - self.entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def render(self, rrd, options):
+        """
+            Returns the path of the cached image of the graph or
+            renders it.
+        """
+        path = self._path(rrd, options)
+        while True:
+            with self._lock:
+                if os.path.isfile(path):
+                    self.hits += 1
+                    try:
+                        # the mtime tells the last use for eviction
+                        os.utime(path, None)
+                    except OSError:
+                        pass
+                    return path
+                pending = self._pending.get(path)
+                if pending is None:
+                    pending = self._pending[path] = threading.Event()
+                    self.misses += 1
+                    break
+            # another thread renders the same graph. if it fails, this
+            # thread tries on its own.
+            pending.wait()
+
+        temporary = "%s.%d.%d.tmp" % (
+            path, os.getpid(), threading.current_thread().ident
+        )
+        try:
+            with self._renders:
+                _execute(rrd, "graph", options, filename=temporary)
+            os.rename(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            with self._lock:
+                del self._pending[path]
+            pending.set()
+
+        self._evict()
+        return path
+
+    def clear(self):
+        """
+            Removes all images.
+        """
+        for _, path in self._images():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
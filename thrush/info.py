@@ -0,0 +1,224 @@
+#-*- coding: utf-8 -*-
+
+"""
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import math
+import locale
+import threading
+import collections
+
+from thrush.rrd import RRDSchemaError, Compute, _execute, _file_signature, \
+    _float_or_nan
+
+
+class RRDInfo(object):
+    """
+        .. versionadded:: 0.4
+
+        The header of a RRD file as reported by rrdinfo_.
+
+        .. attribute:: step
+
+            The seconds between two primary data points.
+
+        .. attribute:: last_update
+
+            The seconds since the epoch of the last update.
+
+        .. attribute:: datasources
+
+            A dictionary containing a dictionary for every datasource
+            of the file, keyed by its name. It contains the fields
+            reported by rrdinfo_, e.g. ``index``, ``type``,
+            ``minimal_heartbeat``, ``min`` and ``max``.
+
+        .. attribute:: rras
+
+            A list containing a dictionary for every archive of the
+            file in the order of their indexes. It contains the fields
+            reported by rrdinfo_, e.g. ``cf``, ``rows``,
+            ``pdp_per_row`` and ``xff``.
+
+        .. attribute:: values
+
+            All fields of the output of rrdinfo_ as nested
+            dictionaries.
+
+        .. _rrdinfo: http://oss.oetiker.ch/rrdtool/doc/rrdinfo.en.html
+    """
+    def __init__(self, values):
+        self.values = values
+        self.version = values.get('rrd_version')
+        self.step = values.get('step')
+        self.last_update = values.get('last_update')
+        self.header_size = values.get('header_size')
+        self.datasources = values.get('ds', {})
+        self.rras = _indexed(values.get('rra', {}))
+        for rra in self.rras:
+            if 'cdp_prep' in rra:
+                rra['cdp_prep'] = _indexed(rra['cdp_prep'])
+        self._verified = set()
+
+    @property
+    def dsnames(self):
+        """
+            The names of the datasources in the order of the file.
+        """
+        return sorted(
+            self.datasources, key=lambda name: self.datasources[name]['index']
+        )
+
+
+def _indexed(items):
+    return [value for _, value in sorted(
+        items.items(), key=lambda item: int(item[0])
+    )]
+
+
+def _parse_info_value(value, decimal_point):
+    if value.startswith('"'):
+        return value[1:-1]
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    if decimal_point != ".":
+        value = value.replace(decimal_point, ".")
+    return _float_or_nan(value)
+
+
+def _parse_info(lines):
+    # keys look like 'step', 'ds[name].type' or 'rra[0].cdp_prep[1].value'
+    # and are parsed into nested dictionaries
+    values = {}
+    decimal_point = locale.localeconv()['decimal_point']
+    for line in lines:
+        key, separator, value = line.partition(" = ")
+        if not separator:
+            continue
+        node = values
+        parts = key.strip().split(".")
+        for i, part in enumerate(parts):
+            name, _, index = part.partition("[")
+            last = i == len(parts) - 1
+            if index:
+                node = node.setdefault(name, {})
+                name = index.rstrip("]")
+            if last:
+                node[name] = _parse_info_value(value.strip(), decimal_point)
+            else:
+                node = node.setdefault(name, {})
+    return values
+
+
+_info_cache = collections.OrderedDict()
+_info_lock = threading.Lock()
+_INFO_ENTRIES = 1024
+
+
+def read(rrd):
+    """
+        Reads the header of the file of a RRD object, see ``info``.
+    """
+    try:
+        signature = _file_signature(rrd.filename)
+    except OSError:
+        signature = None
+
+    if signature is not None:
+        with _info_lock:
+            entry = _info_cache.pop(rrd.filename, None)
+            if entry is not None and entry[0] == signature:
+                _info_cache[rrd.filename] = entry
+                return entry[1]
+
+    info = RRDInfo(_parse_info(_execute(rrd, "info", [])))
+    if signature is not None:
+        with _info_lock:
+            _info_cache[rrd.filename] = (signature, info)
+            while len(_info_cache) > _INFO_ENTRIES:
+                _info_cache.popitem(last=False)
+    return info
+
+
+def _schema_differences(rrd, info):
+    differences = []
+    declared = set()
+    for name in rrd._meta['datasources_list']:
+        ds = rrd._meta['datasources'][name]
+        declared.add(ds.name)
+        actual = info.datasources.get(ds.name)
+        if actual is None:
+            differences.append("datasource '%s' is missing" % ds.name)
+            continue
+        if actual.get('type') != ds._DST:
+            differences.append("datasource '%s' is %s instead of %s" % (
+                ds.name, actual.get('type'), ds._DST))
+        if actual.get('index') != ds.index:
+            differences.append("datasource '%s' is at index %s instead "
+                               "of %d" % (ds.name, actual.get('index'),
+                                          ds.index))
+        if isinstance(ds, Compute):
+            continue
+        expected = [
+            ('minimal_heartbeat', ds.heartbeat), ('min', ds.min),
+            ('max', ds.max)
+        ]
+        for field, value in expected:
+            if not _same_value(actual.get(field), _float_or_nan(value)):
+                differences.append("%s of datasource '%s' is %s instead "
+                                   "of %s" % (field, ds.name,
+                                              actual.get(field), value))
+    for name in info.dsnames:
+        if name not in declared:
+            differences.append("datasource '%s' is not declared" % name)
+
+    if len(info.rras) != len(rrd._meta['rras_list']):
+        differences.append("file has %d archives instead of %d" % (
+            len(info.rras), len(rrd._meta['rras_list'])))
+    for name in rrd._meta['rras_list']:
+        rra = rrd._meta['rras'][name]
+        if rra.index >= len(info.rras):
+            continue
+        actual = info.rras[rra.index]
+        if actual.get('cf') != rra.cf:
+            differences.append("cf of archive %d is %s instead of %s" % (
+                rra.index, actual.get('cf'), rra.cf))
+        expected = [
+            ('pdp_per_row', rra.steps), ('rows', rra.rows), ('xff', rra.xff)
+        ]
+        for field, value in expected:
+            if not _same_value(actual.get(field), _float_or_nan(value)):
+                differences.append("%s of archive %d is %s instead of "
+                                   "%s" % (field, rra.index,
+                                           actual.get(field), value))
+    return differences
+
+
+def _same_value(actual, expected):
+    # compares a number of rrdinfo with a declared one, where NaN
+    # stands for unknown
+    if not isinstance(actual, (int, float)):
+        return False
+    if math.isnan(expected) or math.isnan(actual):
+        return math.isnan(expected) and math.isnan(actual)
+    return abs(actual - expected) <= 1e-9 * max(abs(expected), 1.0)
+
+
+def verify(rrd):
+    """
+        Checks the file of a RRD object against its class, see
+        ``verify``.
+    """
+    info = rrd.info()
+    if type(rrd) in info._verified:
+        return info
+
+    differences = _schema_differences(rrd, info)
+    if differences:
+        raise RRDSchemaError(rrd.filename, differences)
+    info._verified.add(type(rrd))
+    return info
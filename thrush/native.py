@@ -0,0 +1,502 @@
+#-*- coding: utf-8 -*-
+
+"""
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import mmap
+import time
+import random
+import struct
+import contextlib
+
+from thrush.rrd import RRDError, _rrdtool_impl, _parse_time, _Unsupported
+
+try:
+    range = xrange
+except NameError:
+    pass
+
+_FLOAT_COOKIE = 8.642135E130
+
+
+def _align(offset, alignment):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _format_float(value):
+    # the format of rrdtool, which prints NaN in capitals
+    if value != value:
+        return "NaN"
+    return "%0.10e" % value
+
+
+class RRDFile(object):
+    """
+        .. versionadded:: 0.4
+
+        A read-only view of the binary RRD format. The file is
+        memory mapped; header, datasource and archive definitions, the
+        live header, the cdp_prep areas and the archive pointers are
+        parsed upon creation, the values of the archives only when
+        they are accessed.
+
+        Files written on the most common platforms can be read,
+        regardless of their byte order and word size.
+
+        :param filename: The path to the RRD file.
+
+        :raises: :py:class:`thrush.rrd.RRDError`
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename, 'rb') as fd:
+                self._map = mmap.mmap(
+                    fd.fileno(), 0, access=mmap.ACCESS_READ
+                )
+        except (IOError, OSError, ValueError) as e:
+            raise RRDError(1, "opening '%s': %s" % (
+                filename, getattr(e, 'strerror', None) or e))
+
+        self._size = 0
+        try:
+            self._parse()
+        except struct.error:
+            self.close()
+            raise RRDError(1, "'%s' is too small (should be %d bytes)" % (
+                filename, self._size))
+        except RRDError:
+            self.close()
+            raise
+
+    def _layout(self):
+        data = self._map
+        if data[:4] != b'RRD\0':
+            raise RRDError(1, "'%s' is not an RRD file" % self.filename)
+
+        # find the float cookie, which tells the alignment of
+        # doubles and the byte order of the file
+        for alignment in (8, 4):
+            for order in ('<', '>'):
+                cookie, = struct.unpack_from(order + 'd', data, alignment + 8)
+                if cookie == _FLOAT_COOKIE:
+                    break
+            else:
+                continue
+            break
+        else:
+            raise RRDError(1, "'%s' was written on an incompatible "
+                              "architecture" % self.filename)
+
+        # the datasource and archive counts are never zero, thus a
+        # 64bit read spanning both of them tells a 32bit long
+        word = alignment
+        if alignment == 8:
+            counts, = struct.unpack_from(order + 'Q', data, 24)
+            if counts >= 2 ** 32:
+                word = 4
+        return order, alignment, word
+
+    def _parse(self):
+        order, alignment, word = self._layout()
+        data = self._map
+        L = 'Q' if word == 8 else 'I'
+        if not data[4:8].isdigit():
+            raise RRDError(1, "'%s' is not an RRD file" % self.filename)
+        self.version = int(data[4:8].decode('ascii'))
+        offset = alignment + 16
+        self.ds_cnt, self.rra_cnt, self.pdp_step = struct.unpack_from(
+            order + L * 3, data, offset
+        )
+        offset = _align(_align(offset + 3 * word, alignment) + 80, alignment)
+
+        self.datasources = []
+        for i in range(self.ds_cnt):
+            name, dst = struct.unpack_from('20s20s', data, offset)
+            heartbeat, = struct.unpack_from(order + L, data, offset + 40)
+            minimum, maximum = struct.unpack_from(
+                order + 'dd', data, offset + 48
+            )
+            self.datasources.append({
+                'name': name.split(b'\0', 1)[0].decode('ascii'),
+                'type': dst.split(b'\0', 1)[0].decode('ascii'),
+                'minimal_heartbeat': heartbeat,
+                'min': minimum,
+                'max': maximum,
+            })
+            offset += 120
+
+        rra_def_size = _align(
+            _align(_align(20, word) + 2 * word, alignment) + 80, alignment
+        )
+        self.rras = []
+        for i in range(self.rra_cnt):
+            cf, = struct.unpack_from('20s', data, offset)
+            rows, pdp_cnt = struct.unpack_from(
+                order + L * 2, data, offset + _align(20, word)
+            )
+            xff, = struct.unpack_from(
+                order + 'd', data,
+                offset + _align(_align(20, word) + 2 * word, alignment)
+            )
+            self.rras.append({
+                'cf': cf.split(b'\0', 1)[0].decode('ascii'),
+                'rows': rows,
+                'pdp_per_row': pdp_cnt,
+                'xff': xff,
+            })
+            offset += rra_def_size
+
+        self._layout_info = (order, alignment, word)
+        self._live_head = offset
+        if self.version >= 3:
+            self.last_update, usec = struct.unpack_from(
+                order + L * 2, data, offset
+            )
+            offset += 2 * word
+        else:
+            self.last_update, = struct.unpack_from(order + L, data, offset)
+            offset += word
+
+        self._pdp_prep = offset
+        self.last_ds = []
+        for i in range(self.ds_cnt):
+            last_ds, = struct.unpack_from('30s', data, offset)
+            self.last_ds.append(last_ds.split(b'\0', 1)[0].decode('ascii'))
+            offset += 112
+
+        # cdp_prep: ten scratch values per archive and datasource
+        self._cdp_prep = offset
+        for rra in self.rras:
+            rra['cdp_prep'] = [
+                struct.unpack_from(order + 'd', data, offset + i * 80)[0]
+                for i in range(self.ds_cnt)
+            ]
+            offset += self.ds_cnt * 80
+
+        self._rra_ptr = offset
+        for rra in self.rras:
+            rra['cur_row'], = struct.unpack_from(order + L, data, offset)
+            offset += word
+
+        self.header_size = offset
+        self._row = struct.Struct(order + 'd' * self.ds_cnt)
+        for rra in self.rras:
+            rra['offset'] = offset
+            rra['step'] = rra['pdp_per_row'] * self.pdp_step
+            rra['end'] = self.last_update - self.last_update % rra['step']
+            offset += rra['rows'] * self._row.size
+        self._size = offset
+        if len(data) < offset:
+            raise struct.error()
+
+    def _start_patches(self, start):
+        # the fields rrdcreate derives from the start time. the live
+        # header holds the time of the last update, the pdp_prep area
+        # the unknown seconds of the current step and the cdp_prep
+        # area the unknown primary data points of the current row.
+        order, alignment, word = self._layout_info
+        L = order + ('Q' if word == 8 else 'I')
+        patches = [(self._live_head, struct.pack(L, start))]
+        if self.version >= 3:
+            patches.append((self._live_head + word, struct.pack(L, 0)))
+
+        unknown_seconds = start % self.pdp_step
+        for i in range(self.ds_cnt):
+            patches.append((
+                self._pdp_prep + i * 112 + _align(30, alignment),
+                struct.pack(L, unknown_seconds)
+            ))
+        for r, rra in enumerate(self.rras):
+            unknown_pdps = (start - unknown_seconds) % (
+                self.pdp_step * rra['pdp_per_row']) // self.pdp_step
+            for i in range(self.ds_cnt):
+                patches.append((
+                    self._cdp_prep + (r * self.ds_cnt + i) * 80 + 8,
+                    struct.pack(L, unknown_pdps)
+                ))
+        return patches
+
+    def _cur_row_patches(self):
+        # rrdcreate starts every archive at a random row, thus files
+        # created at the same time do not write the same blocks.
+        order, alignment, word = self._layout_info
+        L = order + ('Q' if word == 8 else 'I')
+        return [
+            (self._rra_ptr + r * word,
+             struct.pack(L, random.randrange(rra['rows'])))
+            for r, rra in enumerate(self.rras)
+        ]
+
+    @property
+    def dsnames(self):
+        return [ds['name'] for ds in self.datasources]
+
+    def first(self, index=0):
+        """
+            :returns: The timestamp of the first row of the archive
+                      with the given index.
+        """
+        if not 0 <= index < self.rra_cnt:
+            raise RRDError(1, "invalid rraindex number")
+        rra = self.rras[index]
+        return rra['end'] - (rra['rows'] - 1) * rra['step']
+
+    def row(self, index, timestamp):
+        """
+            :returns: A tuple with the values of all datasources of
+                      the archive with the given index at the given
+                      time, or ``None`` if the time is not covered
+                      by the archive.
+        """
+        rra = self.rras[index]
+        back, remainder = divmod(rra['end'] - timestamp, rra['step'])
+        if remainder or not 0 <= back < rra['rows']:
+            return None
+        position = (rra['cur_row'] - back) % rra['rows']
+        return self._row.unpack_from(
+            self._map, rra['offset'] + position * self._row.size
+        )
+
+    def choose(self, cf, start, end, resolution=1):
+        """
+            Selects an archive for the given time range the same way
+            rrdfetch_ does it.
+
+            :returns: The index of the chosen archive.
+
+            .. _rrdfetch: http://oss.oetiker.ch/rrdtool/doc/rrdfetch.en.html
+        """
+        full = part = None
+        for i, rra in enumerate(self.rras):
+            if rra['cf'] != cf:
+                continue
+
+            cal_end = rra['end']
+            cal_start = cal_end - rra['rows'] * rra['step']
+            step_diff = abs(resolution - rra['step'])
+            if cal_end >= end and cal_start <= start:
+                if full is None or step_diff < full[0]:
+                    full = (step_diff, i)
+            else:
+                # the covered part of the requested range
+                match = end - start
+                if cal_start > start:
+                    match -= cal_start - start
+                if cal_end < end:
+                    match -= end - cal_end
+                if part is None or match > part[0] or \
+                        (match == part[0] and step_diff < part[1]):
+                    part = (match, step_diff, i)
+
+        if full is not None:
+            return full[1]
+        if part is not None:
+            return part[2]
+        raise RRDError(
+            1, "the RRD does not contain an RRA matching the chosen CF"
+        )
+
+    def fetch(self, cf, start, end, resolution=1):
+        """
+            Fetches the rows of the best matching archive.
+
+            :returns: A tuple ``(start, end, step, rows)``. *rows* is a
+                      generator of ``(timestamp, values)`` tuples, where
+                      values not covered by the archive are NaN.
+        """
+        if start > end:
+            raise RRDError(1, "start (%d) should be less than end (%d)" % (
+                start, end))
+
+        index = self.choose(cf.upper(), start, end, resolution)
+        step = self.rras[index]['step']
+        start -= start % step
+        end += step - end % step
+        unknown = (float('nan'),) * self.ds_cnt
+
+        def rows():
+            for timestamp in range(start + step, end + step, step):
+                yield timestamp, self.row(index, timestamp) or unknown
+
+        return start, end, step, rows()
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class _NativeOutput(object):
+    def __init__(self, lines):
+        self._lines = lines
+
+    def __iter__(self):
+        for line in self._lines:
+            yield line
+
+    def readline(self):
+        for line in self._lines:
+            return line + "\n"
+        return ""
+
+    def close(self):
+        close = getattr(self._lines, 'close', None)
+        if close is not None:
+            close()
+
+
+class NativeReader(object):
+    """
+        .. versionadded:: 0.4
+
+        An implementation that serves ``fetch``, ``first``, ``last``,
+        ``lastupdate`` and ``info`` by reading the RRD file directly,
+        without starting any process. All other commands, as well as
+        time references that cannot be resolved without rrdtool, are
+        passed to the *fallback* implementation.
+
+        :param fallback: The implementation used for the commands that
+                         cannot be served natively. If set to ``None``
+                         such commands raise a
+                         :py:class:`thrush.rrd.RRDError`.
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            from thrush import rrd, native
+
+            class MyRRD(rrd.RRD):
+                _impl = native.NativeReader()
+
+                ds = rrd.Gauge(heartbeat=600)
+                rra = rrd.Max(xff=0.5, steps=1, rows=24)
+    """
+    def __init__(self, fallback=_rrdtool_impl):
+        self.fallback = fallback
+        self._commands = {
+            'fetch': self._fetch,
+            'first': self._first,
+            'last': self._last,
+            'lastupdate': self._lastupdate,
+            'info': self._info,
+        }
+
+    def __call__(self, filename, command, options, wait=True):
+        handler = self._commands.get(command)
+        if handler is not None:
+            try:
+                lines = handler(filename, list(options))
+                if wait:
+                    lines = list(lines)
+                return _NativeOutput(iter(lines))
+            except _Unsupported:
+                pass
+
+        if self.fallback is None:
+            raise RRDError(
+                1, "'%s %s' is not supported natively" % (command, filename)
+            )
+        return self.fallback(filename, command, options, wait=wait)
+
+    def _fetch(self, filename, options):
+        cf = options.pop(0)
+        arguments = {'--start': "end-1day", '--end': "now",
+                     '--resolution': "1"}
+        while options:
+            option = options.pop(0)
+            if option not in arguments or not options:
+                raise _Unsupported(option)
+            arguments[option] = options.pop(0)
+
+        resolution = int(arguments['--resolution'])
+        end = _parse_time(arguments['--end'], {'n': int(time.time())})
+        start = _parse_time(arguments['--start'], {
+            'n': int(time.time()), 'e': end
+        })
+        rrd = RRDFile(filename)
+        try:
+            start, end, step, rows = rrd.fetch(cf, start, end, resolution)
+        except RRDError:
+            rrd.close()
+            raise
+        return self._format_fetch(rrd, rows)
+
+    def _format_fetch(self, rrd, rows):
+        with contextlib.closing(rrd):
+            yield "".join("%20s" % name for name in rrd.dsnames)
+            yield ""
+            for timestamp, values in rows:
+                yield "%d: %s" % (
+                    timestamp, " ".join("%0.10e" % v for v in values)
+                )
+
+    def _first(self, filename, options):
+        index = 0
+        if options[:1] == ["--rraindex"] and len(options) == 2:
+            index = int(options[1])
+        elif options:
+            raise _Unsupported(options[0])
+        with RRDFile(filename) as rrd:
+            return ["%d" % rrd.first(index)]
+
+    def _last(self, filename, options):
+        if options:
+            raise _Unsupported(options[0])
+        with RRDFile(filename) as rrd:
+            return ["%d" % rrd.last_update]
+
+    def _lastupdate(self, filename, options):
+        if options:
+            raise _Unsupported(options[0])
+        with RRDFile(filename) as rrd:
+            return [
+                "".join(" %s" % name for name in rrd.dsnames),
+                "",
+                "%d: %s" % (rrd.last_update, " ".join(rrd.last_ds))
+            ]
+
+    def _info(self, filename, options):
+        if options:
+            raise _Unsupported(options[0])
+        with RRDFile(filename) as rrd:
+            lines = [
+                'filename = "%s"' % filename,
+                'rrd_version = "%04d"' % rrd.version,
+                'step = %d' % rrd.pdp_step,
+                'last_update = %d' % rrd.last_update,
+                'header_size = %d' % rrd.header_size,
+            ]
+            for i, ds in enumerate(rrd.datasources):
+                prefix = "ds[%s]." % ds['name']
+                lines += [
+                    prefix + 'index = %d' % i,
+                    prefix + 'type = "%s"' % ds['type'],
+                    prefix + 'minimal_heartbeat = %d' %
+                    ds['minimal_heartbeat'],
+                    prefix + 'min = %s' % _format_float(ds['min']),
+                    prefix + 'max = %s' % _format_float(ds['max']),
+                    prefix + 'last_ds = "%s"' % rrd.last_ds[i],
+                ]
+            for i, rra in enumerate(rrd.rras):
+                prefix = "rra[%d]." % i
+                lines += [
+                    prefix + 'cf = "%s"' % rra['cf'],
+                    prefix + 'rows = %d' % rra['rows'],
+                    prefix + 'cur_row = %d' % rra['cur_row'],
+                    prefix + 'pdp_per_row = %d' % rra['pdp_per_row'],
+                    prefix + 'xff = %s' % _format_float(rra['xff']),
+                ]
+                lines += [
+                    prefix + 'cdp_prep[%d].value = %s' % (
+                        j, _format_float(value))
+                    for j, value in enumerate(rra['cdp_prep'])
+                ]
+            return lines
@@ -0,0 +1,199 @@
+#-*- coding: utf-8 -*-
+
+"""
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+from subprocess import Popen, PIPE, STDOUT
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from thrush.rrd import RRDError, RRDLines
+
+
+def _quote(argument):
+    # rrdtool splits pipe-mode commands at whitespace but honours
+    # single and double quotes, so wrap every argument that would
+    # otherwise be split.
+    if '\n' in argument or '\r' in argument:
+        raise RRDError(-1, "newline in argument %r" % argument)
+    if argument and not any(c in argument for c in ' \t\'"'):
+        return argument
+    if '"' not in argument:
+        return '"%s"' % argument
+    if "'" not in argument:
+        return "'%s'" % argument
+    raise RRDError(-1, "cannot quote argument %r" % argument)
+
+
+def _line_length(line):
+    if not isinstance(line, bytes):
+        line = line.encode('utf-8')
+    return len(line)
+
+
+class _PipeProcess(object):
+    def __init__(self, binary, env, max_line):
+        self.binary = binary
+        self.env = env
+        self.max_line = max_line
+        self.process = None
+
+    def _start(self):
+        self.process = Popen(
+            [self.binary, '-'], env=self.env, stdin=PIPE, stdout=PIPE,
+            stderr=STDOUT, universal_newlines=True
+        )
+
+    def _kill(self):
+        process, self.process = self.process, None
+        if process is None:
+            return
+        try:
+            process.kill()
+        except OSError:
+            pass
+        process.wait()
+        for stream in (process.stdin, process.stdout):
+            try:
+                stream.close()
+            except (IOError, OSError):
+                pass
+
+    def execute(self, arguments):
+        line = " ".join(_quote(arg) for arg in arguments) + "\n"
+
+        # rrdtool would split a longer line into several commands and
+        # answer each of them, thus every later answer would belong to
+        # the wrong command.
+        if _line_length(line) > self.max_line:
+            raise RRDError(-1, "command exceeds %d bytes of rrdtool "
+                               "pipe mode" % self.max_line)
+
+        # restart a child that died while it was idle. the command
+        # was not sent yet, thus nothing is lost by doing so.
+        if self.process is None or self.process.poll() is not None:
+            self._kill()
+            self._start()
+
+        output, error = [], None
+        try:
+            self.process.stdin.write(line)
+            self.process.stdin.flush()
+            for answer in iter(self.process.stdout.readline, ""):
+                answer = answer.rstrip("\r\n")
+                if answer.startswith("OK "):
+                    return output
+                if answer.startswith("ERROR"):
+                    error = answer.partition(":")[2].strip()
+                    break
+                output.append(answer)
+        except (IOError, OSError) as e:
+            output.append(str(e))
+        except BaseException:
+            # e.g. a UnicodeDecodeError or KeyboardInterrupt. the rest
+            # of the answer is still unread and would be taken as the
+            # answer of the next command.
+            self._kill()
+            raise
+        if error is not None:
+            raise RRDError(1, error)
+
+        # the child died in the middle of a command. it is restarted
+        # on the next call, but we cannot know whether the command
+        # was executed or not.
+        code = self.process.poll()
+        self._kill()
+        raise RRDError(
+            -1 if code is None else code,
+            "rrdtool pipe terminated unexpectedly: %s" % "\n".join(output)
+        )
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.process.wait()
+        self.process.stdout.close()
+        self.process = None
+
+
+class RRDToolPipe(object):
+    """
+        .. versionadded:: 0.4
+
+        An implementation that keeps long running ``rrdtool -``
+        processes and sends all commands through their standard
+        input, instead of starting a new process for every command.
+
+        The processes are started on first use. Each command is
+        executed by exactly one idle process; if all processes are
+        busy the calling thread blocks until one becomes available.
+        Thus an instance can safely be shared among threads. A
+        process that crashed will be restarted automatically.
+
+        :param processes: The number of ``rrdtool`` processes to keep.
+        :param binary: The name or path of the ``rrdtool`` executable.
+        :param env: The environment for the processes. Defaults to
+                    ``os.environ``.
+        :param max_line: The maximum length of a command line in bytes
+                         including the newline. rrdtool reads commands
+                         into a buffer of 10000 bytes, of which fgets
+                         fills at most 9998. ``update_many`` and
+                         ``xport`` split their arguments accordingly,
+                         longer commands raise a
+                         :py:class:`thrush.rrd.RRDError`.
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            from thrush import rrd, pipe
+
+            class MyRRD(rrd.RRD):
+                _impl = pipe.RRDToolPipe(processes=2)
+
+                ds = rrd.Gauge(heartbeat=600)
+                rra = rrd.Max(xff=0.5, steps=1, rows=24)
+    """
+    def __init__(self, processes=1, binary="rrdtool", env=None,
+                 max_line=9998):
+        if processes < 1:
+            raise ValueError("need at least one process")
+        self.max_line = max_line
+        self._idle = queue.Queue()
+        self._processes = [
+            _PipeProcess(binary, os.environ if env is None else env,
+                         max_line)
+            for _ in range(processes)
+        ]
+        for process in self._processes:
+            self._idle.put(process)
+
+    def __call__(self, filename, command, options, wait=True):
+        process = self._idle.get()
+        try:
+            lines = process.execute([command, filename] + list(options))
+        finally:
+            self._idle.put(process)
+        return RRDLines(lines)
+
+    def close(self):
+        """
+            Terminates all ``rrdtool`` processes. They will be started
+            again if the object is used afterwards.
+        """
+        for _ in self._processes:
+            process = self._idle.get()
+            try:
+                process.close()
+            finally:
+                self._idle.put(process)
@@ -7,16 +7,67 @@
 
 import re
 import os
+import sys
 import datetime
 import time
 import locale
 import functools
 import math
 import contextlib
+import collections
+import weakref
+import atexit
+import codecs
+import struct
+import array
+import shutil
+import errno
+import tempfile
+import threading
+import multiprocessing
+import multiprocessing.pool
 from subprocess import Popen, PIPE, STDOUT
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    _clock = time.perf_counter
+except AttributeError:
+    _clock = time.time
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+
+try:
+    range = xrange
+except NameError:
+    pass
+
 _dsname_re = re.compile('[^a-zA-Z0-9_]')
 _fetch_re = re.compile('[0-9]+: .+')
+_POINTER_SIZE = struct.calcsize('P')
+_TIMESTAMP_TYPECODE = 'q' if 'q' in getattr(array, 'typecodes', '') else 'l'
+_time_re = re.compile(
+    r'^(now|n|end|e|start|s)?((?:[+-]\d+[a-z]*)*)$'
+)
+_offset_re = re.compile(r'([+-])(\d+)([a-z]*)')
+_units = {
+    '': 1, 's': 1, 'sec': 1, 'second': 1, 'seconds': 1,
+    'min': 60, 'minute': 60, 'minutes': 60,
+    'h': 3600, 'hour': 3600, 'hours': 3600,
+    'd': 86400, 'day': 86400, 'days': 86400,
+    'w': 604800, 'week': 604800, 'weeks': 604800,
+}
 
 
 def _convert_to_dsname(name):
@@ -26,13 +77,21 @@ def _convert_to_dsname(name):
     return _dsname_re.sub('', name)[:19]
 
 
+def _convert_to_argument(value):
+    # converts a value into a single command line argument.
+    # floats are converted without losing precision.
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
 def _convert_to_timestamp(timeinfo):
     # converts a (date)time object into a timestamp
     # or just get the string representation of whatever
     # was passed
     if isinstance(timeinfo, datetime.datetime):
         timeinfo = int(time.mktime(timeinfo.timetuple()))
-    return repr(timeinfo)
+    return _convert_to_argument(timeinfo)
 
 
 def _convert_from_timestamp(timestamp):
@@ -53,6 +112,224 @@ def _convert_float(unknown, value):
     return value
 
 
+def _float_or_nan(value):
+    try:
+        return float(value)
+    except ValueError:
+        return float("nan")
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _parse_time(value, references):
+    # parses the subset of at-style time references that can be
+    # resolved without a calendar: an epoch, now/start/end and
+    # offsets in seconds, minutes, hours, days or weeks.
+    value = value.strip().lower().replace(' ', '')
+    if value.isdigit():
+        return int(value)
+
+    match = _time_re.match(value)
+    if match is None or not (match.group(1) or match.group(2)):
+        raise _Unsupported(value)
+
+    reference = (match.group(1) or 'now')[0]
+    if references.get(reference) is None:
+        raise _Unsupported(value)
+
+    result = references[reference]
+    for sign, amount, unit in _offset_re.findall(match.group(2)):
+        if unit not in _units:
+            raise _Unsupported(value)
+        amount = int(amount) * _units[unit]
+        result += amount if sign == '+' else -amount
+    return result
+
+
+class Instrumentation(object):
+    """
+        .. versionadded:: 0.4
+
+        The base class for receiving measurements of thrush. All
+        methods do nothing, thus subclasses only need to implement the
+        measurements they are interested in. An instance is activated
+        with :py:func:`set_instrumentation`.
+
+        *command* is always the name of the rrdtool command, like
+        ``"fetch"`` or ``"update"``. The methods can be called from
+        several threads at the same time.
+    """
+    def executed(self, command, seconds):
+        """
+            Called after a command was passed to the implementation of
+            a RRD class. For commands that stream their output, like
+            ``fetch``, this does not include reading the output.
+        """
+
+    def failed(self, command, errorcode):
+        """
+            Called whenever a command raised a
+            :py:class:`thrush.rrd.RRDError`, either immediately or
+            while its output was read.
+        """
+
+    def spawned(self, command, seconds):
+        """
+            Called after an rrdtool process was started.
+        """
+
+    def waited(self, command, seconds):
+        """
+            Called after the output of an rrdtool process was read
+            completely and the process terminated, for commands that
+            are not streamed.
+        """
+
+    def read(self, command, size, seconds):
+        """
+            Called after the output of an rrdtool process was read,
+            with the number of bytes read and the seconds spent in
+            reading.
+        """
+
+    def parsed(self, rows, seconds):
+        """
+            Called after iterating a :py:class:`RRDFetchResult`, with
+            the number of rows and the seconds spent in parsing them,
+            including the conversion to :py:class:`datetime` objects.
+        """
+
+
+def _percentile(durations, percent):
+    # nearest-rank percentile of a sorted list
+    if not durations:
+        return None
+    index = int(math.ceil(percent / 100.0 * len(durations))) - 1
+    return durations[min(max(index, 0), len(durations) - 1)]
+
+
+class InstrumentationRecorder(Instrumentation):
+    """
+        .. versionadded:: 0.4
+
+        Aggregates all measurements in memory. For every kind of
+        measurement and command the number of occurrences and the sum
+        of the durations are kept, as well as the last *samples*
+        durations to calculate percentiles.
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            recorder = rrd.InstrumentationRecorder()
+            rrd.set_instrumentation(recorder)
+            ...
+            print recorder.summary()["spawned"]["fetch"]["p99"]
+    """
+    def __init__(self, samples=1024):
+        self.samples = samples
+        self._lock = threading.Lock()
+        self.clear()
+
+    def _record(self, kind, command, seconds, amount=0):
+        with self._lock:
+            entries = self._entries.setdefault(kind, {})
+            entry = entries.get(command)
+            if entry is None:
+                entry = entries[command] = {
+                    'count': 0, 'seconds': 0.0, 'amount': 0,
+                    'durations': collections.deque(maxlen=self.samples)
+                }
+            entry['count'] += 1
+            entry['seconds'] += seconds
+            entry['amount'] += amount
+            entry['durations'].append(seconds)
+
+    def executed(self, command, seconds):
+        self._record('executed', command, seconds)
+
+    def failed(self, command, errorcode):
+        self._record('failed', command, 0.0)
+
+    def spawned(self, command, seconds):
+        self._record('spawned', command, seconds)
+
+    def waited(self, command, seconds):
+        self._record('waited', command, seconds)
+
+    def read(self, command, size, seconds):
+        self._record('read', command, seconds, size)
+
+    def parsed(self, rows, seconds):
+        self._record('parsed', None, seconds, rows)
+
+    def percentile(self, kind, command, percent):
+        """
+            :returns: The given percentile of the recent durations of a
+                      kind of measurement, or ``None`` if nothing was
+                      recorded.
+        """
+        with self._lock:
+            entry = self._entries.get(kind, {}).get(command)
+            durations = sorted(entry['durations']) if entry else []
+        return _percentile(durations, percent)
+
+    def summary(self):
+        """
+            :returns: A dictionary with the kind of measurement as key,
+                      i.e. the name of the method of
+                      :py:class:`Instrumentation`. Each value is a
+                      dictionary with the command as key (``None`` for
+                      ``parsed``) and a dictionary containing
+                      ``count``, ``seconds``, ``amount`` (bytes read or
+                      rows parsed), ``p50``, ``p90``, ``p99`` and
+                      ``max`` as value.
+        """
+        with self._lock:
+            keys = [
+                (kind, command,
+                 dict(entry, durations=list(entry['durations'])))
+                for kind, entries in self._entries.items()
+                for command, entry in entries.items()
+            ]
+
+        result = {}
+        for kind, command, entry in keys:
+            durations = sorted(entry.pop('durations'))
+            for percent in (50, 90, 99):
+                entry['p%d' % percent] = _percentile(durations, percent)
+            entry['max'] = durations[-1] if durations else None
+            result.setdefault(kind, {})[command] = entry
+        return result
+
+    def clear(self):
+        """
+            Removes all recorded measurements.
+        """
+        with self._lock:
+            self._entries = {}
+
+
+_instrumentation = None
+
+
+def set_instrumentation(instrumentation):
+    """
+        .. versionadded:: 0.4
+
+        Activates an :py:class:`Instrumentation` for all RRD classes.
+        Passing ``None`` deactivates the instrumentation, which is the
+        default.
+
+        :returns: The previously active instrumentation.
+    """
+    global _instrumentation
+    previous, _instrumentation = _instrumentation, instrumentation
+    return previous
+
+
 class RRDError(Exception):
     def __init__(self, errorcode, message):
         self.errorcode = errorcode
@@ -66,14 +343,68 @@ class RRDError(Exception):
         return str(self)
 
 
+class RRDUpdateError(RRDError):
+    """
+        .. versionadded:: 0.4
+
+        Raised by ``update_many`` if one of the ``rrdupdate``
+        executions failed or a sample is invalid.
+
+        .. attribute:: chunk
+
+            The index of the failed ``rrdupdate`` execution.
+
+        .. attribute:: committed
+
+            The number of samples that were written by the successful
+            executions before the failed one.
+
+        .. attribute:: samples
+
+            The list of ``(timestamp, values)`` tuples that were sent
+            with the failed execution. rrdtool stops at the first
+            invalid sample, thus samples preceding it in this list might
+            have been written nevertheless.
+    """
+    def __init__(self, errorcode, message, chunk, committed, samples):
+        super(RRDUpdateError, self).__init__(errorcode, message)
+        self.chunk = chunk
+        self.committed = committed
+        self.samples = samples
+
+    def __str__(self):
+        return "chunk %d (%d samples committed before): %s" % (
+            self.chunk, self.committed,
+            super(RRDUpdateError, self).__str__())
+
+
+class RRDSchemaError(RRDError):
+    """
+        .. versionadded:: 0.4
+
+        Raised by ``verify``, when a RRD file does not match the
+        datasources and archives of its class.
+
+        .. attribute:: differences
+
+            A list of strings describing every difference.
+    """
+    def __init__(self, filename, differences):
+        super(RRDSchemaError, self).__init__(
+            -1, "'%s' does not match its class: %s" % (
+                filename, "; ".join(differences))
+        )
+        self.differences = differences
+
+
 class DataSource(object):
     """
         Base class for all Data Source Types.
     """
     def __init__(self, heartbeat, min='U', max='U'):
-        self.heartbeat = repr(heartbeat)
-        self.min = repr(min)
-        self.max = repr(max)
+        self.heartbeat = _convert_to_argument(heartbeat)
+        self.min = _convert_to_argument(min)
+        self.max = _convert_to_argument(max)
 
     def __str__(self):
         return "DS:%s:%s:%s:%s:%s" % (
@@ -135,9 +466,9 @@ class RRA(object):
     """
 
     def __init__(self, xff, steps, rows):
-        self.xff = repr(xff)
-        self.steps = repr(steps)
-        self.rows = repr(rows)
+        self.xff = _convert_to_argument(xff)
+        self.steps = _convert_to_argument(steps)
+        self.rows = _convert_to_argument(rows)
 
     def __repr__(self):
         return "RRA:%s:%s:%s:%s" % (
@@ -176,6 +507,62 @@ class Last(RRA):
     _CF = "LAST"
 
 
+class GraphElement(object):
+    """
+        .. versionadded:: 0.4
+
+        Base class for all elements of a graph. An element draws the
+        values of a datasource.
+    """
+    def __init__(self, ds, color, legend=None):
+        self.ds = ds
+        self.color = color
+        self.legend = legend
+
+    def _legend(self):
+        # colons separate the fields of an element
+        if self.legend is None:
+            return ""
+        return ":" + self.legend.replace(":", "\\:")
+
+    def __repr__(self):
+        return str(self)
+
+
+class Line(GraphElement):
+    """
+        .. versionadded:: 0.4
+
+        Draws a line of *width* pixels.
+    """
+    def __init__(self, ds, color="#0000ff", width=1, legend=None):
+        super(Line, self).__init__(ds, color, legend)
+        self.width = _convert_to_argument(width)
+
+    def __str__(self):
+        return "LINE%s:%s%s%s" % (
+            self.width, self.ds.name, self.color, self._legend()
+        )
+
+
+class Area(GraphElement):
+    """
+        .. versionadded:: 0.4
+
+        Fills the area below the values. If *stack* is set, the area
+        is stacked onto the previous element.
+    """
+    def __init__(self, ds, color="#0000ff", legend=None, stack=False):
+        super(Area, self).__init__(ds, color, legend)
+        self.stack = stack
+
+    def __str__(self):
+        legend = self._legend()
+        if self.stack:
+            legend = (legend or ":") + ":STACK"
+        return "AREA:%s%s%s" % (self.ds.name, self.color, legend)
+
+
 class RRDFetchResult(object):
     """
         An object of this class can be iterated. On every iteration
@@ -191,6 +578,11 @@ class RRDFetchResult(object):
         use. This can be achieved automatically by using this
         object within a ``with`` statement.
 
+        .. versionchanged:: 0.4
+            Errors of ``rrdtool`` are raised as
+            :py:class:`thrush.rrd.RRDError` while iterating, as soon
+            as they occur.
+
         *Example*:
 
         .. sourcecode:: python
@@ -209,18 +601,175 @@ class RRDFetchResult(object):
         self.dsnames = [_convert_to_dsname(name) for name in dsnames]
         self.unknown = unknown
 
+    def _parse_line(self, line):
+        match = _fetch_re.match(line)
+        if match is None:
+            return None
+
+        timestamp, values = line.split(":", 1)
+        func = functools.partial(_convert_float, self.unknown)
+        converted_values = map(func, values.strip().split(' '))
+        return _convert_from_timestamp(timestamp), dict(
+            zip(self.dsnames, converted_values)
+        )
+
     def __iter__(self):
+        instrumentation = _instrumentation
+        if instrumentation is not None:
+            for row in self._instrumented(instrumentation, self._parse_line):
+                yield row
+            return
+
         for line in self.stdout:
-            match = _fetch_re.match(line)
-            if match is None:
-                continue
-
-            timestamp, values = line.split(":", 1)
-            func = functools.partial(_convert_float, self.unknown)
-            converted_values = map(func, values.strip().split(' '))
-            yield _convert_from_timestamp(timestamp), dict(
-                zip(self.dsnames, converted_values)
-            )
+            row = self._parse_line(line)
+            if row is not None:
+                yield row
+
+    def _instrumented(self, instrumentation, parse):
+        rows, seconds = 0, 0.0
+        try:
+            for line in self.stdout:
+                start = _clock()
+                row = parse(line)
+                seconds += _clock() - start
+                if row is not None:
+                    rows += 1
+                    yield row
+        finally:
+            instrumentation.parsed(rows, seconds)
+
+    def _row_parser(self):
+        # builds the parser for rows() once per result, thus nothing
+        # but splitting and float() is done per line.
+        decimal_point = locale.localeconv()['decimal_point']
+        unknown = self.unknown
+
+        def parse(line):
+            timestamp, _, values = line.partition(":")
+            timestamp = timestamp.strip()
+            if not values or not timestamp.isdigit():
+                return None
+            if decimal_point != ".":
+                values = values.replace(decimal_point, ".")
+            values = values.split()
+            try:
+                values = tuple(map(float, values))
+            except ValueError:
+                # lastupdate reports unknown values as 'U'
+                values = tuple(map(_float_or_nan, values))
+            if unknown is not None:
+                values = tuple(
+                    unknown if value != value else value for value in values
+                )
+            return int(timestamp), values
+        return parse
+
+    def rows(self):
+        """
+            .. versionadded:: 0.4
+
+            Iterates over the result like iterating over the object
+            itself, but much faster, as no :py:class:`datetime` objects
+            and dictionaries are created.
+
+            :returns: An iterator over tuples ``(timestamp, values)``,
+                      where *timestamp* are the seconds since the epoch
+                      as integer and *values* a tuple containing a float
+                      for every datasource. The values are in the order
+                      of the datasources in the RRD, which is also
+                      available as the ``index`` attribute of each
+                      datasource. Unknown values are NaN, unless the
+                      *unknown* parameter of ``fetch`` was set.
+
+            *Example*:
+
+            .. sourcecode:: python
+
+                with myrrd.fetch(myrrd.rra.cf) as result:
+                    for timestamp, values in result.rows():
+                        print timestamp, values[myrrd.ds.index]
+        """
+        parse = self._row_parser()
+        instrumentation = _instrumentation
+        if instrumentation is not None:
+            for row in self._instrumented(instrumentation, parse):
+                yield row
+            return
+
+        for line in self.stdout:
+            row = parse(line)
+            if row is not None:
+                yield row
+
+    def materialize(self):
+        """
+            .. versionadded:: 0.4
+
+            Reads the whole result into a
+            :py:class:`thrush.rrd.RRDSeries`, which needs much less
+            memory than a list of the rows, and closes the result.
+
+            :raises: :py:class:`ValueError` if the rows are not evenly
+                     spaced.
+        """
+        try:
+            series = RRDSeries(None, None, self.dsnames)
+            for timestamp, values in self.rows():
+                series._append(timestamp, values)
+            return series
+        finally:
+            self.close()
+
+    def to_arrays(self):
+        """
+            .. versionadded:: 0.4
+
+            Reads the complete output at once into columns. This
+            requires NumPy_ and is much faster than iterating over
+            the result, if the values are processed with NumPy anyway.
+
+            :returns: A tuple ``(timestamps, values)``. *timestamps* is
+                      an ``int64`` array containing the seconds since
+                      the epoch. *values* is a dictionary containing a
+                      contiguous ``float64`` array for every datasource.
+                      Unknown values are always NaN.
+
+            *Example*:
+
+            .. sourcecode:: python
+
+                with myrrd.fetch(myrrd.rra.cf) as result:
+                    timestamps, values = result.to_arrays()
+                    print values[myrrd.ds.name].mean()
+
+            .. _NumPy: http://www.numpy.org
+        """
+        if numpy is None:
+            raise ImportError("to_arrays() requires numpy")
+        return self._arrays(list(self.stdout))
+
+    def _arrays(self, lines):
+        # the rows follow the header and an empty line
+        body = lines[lines.index("") + 1:] if "" in lines else []
+        while body and body[-1] == "":
+            body.pop()
+
+        # lastupdate reports unknown values as 'U'
+        text = "\n".join(body).replace(":", " ").replace(" U", " nan")
+        decimal_point = locale.localeconv()['decimal_point']
+        if decimal_point != ".":
+            text = text.replace(decimal_point, ".")
+
+        columns = len(self.dsnames) + 1
+        data = numpy.fromstring(text, dtype=numpy.float64, sep=" ")
+        if data.size != len(body) * columns:
+            raise ValueError("unexpected output of rrdtool")
+        data = data.reshape(len(body), columns)
+
+        return data[:, 0].astype(numpy.int64), dict(
+            (name, numpy.ascontiguousarray(data[:, i + 1]))
+            for i, name in enumerate(self.dsnames)
+        )
 
     def close(self):
         """
@@ -238,71 +787,895 @@ class RRDFetchResult(object):
         self.close()
 
 
-def _rrdtool_impl(filename, command, options, wait=True):
-    class RRDOutput(object):
+class RRDSeries(object):
+    """
+        .. versionadded:: 0.4
+
+        A fetch result kept in memory. Only the time of the first row
+        and the step are stored, the values of all rows are stored in a
+        single ``array`` of floats, thus a value takes 8 bytes. Unknown
+        values are NaN, unless *unknown* was set for ``fetch``.
+
+        The object is a sequence of ``(timestamp, values)`` tuples like
+        :py:meth:`thrush.rrd.RRDFetchResult.rows`, which are created
+        while iterating. Indexing by a slice returns another
+        :py:class:`thrush.rrd.RRDSeries`.
+
+        .. attribute:: start
+
+            The seconds since the epoch of the first row or ``None`` if
+            there are no rows.
+
+        .. attribute:: step
+
+            The seconds between two rows or ``None`` if there are less
+            than two rows.
+
+        .. attribute:: dsnames
+
+            The names of the datasources in the order of the values.
+
+        .. attribute:: values
+
+            An ``array`` containing the values row by row.
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            series = myrrd.fetch(myrrd.rra.cf).materialize()
+            for timestamp, values in series.between(start, end):
+                print timestamp, values[myrrd.ds.index]
+    """
+    def __init__(self, start, step, dsnames, values=None):
+        self.start = start
+        self.step = step
+        self.dsnames = list(dsnames)
+        self.values = array.array('d') if values is None else values
+        if len(self.values) % max(len(self.dsnames), 1):
+            raise ValueError("the number of values does not match")
+
+    def _append(self, timestamp, values):
+        # used while reading a fetch result row by row
+        if self.start is None:
+            self.start = timestamp
+        elif self.step is None:
+            self.step = timestamp - self.start
+        if timestamp != self.timestamp(len(self)):
+            raise ValueError("rows are not evenly spaced")
+        self.values.extend(values)
+
+    def __len__(self):
+        if not self.dsnames:
+            return 0
+        return len(self.values) // len(self.dsnames)
+
+    @property
+    def end(self):
+        """
+            The seconds since the epoch of the last row or ``None`` if
+            there are no rows.
+        """
+        if not len(self):
+            return None
+        return self.timestamp(len(self) - 1)
+
+    def timestamp(self, index):
+        """
+            :returns: The seconds since the epoch of the row at the
+                      index.
+        """
+        if self.start is None:
+            raise IndexError("the series has no rows")
+        return self.start + index * (self.step or 0)
+
+    def __iter__(self):
+        values, width = self.values, len(self.dsnames)
+        for i in range(len(self)):
+            yield self.timestamp(i), \
+                tuple(values[i * width:(i + 1) * width])
+
+    def __getitem__(self, index):
+        width = len(self.dsnames)
+        if isinstance(index, slice):
+            first, stop, stride = index.indices(len(self))
+            if stride != 1:
+                raise ValueError("slices with a step are not supported")
+            stop = max(first, stop)
+            start = None if self.start is None else self.timestamp(first)
+            return RRDSeries(
+                start, self.step, self.dsnames,
+                self.values[first * width:stop * width]
+            )
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("row index out of range")
+        return self.timestamp(index), \
+            tuple(self.values[index * width:(index + 1) * width])
+
+    def between(self, start=None, end=None):
         """
-        Wrapping around subprocesses output streams to get
-        a more "unbuffered" version that should prevent
-        errors when having large outputs from rrdtool.
+            Returns the rows within a time range as a new
+            :py:class:`thrush.rrd.RRDSeries`. The values are copied.
 
-        Based upon:
-            https://gist.github.com/thelinuxkid/5114777
+            :param start: The earliest timestamp as seconds since the
+                          epoch or :py:class:`datetime` object. ``None``
+                          selects the first row.
+            :param end: The latest timestamp, like *start*.
+        """
+        first, stop, step = 0, len(self), self.step or 1
+        if not stop:
+            return self[:]
+        if start is not None:
+            start = int(_convert_to_timestamp(start))
+            first = max(0, -(-(start - self.start) // step))
+        if end is not None:
+            end = int(_convert_to_timestamp(end))
+            stop = max(0, (end - self.start) // step + 1)
+        return self[first:stop]
+
+    def column(self, ds):
         """
-        def __init__(self, process):
-            self.process = process
-            self._check_stderr()
+            :param ds: The index or name of a datasource.
 
-        def _unbuffered(self, stream):
-            newlines = ['\n', '\r\n', '\r']
+            :returns: An ``array`` containing the values of the
+                      datasource.
+        """
+        if not isinstance(ds, int):
+            ds = self.dsnames.index(_convert_to_dsname(ds))
+        return self.values[ds::len(self.dsnames)]
 
-            stream = getattr(self.process, stream)
-            with contextlib.closing(stream):
-                while True:
-                    out = []
-                    last = stream.read(1)
+    def memoryview(self):
+        """
+            Returns a two-dimensional :py:class:`memoryview` of the
+            values with a row for every timestamp, e.g. to pass them to
+            other libraries without copying. Requires Python 3.
+        """
+        view = memoryview(self.values)
+        if not len(self):
+            return view
+        return view.cast('B').cast('d', [len(self), len(self.dsnames)])
 
-                    if last == "" and self.process.poll() is not None:
-                        break
+    def to_arrays(self):
+        """
+            Converts the result into arrays like
+            :py:meth:`thrush.rrd.RRDFetchResult.to_arrays`. The arrays
+            of the datasources share the memory of :py:attr:`values`.
+            This requires NumPy_.
 
-                    while last not in newlines:
-                        if last == "" and self.process.poll() is not None:
-                            break
+            .. _NumPy: http://www.numpy.org
+        """
+        if numpy is None:
+            raise ImportError("to_arrays() requires numpy")
+        timestamps = numpy.arange(len(self), dtype=numpy.int64)
+        if len(self):
+            timestamps *= self.step or 0
+            timestamps += self.start
+        if self.values:
+            data = numpy.frombuffer(self.values, dtype=numpy.float64)
+        else:
+            data = numpy.empty(0)
+        data = data.reshape(len(self), len(self.dsnames))
+        return timestamps, dict(
+            (name, data[:, i]) for i, name in enumerate(self.dsnames)
+        )
+
+
+class RRDLines(object):
+    """
+        The already collected output of a single rrdtool command. It
+        behaves like the output stream of :py:func:`_rrdtool_impl`.
+    """
+    def __init__(self, lines):
+        self.lines = lines
+        self._position = 0
 
-                        out.append(last)
-                        last = stream.read(1)
+    def __iter__(self):
+        while self._position < len(self.lines):
+            self._position += 1
+            yield self.lines[self._position - 1]
 
-                    yield "".join(out)
+    def readline(self):
+        if self._position >= len(self.lines):
+            return ""
+        self._position += 1
+        return self.lines[self._position - 1] + "\n"
 
-        def _check_stderr(self):
-            time.sleep(0.01)
+    def close(self):
+        self.lines = []
+        self._position = 0
+
+
+def _decoder():
+    # returns a function that decodes chunks read from a pipe the
+    # same way a text mode stream would do.
+    if str is bytes:
+        return lambda data, final=False: data
+    encoding = locale.getpreferredencoding(False)
+    return codecs.getincrementaldecoder(encoding)('replace').decode
+
+
+def _read_lines(stream, chunk_size=65536, counter=None):
+    # reads a stream in large chunks and yields the complete lines
+    # without their terminator, which is either '\n', '\r\n' or
+    # '\r'. only the current chunk and an unfinished line are held
+    # in memory. if given, the counter list is increased by the number
+    # of bytes and the seconds spent reading.
+    fd = stream.fileno()
+    decode = _decoder()
+    pending = ''
+    while True:
+        if counter is None:
+            chunk = os.read(fd, chunk_size)
+        else:
+            start = _clock()
+            chunk = os.read(fd, chunk_size)
+            counter[0] += len(chunk)
+            counter[1] += _clock() - start
+        data = pending + decode(chunk, not chunk)
+        if not chunk:
+            break
+
+        # a trailing '\r' might be the first half of a '\r\n'
+        carry = ''
+        if data.endswith('\r'):
+            data, carry = data[:-1], '\r'
+
+        lines = data.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        pending = lines.pop() + carry
+        for line in lines:
+            yield line
+
+    lines = data.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    for line in lines:
+        yield line
+
+
+class _RRDOutput(object):
+    """
+        Wraps the output streams of a rrdtool process. The output is
+        consumed while it is produced, which prevents the process
+        from blocking on a full pipe when having large outputs.
 
-            # check stderr for some text. if so we shall raise error
-            code = self.process.poll()
-            if not code is None and code != 0:
-                raise RRDError(
-                    code, "\n".join(
-                        [x for x in self._unbuffered("stderr")]
-                    )
+        Standard error is drained by a separate thread. As soon as
+        the process has terminated with an error, the next read
+        raises a :py:class:`RRDError`.
+    """
+    def __init__(self, process, command, instrumentation=None):
+        self.process = process
+        self.command = command
+        self._instrumentation = instrumentation
+        self._waiting = False
+        self._lines = None
+        self._stderr = []
+        self._stderr_seen = threading.Event()
+        self._stderr_reader = threading.Thread(target=self._drain_stderr)
+        self._stderr_reader.daemon = True
+        self._stderr_reader.start()
+
+    def _drain_stderr(self):
+        with contextlib.closing(self.process.stderr) as stream:
+            for line in _read_lines(stream):
+                self._stderr.append(line)
+                self._stderr_seen.set()
+
+    def _check_error(self, block):
+        code = self.process.wait() if block else self.process.poll()
+        if code is None:
+            return
+
+        self._stderr_reader.join()
+        if code != 0:
+            if self._instrumentation is not None and not self._waiting:
+                self._instrumentation.failed(self.command, code)
+            raise RRDError(code, "\n".join(self._stderr))
+
+    def _unbuffered(self):
+        counter = None if self._instrumentation is None else [0, 0.0]
+        try:
+            with contextlib.closing(self.process.stdout) as stream:
+                for line in _read_lines(stream, counter=counter):
+                    if self._stderr_seen.is_set():
+                        self._check_error(block=False)
+                    yield line
+        finally:
+            if counter is not None:
+                self._instrumentation.read(
+                    self.command, counter[0], counter[1]
                 )
+        self._check_error(block=True)
 
-        def __iter__(self):
-            self._check_stderr()
-            for line in self._unbuffered("stdout"):
-                yield line
+    def _stream(self):
+        if self._lines is None:
+            self._lines = self._unbuffered()
+        return self._lines
 
-        def close(self):
-            pass
+    def wait(self):
+        """
+            Reads the complete output and waits for the process to
+            terminate.
+        """
+        self._waiting = True
+        self._lines = iter(list(self._stream()))
+        self._waiting = False
 
-    env = os.environ
-    process = Popen(
-        'rrdtool %s %s %s' % (command, filename, " ".join(options)),
-        env=env, shell=True, stdout=PIPE, stderr=PIPE, universal_newlines=True
-    )
+    def __iter__(self):
+        for line in self._stream():
+            yield line
+
+    def readline(self):
+        for line in self._stream():
+            return line + "\n"
+        return ""
+
+    def close(self):
+        self.process.stdout.close()
+        self.process.wait()
+        self._stderr_reader.join()
+
+
+def _file_signature(filename):
+    info = os.stat(filename)
+    return info.st_mtime, info.st_size, info.st_ino
+
+
+class FetchCache(object):
+    """
+        .. versionadded:: 0.4
+
+        A LRU cache for the output of ``fetch``. It is enabled for
+        a RRD class by setting it as the ``_cache`` attribute and can
+        be shared among several classes.
+
+        Time references relative to now are resolved and aligned to
+        *granularity* seconds. Thus requests like ``start="end-1h"``
+        within the same interval share their results. Epochs and
+        :py:class:`datetime` objects, as well as offsets to them, are
+        fetched exactly as requested. Only epochs,
+        :py:class:`datetime` objects and references to now/start/end
+        with offsets in seconds, minutes, hours, days or weeks can be
+        cached.
+
+        An entry is invalid as soon as the signature of its file has
+        changed. By default the signature consists of the mtime, size
+        and inode of the file. If the file is written by rrdcached,
+        its mtime does not change for every update, and the signature
+        should e.g. be the time of the last update.
+
+        :param entries: The maximum number of results in the cache.
+        :param size: The maximum total size in bytes of the cached
+                     output.
+        :param granularity: The number of seconds start and end are
+                            aligned to, if they are relative to now.
+        :param signature: A function that returns a comparable value
+                          for a filename, which changes whenever the
+                          content of the file changes.
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            class MyRRD(rrd.RRD):
+                _cache = rrd.FetchCache(entries=1000, granularity=60)
+
+                ds = rrd.Gauge(heartbeat=600)
+                rra = rrd.Max(xff=0.5, steps=1, rows=24)
+
+        .. attribute:: hits
+
+            The number of requests served by the cache.
+
+        .. attribute:: misses
+
+            The number of requests that had to be fetched, including
+            invalidated entries.
+
+        .. attribute:: invalidations
+
+            The number of entries dropped because their file changed.
+
+        .. attribute:: evictions
+
+            The number of entries dropped to stay within the bounds.
+    """
+    def __init__(self, entries=1024, size=64 * 1024 * 1024, granularity=60,
+                 signature=_file_signature):
+        self.entries = entries
+        self.size = size
+        self.granularity = granularity
+        self.signature = signature
+        self.hits = self.misses = self.invalidations = self.evictions = 0
+        self._size = 0
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _align(self, timestamp):
+        return timestamp - timestamp % self.granularity
+
+    def _resolve(self, value, references, fixed):
+        # only times that depend on now are aligned, epochs and
+        # offsets to an epoch are fetched exactly as requested.
+        result = _parse_time(value, references)
+        try:
+            _parse_time(value, fixed)
+        except _Unsupported:
+            result = self._align(result)
+        return result
+
+    def _key(self, rrd, cf, start, end, resolution):
+        now = int(time.time())
+        end = _convert_to_timestamp(end)
+        start = _convert_to_timestamp(start)
+
+        resolved = self._resolve(end, {'n': now}, {})
+        fixed = {'e': resolved} if end.strip().isdigit() else {}
+        start = self._resolve(start, {'n': now, 'e': resolved}, fixed)
+        return rrd.filename, str(cf), start, resolved, resolution
+
+    def _lookup(self, key, signature):
+        with self._lock:
+            entry = self._cache.pop(key, None)
+            if entry is not None:
+                if entry[0] == signature:
+                    self._cache[key] = entry
+                    self.hits += 1
+                    return entry[1]
+                self._size -= entry[2]
+                self.invalidations += 1
+            self.misses += 1
+        return None
+
+    def _store(self, key, signature, lines):
+        size = sum(len(line) + 1 for line in lines)
+        if size > self.size:
+            return
+
+        with self._lock:
+            entry = self._cache.pop(key, None)
+            if entry is not None:
+                self._size -= entry[2]
+            while self._cache and (len(self._cache) >= self.entries or
+                                   self._size + size > self.size):
+                _, entry = self._cache.popitem(last=False)
+                self._size -= entry[2]
+                self.evictions += 1
+            self._cache[key] = (signature, lines, size)
+            self._size += size
+
+    def fetch(self, rrd, cf, start, end, resolution, unknown):
+        """
+            Serves a ``fetch`` of the given RRD object from the cache or
+            fetches and stores it.
+        """
+        try:
+            key = self._key(rrd, cf, start, end, resolution)
+            signature = self.signature(rrd.filename)
+        except (_Unsupported, OSError):
+            return _fetch(rrd, cf, start, end, resolution, unknown)
+
+        lines = self._lookup(key, signature)
+        if lines is None:
+            with _fetch(rrd, cf, key[2], key[3], resolution, None) as result:
+                lines = list(result.stdout)
+            self._store(key, signature, lines)
+
+        return RRDFetchResult(
+            RRDLines(lines), rrd._meta['datasources_list'], unknown
+        )
+
+    def clear(self):
+        """
+            Removes all entries.
+        """
+        with self._lock:
+            self._cache.clear()
+            self._size = 0
+
+
+def _sample_time(sample):
+    timestamp = sample[0]
+    if isinstance(timestamp, datetime.datetime):
+        return time.mktime(timestamp.timetuple())
+    return float(timestamp)
+
+
+class UpdateBuffer(object):
+    """
+        .. versionadded:: 0.4
+
+        Queues updates in memory and writes them from a background
+        thread using ``update_many``. The samples of a file are written
+        once *count* samples are queued for it, the oldest of them is
+        *age* seconds old or :py:meth:`flush` is called. Samples of the
+        same file are written in the order of their timestamps.
+
+        At most *size* samples are queued. If the buffer is full,
+        ``update`` blocks until the samples have been written. All
+        queued samples are written when the buffer is closed, which
+        happens at the latest when the interpreter exits.
+
+        Errors cannot be raised to the caller of ``update``. Instead
+        *on_error* is called with the filename, the exception, usually
+        a :py:class:`thrush.rrd.RRDUpdateError`, and the list of
+        samples of the file that were not written for sure. By default
+        these tuples are appended to :py:attr:`errors`.
+
+        :param size: The maximum number of queued samples.
+        :param count: The number of samples of a file that triggers
+                      writing them.
+        :param age: The maximum number of seconds a sample is queued.
+        :param on_error: A function called for failed writes.
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            with rrd.UpdateBuffer(count=60, age=30) as buffer:
+                for host, load in measurements():
+                    buffer.update(MyRRD(host + ".rrd"), "N", load=load)
+
+        .. attribute:: errors
+
+            A list of ``(filename, exception, samples)`` tuples for the
+            failed writes, if no *on_error* function is set.
+    """
+    def __init__(self, size=10000, count=100, age=10.0, on_error=None):
+        self.size = size
+        self.count = count
+        self.age = age
+        self.errors = []
+        self.on_error = on_error or (
+            lambda filename, e, samples: self.errors.append(
+                (filename, e, samples)
+            )
+        )
+        self._pending = collections.OrderedDict()
+        self._queued = 0
+        self._closed = False
+        self._thread = None
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        _open_buffers.add(self)
+
+    def update(self, rrd, timestamp, **kwargs):
+        """
+            Queues a sample for the given RRD object. The arguments are
+            the same as for ``update``. A timestamp of ``"N"`` is
+            replaced by the current time, as the sample is written
+            later.
+
+            :raises: :py:class:`ValueError` for unknown datasources
+                     and if the buffer is closed, also while waiting
+                     for space in a full buffer.
+        """
+        if _convert_to_timestamp(timestamp).upper() == "N":
+            timestamp = int(time.time())
+        # checks the sample now, as errors of update_many are only
+        # reported to on_error
+        rrd._meta['encoder'].sample(timestamp, kwargs)
+
+        with self._condition:
+            if self._closed:
+                raise ValueError("update on closed buffer")
+            while self._queued >= self.size:
+                self._condition.notify_all()
+                self._condition.wait()
+            # the buffer might have been closed while waiting, its
+            # samples are already written
+            if self._closed:
+                raise ValueError("update on closed buffer")
+
+            entry = self._pending.get(rrd.filename)
+            if entry is None:
+                # the background thread needs a new timeout
+                entry = self._pending[rrd.filename] = [rrd, [], time.time()]
+                self._condition.notify_all()
+            entry[1].append((timestamp, kwargs))
+            self._queued += 1
+
+            if len(entry[1]) >= self.count or self._queued >= self.size:
+                self._condition.notify_all()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _due(self, entry, now):
+        return len(entry[1]) >= self.count or \
+            now - entry[2] >= self.age or self._queued >= self.size
+
+    def _timeout(self, now):
+        if not self._pending:
+            return None
+        return max(min(
+            entry[2] + self.age - now for entry in self._pending.values()
+        ), 0)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed:
+                    now = time.time()
+                    if any(self._due(entry, now)
+                           for entry in self._pending.values()):
+                        break
+                    self._condition.wait(self._timeout(now))
+                if self._closed:
+                    return
+            self._flush(force=False)
+
+    def _flush(self, force):
+        # taking and writing the samples happens under one lock, so
+        # the batches of a file are always written in order
+        with self._flush_lock:
+            with self._condition:
+                now = time.time()
+                due = [
+                    (filename, entry)
+                    for filename, entry in self._pending.items()
+                    if force or self._due(entry, now)
+                ]
+                for filename, _ in due:
+                    del self._pending[filename]
+
+            try:
+                while due:
+                    filename, (rrd, samples, _) = due.pop(0)
+                    try:
+                        samples.sort(key=_sample_time)
+                    except (TypeError, ValueError):
+                        pass
+
+                    try:
+                        rrd.update_many(samples)
+                    except RRDUpdateError as e:
+                        self.on_error(filename, e, samples[e.committed:])
+                    except Exception as e:
+                        # the other files must be written anyway and the
+                        # background thread has to keep on running
+                        self.on_error(filename, e, samples)
+                    finally:
+                        self._release(len(samples))
+            finally:
+                # only left over if on_error has raised, the samples
+                # must not block update() forever
+                self._release(sum(len(entry[1]) for _, entry in due))
+
+    def _release(self, count):
+        with self._condition:
+            self._queued -= count
+            self._condition.notify_all()
+
+    def flush(self):
+        """
+            Writes all queued samples.
+        """
+        self._flush(force=True)
+
+    def close(self):
+        """
+            Writes all queued samples and stops the background thread.
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        _open_buffers.discard(self)
+        if self._thread is not None:
+            self._thread.join()
+        self._flush(force=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+# the buffers, that are closed at exit. a single handler for all of
+# them does not keep them alive and does not pile up.
+_open_buffers = weakref.WeakSet()
+
+
+def _close_buffers():
+    for buffer in list(_open_buffers):
+        buffer.close()
+
+
+atexit.register(_close_buffers)
 
-    if wait:
-        process.wait()
 
-    return RRDOutput(process)
+# since python 3.4 file descriptors are not inherited by default
+# (PEP 446), thus they need not be closed in the child, which allows
+# subprocess to use posix_spawn() or vfork() instead of fork(). before,
+# a child would inherit the pipes of other rrdtool processes and keep
+# them from being closed, so reading their output could hang.
+_close_fds = sys.version_info < (3, 4)
+
+
+def _which(binary, path):
+    # searches the executable like execvp() does
+    if os.sep in binary:
+        return binary
+    for directory in path.split(os.pathsep):
+        candidate = os.path.join(directory or os.curdir, binary)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return os.path.abspath(candidate)
+    return None
+
+
+class RRDTool(object):
+    """
+        .. versionadded:: 0.4
+
+        The default implementation, which starts a ``rrdtool`` process
+        for every command. The process is executed directly with the
+        arguments as a list and without a shell, thus filenames may
+        contain any character.
+
+        The path of the executable is looked up once, on the first
+        command. The environment is prepared at the same time and
+        passed unchanged to all processes, later changes of
+        ``os.environ`` are not seen by rrdtool.
+
+        :param binary: The name or path of the ``rrdtool`` executable.
+        :param env: The environment for the processes. Defaults to a
+                    copy of ``os.environ`` at the time of the first
+                    command.
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            from thrush import rrd
+
+            class MyRRD(rrd.RRD):
+                _impl = rrd.RRDTool("/opt/rrdtool/bin/rrdtool",
+                                    env={'LC_ALL': 'C'})
+
+                ds = rrd.Gauge(heartbeat=600)
+                rra = rrd.Max(xff=0.5, steps=1, rows=24)
+    """
+    def __init__(self, binary="rrdtool", env=None):
+        self.binary = binary
+        self.env = env
+        self._path = None
+        self._prepared = None
+
+    def _prepare(self):
+        env = dict(os.environ if self.env is None else self.env)
+        path = _which(self.binary, env.get('PATH', os.defpath))
+        if path is None:
+            raise RRDError(-1, "cannot find '%s' in PATH" % self.binary)
+        self._prepared, self._path = env, path
+
+    def __call__(self, filename, command, options, wait=True):
+        if self._path is None:
+            self._prepare()
+
+        instrumentation = _instrumentation
+        if instrumentation is not None:
+            start = _clock()
+
+        try:
+            process = Popen(
+                [self._path, command, filename] + list(options),
+                env=self._prepared, close_fds=_close_fds, stdout=PIPE,
+                stderr=PIPE
+            )
+        except OSError as e:
+            raise RRDError(-1, "cannot execute rrdtool: %s" % e)
+
+        if instrumentation is not None:
+            instrumentation.spawned(command, _clock() - start)
+            start = _clock()
+
+        output = _RRDOutput(process, command, instrumentation)
+        if wait:
+            try:
+                output.wait()
+            finally:
+                if instrumentation is not None:
+                    instrumentation.waited(command, _clock() - start)
+
+        return output
+
+
+_rrdtool_impl = RRDTool()
+
+
+def _execute(self, command, options, wait=True, filename=None):
+    # commands like graph take another file in place of the RRD
+    implementation = self._meta['implementation']
+    filename = self.filename if filename is None else filename
+    instrumentation = _instrumentation
+    if instrumentation is None:
+        return implementation(filename, command, options, wait=wait)
+
+    start = _clock()
+    try:
+        return implementation(filename, command, options, wait=wait)
+    except RRDError as e:
+        instrumentation.failed(command, e.errorcode)
+        raise
+    finally:
+        instrumentation.executed(command, _clock() - start)
+
+
+def _format_value(value):
+    # a single value of an update. None is unknown like a missing one.
+    if value is None:
+        return "U"
+    if type(value) is float:
+        return repr(value)
+    return str(value)
+
+
+class _CommandEncoder(object):
+    # the arguments of create and update of a RRD class. everything
+    # that only depends on the class is prepared by RRDMeta, thus only
+    # the values have to be formatted per call.
+    def __init__(self, meta):
+        datasources = [meta['datasources'][ds]
+                       for ds in meta['datasources_list']]
+        self.positions = dict(
+            (name, i) for i, name in enumerate(meta['datasources_list'])
+        )
+        self.definitions = [repr(ds) for ds in datasources] + [
+            repr(meta['rras'][rra]) for rra in meta['rras_list']
+        ]
+        self.template = [
+            "--template", ":".join(ds.name for ds in datasources), "--"
+        ]
+        self.unknown = ["U"] * len(datasources)
+
+    def create(self, start, step, overwrite):
+        options = [
+            "--start", _convert_to_timestamp(start),
+            "--step", _convert_to_argument(step)
+        ]
+        if not overwrite:
+            options.append("--no-overwrite")
+        return options + self.definitions
+
+    def sample(self, timestamp, values):
+        row = list(self.unknown)
+        positions = self.positions
+        for name, value in values.items():
+            try:
+                row[positions[name]] = _format_value(value)
+            except KeyError:
+                raise ValueError("unknown datasource '%s'" % name)
+        return "%s:%s" % (_convert_to_timestamp(timestamp), ":".join(row))
+
+    def update(self, timestamp, values):
+        return self.template + [self.sample(timestamp, values)]
+
+
+def _create_options(self, start, step, overwrite):
+    return self._meta['encoder'].create(start, step, overwrite)
+
+
+def _update_options(self, timestamp, values):
+    return self._meta['encoder'].update(timestamp, values)
+
+
+def _fetch_options(cf, start, end, resolution):
+    options = [
+        str(cf), "--start", _convert_to_timestamp(start), "--end",
+        _convert_to_timestamp(end)
+    ]
+    if not resolution is None:
+        options += ['--resolution', _convert_to_argument(resolution)]
+    return options
+
+
+def _first_options(index):
+    return ["--rraindex", _convert_to_argument(index)]
 
 
 def _rrd_init(self, filename):
@@ -339,18 +1712,8 @@ def _rrd_create(self, start='N', step=300, overwrite=False):
 
         .. _rrdcreate: http://oss.oetiker.ch/rrdtool/doc/rrdcreate.en.html
     """
-    options = ["--start", _convert_to_timestamp(start), "--step", repr(step)]
-    if not overwrite:
-        options += ["--no-overwrite"]
-    options += [
-        repr(self._meta['datasources'][ds])
-        for ds in self._meta['datasources_list']
-    ]
-    options += [
-        repr(self._meta['rras'][rra])
-        for rra in self._meta['rras_list']
-    ]
-    stdout = self._meta['implementation'](self.filename, "create", options)
+    options = _create_options(self, start, step, overwrite)
+    stdout = _execute(self, "create", options)
 
 
 def _rrd_update(self, timestamp, **kwargs):
@@ -369,6 +1732,10 @@ def _rrd_update(self, timestamp, **kwargs):
 
         :raises: :py:class:`thrush.rrd.RRDError`
 
+        .. versionchanged:: 0.4
+            A value of ``None`` is unknown and an unknown datasource
+            name raises a :py:class:`ValueError`.
+
         *Example*: Consider a class ``MyRRD`` that has two datasources
         ds1 and ds2.
 
@@ -393,14 +1760,113 @@ def _rrd_update(self, timestamp, **kwargs):
 
         .. _rrdupdate: http://oss.oetiker.ch/rrdtool/doc/rrdupdate.en.html
     """
-    options = ["--template", ":".join(self._meta['datasources_list']), "--"]
-    data = [_convert_to_timestamp(timestamp)]
-    data += [
-        "U" if not ds in kwargs else str(kwargs[ds])
-        for ds in self._meta['datasources_list']
-    ]
-    options += [":".join(data)]
-    stdout = self._meta['implementation'](self.filename, "update", options)
+    options = _update_options(self, timestamp, kwargs)
+    stdout = _execute(self, "update", options)
+
+
+def _argument_limit(implementation=None):
+    # the space available for the argument vector of a new process.
+    # the environment is passed alongside and thus needs to be
+    # subtracted, as well as some headroom for the pointers. that is
+    # the env of the implementation, if it has its own one.
+    # implementations that send commands as lines of a limited length,
+    # like the pipe mode, announce that limit as max_line instead.
+    max_line = getattr(implementation, 'max_line', None)
+    if max_line is not None:
+        return max_line
+    try:
+        limit = os.sysconf('SC_ARG_MAX')
+    except (AttributeError, ValueError, OSError):
+        limit = -1
+    if limit <= 0:
+        limit = 32767
+    environ = getattr(implementation, 'env', None)
+    if environ is None:
+        environ = os.environ
+    for key, value in environ.items():
+        limit -= len(key) + len(value) + 2 + _POINTER_SIZE
+    return max(limit - 4096, 4096)
+
+
+def _arguments_length(arguments):
+    return sum(len(arg) + 1 + _POINTER_SIZE for arg in arguments)
+
+
+def _rrd_update_many(self, samples):
+    """
+        .. versionadded:: 0.4
+
+        Updates a RRD file with many samples at once. The samples are
+        passed to as few rrdupdate_ executions as possible, while
+        keeping the command line below the limits of the operating
+        system or the ``max_line`` of the implementation.
+
+        :param samples: An iterable of ``(timestamp, values)`` tuples,
+                        where *timestamp* and *values* are the same as
+                        the *timestamp* and *kwargs* parameters of
+                        ``update``. The samples must be ordered by time.
+
+        :returns: The number of samples written.
+
+        :raises: :py:class:`thrush.rrd.RRDUpdateError`
+
+        An unknown datasource name or invalid value raises a
+        :py:class:`thrush.rrd.RRDUpdateError` before the samples of the
+        same command are written. Its *samples* contain the unwritten
+        samples of that command up to the invalid one.
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            myrrd = MyRRD("my.rrd")
+            myrrd.update_many([
+                (1234, {"ds1": 5.4, "ds2": 3}),
+                (5678, {"ds2": 4}),
+            ])
+
+        .. _rrdupdate: http://oss.oetiker.ch/rrdtool/doc/rrdupdate.en.html
+    """
+    encoder = self._meta['encoder']
+    options = encoder.template
+    limit = _argument_limit(self._meta['implementation']) - \
+        _arguments_length(["rrdtool", "update", self.filename] + options)
+
+    state = {'chunk': 0, 'committed': 0}
+
+    def flush(chunk, data):
+        try:
+            _execute(self, "update", options + data)
+        except RRDError as e:
+            raise RRDUpdateError(
+                e.errorcode, e.message, state['chunk'],
+                state['committed'], chunk
+            )
+        state['chunk'] += 1
+        state['committed'] += len(chunk)
+
+    chunk, data, size = [], [], 0
+    for timestamp, values in samples:
+        try:
+            encoded = encoder.sample(timestamp, values)
+        except ValueError as e:
+            # the samples are encoded while they are read, thus the
+            # previous commands have already been written
+            raise RRDUpdateError(
+                -1, str(e), state['chunk'], state['committed'],
+                chunk + [(timestamp, values)]
+            )
+        length = _arguments_length([encoded])
+        if data and size + length > limit:
+            flush(chunk, data)
+            chunk, data, size = [], [], 0
+        chunk.append((timestamp, values))
+        data.append(encoded)
+        size += length
+    if data:
+        flush(chunk, data)
+
+    return state['committed']
 
 
 def _rrd_fetch(self, cf, start="end-1day", end="now", resolution=None,
@@ -440,15 +1906,15 @@ def _rrd_fetch(self, cf, start="end-1day", end="now", resolution=None,
 
         .. _rrdfetch: http://oss.oetiker.ch/rrdtool/doc/rrdfetch.en.html
     """
-    options = [
-        repr(cf), "--start", _convert_to_timestamp(start), "--end",
-        _convert_to_timestamp(end)
-    ]
-    if not resolution is None:
-        options += ['--resolution', repr(resolution)]
-    stdout = self._meta['implementation'](
-        self.filename, "fetch", options, wait=False
-    )
+    cache = self._meta['cache']
+    if cache is not None:
+        return cache.fetch(self, cf, start, end, resolution, unknown)
+    return _fetch(self, cf, start, end, resolution, unknown)
+
+
+def _fetch(self, cf, start, end, resolution, unknown):
+    options = _fetch_options(cf, start, end, resolution)
+    stdout = _execute(self, "fetch", options, wait=False)
     return RRDFetchResult(stdout, self._meta['datasources_list'], unknown)
 
 
@@ -468,9 +1934,7 @@ def _rrd_last(self):
         .. _rrdlast: http://oss.oetiker.ch/rrdtool/doc/rrdlast.en.html
         .. _rrdlastupdate: http://oss.oetiker.ch/rrdtool/doc/rrdlastupdate.en.html
     """
-    stdout = self._meta['implementation'](
-        self.filename, "lastupdate", [], wait=False
-    )
+    stdout = _execute(self, "lastupdate", [], wait=False)
     return RRDFetchResult(stdout, self._meta['datasources_list'])
 
 
@@ -499,11 +1963,534 @@ def _rrd_first(self, index=0):
 
         .. _rrdfirst: http://oss.oetiker.ch/rrdtool/doc/rrdfirst.en.html
     """
-    options = ["--rraindex", repr(index)]
-    stdout = self._meta['implementation'](self.filename, "first", options)
+    options = _first_options(index)
+    stdout = _execute(self, "first", options)
     return _convert_from_timestamp(stdout.readline()[:-1])
 
 
+def _rrd_follow(self, cf, resolution=None, interval=5.0, start=None,
+                unknown=None, signature=_file_signature):
+    """
+        .. versionadded:: 0.4
+
+        Follows the RRD like ``tail -f`` and returns every consolidated
+        row once, as soon as it is complete. See
+        :py:func:`thrush.follow.follow`, which follows many files at once,
+        for details.
+
+        :returns: A generator of ``(timestamp, values)`` tuples like
+                  :py:meth:`thrush.rrd.RRDFetchResult.rows`.
+
+        :raises: :py:class:`thrush.rrd.RRDError`
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            myrrd = MyRRD("my.rrd")
+            for timestamp, values in myrrd.follow(myrrd.rra.cf):
+                print timestamp, values[myrrd.ds.index]
+    """
+    from thrush.follow import follow
+
+    for rrd, timestamp, values in follow([self], cf, resolution, interval,
+                                         start, unknown, signature):
+        yield timestamp, values
+
+
+_palette = [
+    "#0000ff", "#00aa00", "#ff0000", "#ff9900", "#9900cc", "#00aaaa",
+    "#aaaa00", "#666666",
+]
+
+
+def _escape_def(filename):
+    # colons separate the fields of a DEF
+    return filename.replace("\\", "\\\\").replace(":", "\\:")
+
+
+def _graph_options(self, elements, cf, start, end, width, height, title,
+                   imgformat, arguments):
+    datasources = list(self._meta['datasources'].values())
+    if elements is None:
+        elements = [
+            Line(self._meta['datasources'][name], _palette[i % len(_palette)])
+            for i, name in enumerate(self._meta['datasources_list'])
+        ]
+
+    options = [
+        "--start", _convert_to_timestamp(start),
+        "--end", _convert_to_timestamp(end),
+        "--imgformat", imgformat
+    ]
+    if width is not None:
+        options += ["--width", _convert_to_argument(width)]
+    if height is not None:
+        options += ["--height", _convert_to_argument(height)]
+    if title is not None:
+        options += ["--title", title]
+    options += [_convert_to_argument(argument) for argument in arguments]
+
+    definitions = []
+    for element in elements:
+        if not any(element.ds is ds for ds in datasources):
+            raise ValueError("%r is not a datasource of %s" % (
+                element.ds, type(self).__name__))
+        definition = "DEF:%s=%s:%s:%s" % (
+            element.ds.name, _escape_def(self.filename), element.ds.name,
+            getattr(cf, 'cf', cf)
+        )
+        if definition not in definitions:
+            definitions.append(definition)
+    return options + definitions + [str(element) for element in elements]
+
+
+def _rrd_graph(self, filename=None, elements=None, cf="AVERAGE",
+               start="end-1day", end="now", width=None, height=None,
+               title=None, imgformat="PNG", arguments=()):
+    """
+        .. versionadded:: 0.4
+
+        Renders a graph of the datasources. This implements a subset of
+        the rrdgraph_ command.
+
+        If the class has a :py:class:`thrush.graphcache.GraphCache`,
+        the image is taken from the cache or rendered into it.
+
+        :param filename: The file the image is written to. Can be
+                         omitted if the class has a cache, in which case
+                         the image is only stored in the cache.
+        :param elements: A list of :py:class:`thrush.rrd.GraphElement`
+                         objects. Defaults to a line for every
+                         datasource.
+        :param cf: Either the string representation of a consolidation
+                   function or a RRA object.
+        :param start: See ``fetch``.
+        :param end: See ``fetch``.
+        :param width: The width of the canvas in pixels.
+        :param height: The height of the canvas in pixels.
+        :param title: The title of the graph.
+        :param imgformat: The format of the image, e.g. ``PNG`` or
+                          ``SVG``.
+        :param arguments: A list of further arguments for rrdgraph_,
+                          which are inserted before the elements.
+
+        :returns: The path of the image.
+
+        :raises: :py:class:`thrush.rrd.RRDError`
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            class MyRRD(rrd.RRD):
+                ds1 = rrd.Gauge(heartbeat=600)
+                ds2 = rrd.Gauge(heartbeat=600)
+                rra = rrd.Max(xff=0.5, steps=1, rows=24)
+
+            myrrd = MyRRD("my.rrd")
+            myrrd.graph("my.png", [
+                rrd.Area(myrrd.ds1, "#00ff00", legend="first"),
+                rrd.Area(myrrd.ds2, "#0000ff", legend="second", stack=True)
+            ], cf=myrrd.rra, start="end-1h", arguments=["--lower-limit", 0])
+
+        .. _rrdgraph: http://oss.oetiker.ch/rrdtool/doc/rrdgraph.en.html
+    """
+    options = _graph_options(self, elements, cf, start, end, width, height,
+                             title, imgformat, arguments)
+
+    cache = self._meta['graph_cache']
+    if cache is None:
+        if filename is None:
+            raise ValueError("graph() needs a filename without a cache")
+        _execute(self, "graph", options, filename=filename)
+        return filename
+
+    path = cache.render(self, options)
+    if filename is None:
+        return path
+    shutil.copyfile(path, filename)
+    return filename
+
+
+def _fetch_many_worker(arguments):
+    # fetches a single file within a pool worker. results are handed
+    # to the parent either directly or within a shared memory
+    # segment holding the timestamps and values as rows of a matrix.
+    index, cls, filename, cf, start, end, resolution, segment = arguments
+    with cls(filename).fetch(cf, start, end, resolution) as result:
+        timestamps, values = result.to_arrays()
+    if segment is None:
+        return index, filename, timestamps, values
+
+    memory = shared_memory.SharedMemory(
+        name=segment, create=True, size=max(
+            (len(values) + 1) * timestamps.nbytes, 1
+        )
+    )
+    try:
+        block = numpy.ndarray(
+            (len(values) + 1, len(timestamps)), dtype=numpy.float64,
+            buffer=memory.buf
+        )
+        block[0] = timestamps
+        for i, name in enumerate(result.dsnames):
+            block[i + 1] = values[name]
+        del block
+    finally:
+        memory.close()
+
+    # the parent takes over the segment and unlinks it
+    resource_tracker.unregister(memory._name, 'shared_memory')
+    return index, filename, len(timestamps), None
+
+
+def _attach_segment(segment, dsnames, rows):
+    memory = shared_memory.SharedMemory(name=segment)
+    try:
+        block = numpy.ndarray(
+            (len(dsnames) + 1, rows), dtype=numpy.float64, buffer=memory.buf
+        ).copy()
+    finally:
+        memory.close()
+        memory.unlink()
+    return block[0].astype(numpy.int64), dict(
+        (name, block[i + 1]) for i, name in enumerate(dsnames)
+    )
+
+
+def _release_segment(segment):
+    try:
+        memory = shared_memory.SharedMemory(name=segment)
+    except ValueError:
+        # the worker was terminated before it sized the segment, which
+        # cannot be mapped but has a name on POSIX systems
+        posixshmem = getattr(shared_memory, '_posixshmem', None)
+        if posixshmem is not None:
+            try:
+                posixshmem.shm_unlink("/" + segment)
+            except OSError:
+                pass
+        return
+    except OSError:
+        return
+    memory.close()
+    memory.unlink()
+
+
+def _rrd_fetch_many(cls, filenames, cf, start="end-1day", end="now",
+                    resolution=None, workers=None, processes=False):
+    """
+        .. versionadded:: 0.4
+
+        Fetches the same samples from many RRD files of this class
+        in parallel. This requires NumPy_.
+
+        :param filenames: An iterable of file names.
+        :param cf: See ``fetch``.
+        :param start: See ``fetch``.
+        :param end: See ``fetch``.
+        :param resolution: See ``fetch``.
+        :param workers: The number of concurrent fetches. Defaults to the
+                        number of CPUs.
+        :param processes: When set to True the results are fetched and
+                          parsed by a pool of processes instead of
+                          threads. Results are handed back within
+                          shared memory, if the platform supports it.
+
+        :returns: A generator of ``(filename, timestamps, values)``
+                  tuples in the order the fetches complete.
+                  *timestamps* and *values* are the same as returned
+                  by :py:meth:`thrush.rrd.RRDFetchResult.to_arrays`.
+
+        :raises: :py:class:`thrush.rrd.RRDError`
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            for filename, timestamps, values in MyRRD.fetch_many(
+                    ["a.rrd", "b.rrd"], "MAX", start="end-1h"):
+                print filename, values["ds1"].max()
+
+        .. _NumPy: http://www.numpy.org
+    """
+    if numpy is None:
+        raise ImportError("fetch_many() requires numpy")
+
+    workers = workers or multiprocessing.cpu_count()
+    if processes:
+        pool = multiprocessing.Pool(workers)
+    else:
+        pool = multiprocessing.pool.ThreadPool(workers)
+
+    share = processes and shared_memory is not None
+    prefix = "thrush-%d-%d" % (os.getpid(), id(pool))
+    # segments are keyed by the index of the task, as the same file
+    # might be fetched more than once.
+    segments = {}
+    tasks = []
+    for i, filename in enumerate(filenames):
+        segment = None
+        if share:
+            segment = segments[i] = "%s-%d" % (prefix, i)
+        tasks.append(
+            (i, cls, filename, cf, start, end, resolution, segment)
+        )
+    dsnames = [_convert_to_dsname(ds) for ds in cls._meta['datasources_list']]
+
+    try:
+        for index, filename, timestamps, values in pool.imap_unordered(
+                _fetch_many_worker, tasks):
+            if share:
+                timestamps, values = _attach_segment(
+                    segments.pop(index), dsnames, timestamps
+                )
+            yield filename, timestamps, values
+    finally:
+        pool.terminate()
+        pool.join()
+        for segment in segments.values():
+            _release_segment(segment)
+
+
+_FICLONE = 0x40049409
+_TEMPLATE_START = 946684800
+_templates = {}
+_templates_lock = threading.Lock()
+_templates_directory = []
+
+
+def _remove_templates():
+    for directory in _templates_directory:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+atexit.register(_remove_templates)
+
+
+def _template(cls, step):
+    # creates a file of the class with rrdtool once per step. its
+    # header tells where the start time has to be patched.
+    from thrush.native import RRDFile
+
+    with _templates_lock:
+        path = _templates.get((cls, step))
+        if path is None or not os.path.isfile(path):
+            if not _templates_directory:
+                _templates_directory.append(
+                    tempfile.mkdtemp(prefix="thrush-templates-")
+                )
+            path = os.path.join(
+                _templates_directory[0], "%s-%d-%s.rrd" % (
+                    cls.__name__, id(cls), _convert_to_argument(step))
+            )
+            cls(path).create(start=_TEMPLATE_START, step=step,
+                             overwrite=True)
+            _templates[(cls, step)] = path
+    return path, RRDFile(path)
+
+
+def _clone_file(source, target):
+    with open(source, 'rb') as src:
+        with open(target, 'wb') as dst:
+            # a reflink shares the blocks of the source until they
+            # are written to
+            if fcntl is not None:
+                try:
+                    fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+                    return
+                except (IOError, OSError):
+                    pass
+
+            copy_file_range = getattr(os, 'copy_file_range', None)
+            if copy_file_range is not None:
+                size = os.fstat(src.fileno()).st_size
+                copied = 0
+                try:
+                    while copied < size:
+                        count = copy_file_range(
+                            src.fileno(), dst.fileno(), size - copied
+                        )
+                        if count == 0:
+                            break
+                        copied += count
+                except OSError:
+                    pass
+                if copied == size:
+                    return
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+
+            shutil.copyfileobj(src, dst)
+
+
+def _provision(arguments):
+    try:
+        return _clone_template(*arguments)
+    except RRDError as e:
+        return e
+
+
+def _clone_template(template, patches, filename, overwrite):
+    temporary = "%s.%d.%d.tmp" % (
+        filename, os.getpid(), threading.current_thread().ident
+    )
+    try:
+        _clone_file(template, temporary)
+        with open(temporary, 'r+b') as f:
+            for offset, data in patches:
+                f.seek(offset)
+                f.write(data)
+
+        if overwrite:
+            os.rename(temporary, filename)
+            return filename
+
+        # linking fails if the file exists, which is the same check
+        # rrdcreate does with --no-overwrite
+        try:
+            os.link(temporary, filename)
+        except OSError as e:
+            if e.errno == errno.EEXIST or os.path.exists(filename):
+                raise RRDError(1, "creating '%s': %s" % (
+                    filename, os.strerror(errno.EEXIST)))
+            os.rename(temporary, filename)
+    except (IOError, OSError) as e:
+        raise RRDError(1, "creating '%s': %s" % (
+            filename, getattr(e, 'strerror', None) or e))
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return filename
+
+
+def _rrd_create_many(cls, filenames, start='N', step=300, overwrite=False,
+                     workers=None):
+    """
+        .. versionadded:: 0.4
+
+        Creates many RRD files of this class at once. Instead of
+        executing rrdcreate_ for every file, a template file is created
+        once per class and step and copied for every file. Only the
+        fields depending on the start time are changed in the copies.
+        If the file system supports it and the temporary directory is
+        on the same file system, the copies share their blocks with the
+        template.
+
+        If the start time cannot be resolved without rrdtool, or the
+        template cannot be read by :py:class:`thrush.native.RRDFile`,
+        the files are created one by one with ``create``.
+
+        :param filenames: An iterable of file names.
+        :param start: See ``create``. Has to be the same for all files.
+        :param step: See ``create``.
+        :param overwrite: See ``create``.
+        :param workers: The number of files copied concurrently.
+                        Defaults to the number of CPUs.
+
+        :raises: :py:class:`thrush.rrd.RRDError` after all other files
+                 have been created, if any of them failed. The message
+                 names every failed file.
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            MyRRD.create_many(
+                ["host%05d.rrd" % i for i in range(20000)], step=60
+            )
+
+        .. _rrdcreate: http://oss.oetiker.ch/rrdtool/doc/rrdcreate.en.html
+    """
+    filenames = list(filenames)
+    try:
+        timestamp = _parse_time(_convert_to_timestamp(start),
+                                {'n': int(time.time())})
+        template, header = _template(cls, step)
+    except (_Unsupported, RRDError):
+        template = None
+
+    if template is None:
+        errors = []
+        for filename in filenames:
+            try:
+                cls(filename).create(start, step, overwrite)
+            except RRDError as e:
+                errors.append(e)
+    else:
+        with contextlib.closing(header):
+            patches = header._start_patches(timestamp)
+            tasks = [
+                (template, patches + header._cur_row_patches(), filename,
+                 overwrite) for filename in filenames
+            ]
+        pool = multiprocessing.pool.ThreadPool(workers)
+        try:
+            errors = [
+                result for result in pool.imap(_provision, tasks)
+                if isinstance(result, RRDError)
+            ]
+        finally:
+            pool.terminate()
+            pool.join()
+    if len(errors) == 1:
+        raise errors[0]
+    if errors:
+        raise RRDError(1, "%d of %d files failed: %s" % (
+            len(errors), len(filenames),
+            "; ".join(e.message for e in errors)))
+
+
+def _rrd_info(self):
+    """
+        .. versionadded:: 0.4
+
+        Reads the header of the RRD file. This implements the rrdinfo_
+        command.
+
+        The result is cached as long as the mtime, size and inode of
+        the file do not change, thus calling this method repeatedly is
+        cheap.
+
+        :returns: :py:class:`thrush.info.RRDInfo`
+
+        :raises: :py:class:`thrush.rrd.RRDError`
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            myrrd = MyRRD("my.rrd")
+            info = myrrd.info()
+            print info.step, info.rras[myrrd.rra.index]['rows']
+
+        .. _rrdinfo: http://oss.oetiker.ch/rrdtool/doc/rrdinfo.en.html
+    """
+    from thrush.info import read
+    return read(self)
+
+
+def _rrd_verify(self):
+    """
+        .. versionadded:: 0.4
+
+        Checks, whether the RRD file contains exactly the datasources
+        and archives of the class. The result is remembered along with
+        the cached result of ``info``, thus the file is only checked
+        again after it has changed.
+
+        :returns: :py:class:`thrush.info.RRDInfo`
+
+        :raises: :py:class:`thrush.rrd.RRDSchemaError` if the file does
+                 not match, :py:class:`thrush.rrd.RRDError` if it cannot
+                 be read.
+    """
+    from thrush.info import verify
+    return verify(self)
+
+
 def _rrd_exists(self):
     """
         .. versionadded:: 0.2
@@ -517,6 +2504,90 @@ def _rrd_exists(self):
     return os.path.isfile(self.filename)
 
 
+def _rrd_dump(self, path=None):
+    """
+        .. versionadded:: 0.4
+
+        Dumps the RRD as XML. This implements the rrddump_ command.
+
+        :param path: The XML file to write. It is written by rrdtool
+                     itself, thus the dump does not pass through
+                     Python.
+
+        :returns: ``None`` if *path* is given, otherwise a
+                  :py:class:`thrush.dump.RRDDump`, which parses the
+                  output while it is read.
+
+        :raises: :py:class:`thrush.rrd.RRDError`
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            with myrrd.dump() as dump:
+                for index, timestamp, values in dump.rows():
+                    print dump.rras[index]['cf'], timestamp, values
+
+        .. _rrddump: http://oss.oetiker.ch/rrdtool/doc/rrddump.en.html
+    """
+    from thrush.dump import dump
+    return dump(self, path)
+
+
+def _rrd_restore(self, path, overwrite=False, range_check=False):
+    """
+        .. versionadded:: 0.4
+
+        Creates the RRD from a XML file written by ``dump``. This
+        implements the rrdrestore_ command, which reads the file
+        itself.
+
+        :param path: The XML file to read.
+        :param overwrite: When set to True an existing RRD file is
+                          overwritten.
+        :param range_check: When set to True values outside of the
+                            minimum and maximum of their datasource are
+                            stored as unknown.
+
+        :raises: :py:class:`thrush.rrd.RRDError`
+
+        .. _rrdrestore: http://oss.oetiker.ch/rrdtool/doc/rrdrestore.en.html
+    """
+    options = []
+    if overwrite:
+        options += ["--force-overwrite"]
+    if range_check:
+        options += ["--range-check"]
+    _execute(self, "restore", options + [self.filename], filename=path)
+
+
+def _rrd_export_columns(self, path, chunk=4096):
+    """
+        .. versionadded:: 0.4
+
+        Exports all archives of the RRD into a columnar binary file,
+        which can be loaded by :py:class:`thrush.dump.RRDColumns`. The
+        output of rrddump_ is processed while it is read, thus only
+        *chunk* rows per archive are kept in memory.
+
+        The file starts with ``THRUSHC1``, followed by the data of the
+        archives. Every archive consists of a column of little endian
+        int64 timestamps, followed by a column of little endian float64
+        values for every datasource. Then follows a footer as UTF-8
+        encoded JSON containing the offsets of the columns, its length
+        as little endian uint64 and ``THRUSHC1`` again.
+
+        :param path: The file to write. It is replaced atomically.
+        :param chunk: The number of rows of an archive written at once.
+
+        :raises: :py:class:`thrush.rrd.RRDError`
+
+        .. _rrddump: http://oss.oetiker.ch/rrdtool/doc/rrddump.en.html
+    """
+    from thrush.dump import export_columns
+    export_columns(self, path, chunk)
+
+
 class RRDMeta(type):
     def __new__(cls, name, base, attrs):
         super_new = super(RRDMeta, cls).__new__
@@ -525,10 +2596,24 @@ class RRDMeta(type):
             super_class = super_new(cls, name, base, attrs)
 
             super_class.add_to_class('create', _rrd_create)
+            super_class.add_to_class(
+                'create_many', classmethod(_rrd_create_many)
+            )
             super_class.add_to_class('update', _rrd_update)
+            super_class.add_to_class('update_many', _rrd_update_many)
             super_class.add_to_class('last', _rrd_last)
             super_class.add_to_class('first', _rrd_first)
             super_class.add_to_class('fetch', _rrd_fetch)
+            super_class.add_to_class('follow', _rrd_follow)
+            super_class.add_to_class('graph', _rrd_graph)
+            super_class.add_to_class('info', _rrd_info)
+            super_class.add_to_class('verify', _rrd_verify)
+            super_class.add_to_class(
+                'fetch_many', classmethod(_rrd_fetch_many)
+            )
+            super_class.add_to_class('dump', _rrd_dump)
+            super_class.add_to_class('restore', _rrd_restore)
+            super_class.add_to_class('export_columns', _rrd_export_columns)
             super_class.add_to_class('exists', _rrd_exists)
             super_class.add_to_class('__bool__', _rrd_exists)
             super_class.add_to_class('__nonzero__', _rrd_exists)
@@ -542,21 +2627,29 @@ class RRDMeta(type):
         new_class.add_to_class('_meta', {
             'datasources': {},
             'datasources_list': [],
+            'datasources_index': {},
             'rras': {},
             'rras_index': {},
             'rras_list': [],
-            'implementation': _rrdtool_impl
+            'implementation': _rrdtool_impl,
+            'cache': None,
+            'graph_cache': None,
+            'encoder': None
         })
         for obj_name, obj in attrs.items():
             new_class.add_to_class(obj_name, obj)
         new_class._meta['datasources_list'] = \
             sorted(new_class._meta['datasources_list'])
+        for i, name in enumerate(new_class._meta['datasources_list']):
+            new_class._meta['datasources_index'][name] = i
+            new_class._meta['datasources'][name].index = i
         new_class._meta['rras_list'] = \
             sorted(new_class._meta['rras_list'])
-        for i in xrange(0, len(new_class._meta['rras_list'])):
+        for i in range(0, len(new_class._meta['rras_list'])):
             name = new_class._meta['rras_list'][i]
             new_class._meta['rras_index'][name] = i
             new_class._meta['rras'][name].index = i
+        new_class._meta['encoder'] = _CommandEncoder(new_class._meta)
 
         return new_class
 
@@ -571,6 +2664,15 @@ class RRDMeta(type):
             cls._meta['rras_list'].append(name)
         elif name == "_impl":
             cls._meta['implementation'] = value
+        elif name == "_cache":
+            cls._meta['cache'] = value
+        elif name == "_graph_cache":
+            cls._meta['graph_cache'] = value
+
+        # datasources or rras added to an existing class
+        if isinstance(value, (DataSource, RRA)) and \
+                cls._meta['encoder'] is not None:
+            cls._meta['encoder'] = _CommandEncoder(cls._meta)
 
         setattr(cls, name, value)
 
@@ -0,0 +1,367 @@
+#-*- coding: utf-8 -*-
+
+"""
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import os
+import errno
+import socket
+import threading
+import contextlib
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from thrush.rrd import RRDError, RRDLines, _rrdtool_impl
+
+DEFAULT_PORT = 42217
+
+# commands of rrdtool, that do not know the --daemon option
+_LOCAL_COMMANDS = frozenset(["restore"])
+
+
+def _parse_address(address):
+    # accepts the same addresses as the --daemon option of rrdtool
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[5:]
+    if address.startswith("/"):
+        return socket.AF_UNIX, address
+
+    host, port = address, DEFAULT_PORT
+    if address.startswith("["):
+        host, _, rest = address[1:].partition("]")
+        if rest.startswith(":"):
+            port = int(rest[1:])
+    elif address.count(":") == 1:
+        host, port = address.split(":")
+        port = int(port)
+    return socket.AF_UNSPEC, (host, port)
+
+
+def _escape(field):
+    # rrdcached separates fields with spaces, a backslash escapes
+    # the following character
+    return field.replace("\\", "\\\\").replace(" ", "\\ ")
+
+
+class _Connection(object):
+    def __init__(self, address, timeout):
+        family, target = _parse_address(address)
+        self.broken = False
+        try:
+            if family == socket.AF_UNIX:
+                self.socket = socket.socket(family, socket.SOCK_STREAM)
+                self.socket.settimeout(timeout)
+                self.socket.connect(target)
+            else:
+                self.socket = socket.create_connection(target, timeout)
+        except (socket.error, OSError) as e:
+            raise RRDError(-1, "cannot connect to rrdcached at '%s': %s" % (
+                address, e))
+        self.reader = self.socket.makefile('rb')
+
+    def _readline(self):
+        line = self.reader.readline()
+        if not line.endswith(b"\n"):
+            raise socket.error("connection closed by rrdcached")
+        return line.decode('utf-8', 'replace').rstrip("\r\n")
+
+    def send(self, lines):
+        try:
+            self.socket.sendall(
+                "".join(line + "\n" for line in lines).encode('utf-8')
+            )
+        except (socket.error, OSError) as e:
+            self.broken = True
+            raise RRDError(-1, "lost connection to rrdcached: %s" % e)
+
+    def response(self):
+        """
+            Reads a response, which consists of a status line and as
+            many lines as the status tells, if it is positive.
+        """
+        try:
+            status, _, message = self._readline().partition(" ")
+            status = int(status)
+            lines = [self._readline() for _ in range(max(status, 0))]
+        except (socket.error, OSError, ValueError) as e:
+            self.broken = True
+            raise RRDError(-1, "lost connection to rrdcached: %s" % e)
+        return status, message, lines
+
+    def close(self):
+        for closable in (self.reader, self.socket):
+            try:
+                closable.close()
+            except (socket.error, OSError):
+                pass
+
+
+class RRDCachedClient(object):
+    """
+        .. versionadded:: 0.4
+
+        A client for rrdcached_, that speaks its protocol directly.
+        Connections are kept in a pool and can be used from several
+        threads at the same time.
+
+        :param address: The address of the daemon in the same format
+                        as the ``--daemon`` option of rrdtool, i.e.
+                        ``unix:/path/to/socket``, ``/path/to/socket``,
+                        ``host`` or ``host:port``.
+        :param connections: The maximum number of open connections. If
+                            all of them are in use, further commands
+                            wait for a connection to become available.
+        :param timeout: A timeout in seconds for socket operations.
+
+        Filenames are passed like librrd does it: a daemon listening on
+        a unix socket gets the canonical absolute path of the file,
+        while a relative path is sent to a remote daemon, which
+        resolves it against its base directory. Absolute paths cannot
+        be used with a remote daemon.
+
+        All methods raise :py:class:`thrush.rrd.RRDError` when the
+        daemon reports an error or the connection fails.
+
+        .. _rrdcached: http://oss.oetiker.ch/rrdtool/doc/rrdcached.en.html
+    """
+    def __init__(self, address, connections=4, timeout=None):
+        self.address = address
+        self.timeout = timeout
+        self._local = _parse_address(address)[0] == socket.AF_UNIX
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(connections)
+
+    @contextlib.contextmanager
+    def _connection(self):
+        self._slots.acquire()
+        try:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = _Connection(self.address, self.timeout)
+
+            try:
+                yield connection
+            finally:
+                if connection.broken:
+                    connection.close()
+                else:
+                    self._idle.put(connection)
+        finally:
+            self._slots.release()
+
+    def path(self, filename):
+        """
+            :returns: The filename as it is sent to the daemon.
+        """
+        if self._local:
+            # realpath() of librrd fails for missing files
+            if not os.path.exists(filename):
+                raise RRDError(-1, "realpath(%s): %s" % (
+                    filename, os.strerror(errno.ENOENT)))
+            return os.path.realpath(filename)
+        if filename.startswith("/"):
+            raise RRDError(-1, "absolute path names not allowed when "
+                               "talking to a remote daemon")
+        return filename
+
+    def execute(self, command, *arguments):
+        """
+            Executes a single command.
+
+            :returns: A tuple ``(message, lines)`` containing the
+                      message of the status line and the additional
+                      lines of the response.
+        """
+        line = " ".join([command] + [_escape(arg) for arg in arguments])
+        with self._connection() as connection:
+            connection.send([line])
+            status, message, lines = connection.response()
+        if status < 0:
+            raise RRDError(status, message)
+        return message, lines
+
+    def batch(self, commands):
+        """
+            Executes many commands at once using the ``BATCH`` mode.
+            Unlike with :py:meth:`execute`, an error does not stop the
+            execution of the remaining commands.
+
+            :param commands: A list of commands, where each command is a
+                             list containing the name of the command and
+                             its arguments.
+
+            :returns: A list of ``(index, message)`` tuples for every
+                      command that failed, where index is the position
+                      of the command within *commands*.
+        """
+        lines = [
+            " ".join([command[0]] + [_escape(arg) for arg in command[1:]])
+            for command in commands
+        ]
+        with self._connection() as connection:
+            connection.send(["BATCH"])
+            status, message, _ = connection.response()
+            if status < 0:
+                raise RRDError(status, message)
+
+            connection.send(lines + ["."])
+            status, message, errors = connection.response()
+        if status < 0:
+            raise RRDError(status, message)
+
+        result = []
+        for error in errors:
+            index, _, message = error.partition(" ")
+            result.append((int(index) - 1, message))
+        return result
+
+    def update(self, filename, *values):
+        """
+            Queues the given ``timestamp:value[:value...]`` strings
+            for the file.
+        """
+        self.execute("UPDATE", self.path(filename), *values)
+
+    def flush(self, filename=None):
+        """
+            Writes the queued values of the file to disk, or of all
+            files if *filename* is ``None``.
+        """
+        if filename is None:
+            self.execute("FLUSHALL")
+        else:
+            self.execute("FLUSH", self.path(filename))
+
+    def first(self, filename, index=0):
+        """
+            :returns: The timestamp of the first row of an archive.
+        """
+        return int(
+            self.execute("FIRST", self.path(filename), str(index))[0]
+        )
+
+    def last(self, filename):
+        """
+            :returns: The timestamp of the last update.
+        """
+        return int(self.execute("LAST", self.path(filename))[0])
+
+    def fetch(self, filename, cf, start=None, end=None):
+        """
+            :returns: A tuple ``(dsnames, rows)``, where *rows* are the
+                      data lines of the response in the format of
+                      ``rrdtool fetch``.
+        """
+        arguments = [self.path(filename), cf]
+        if start is not None:
+            arguments.append(start)
+            if end is not None:
+                arguments.append(end)
+        message, lines = self.execute("FETCH", *arguments)
+
+        dsnames, rows = [], []
+        for line in lines:
+            line = line.strip()
+            if line.startswith("DSName:"):
+                dsnames = line.split(":", 1)[1].split()
+            elif line[:1].isdigit():
+                rows.append(line)
+        return dsnames, rows
+
+    def close(self):
+        """
+            Closes all idle connections.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class RRDCached(object):
+    """
+        .. versionadded:: 0.4
+
+        An implementation that sends ``update``, ``fetch`` and
+        ``first`` directly to rrdcached using a
+        :py:class:`RRDCachedClient`. All other commands are passed to
+        the *fallback* implementation along with the ``--daemon``
+        option, except ``restore``, which does not support it and
+        thus writes the file without rrdcached.
+
+        Updates are sent without the ``--template`` option, thus the
+        datasources of the RRD file must be in the same order as in
+        the RRD class, which is the case for files created by thrush.
+
+        :param address: See :py:class:`RRDCachedClient`.
+        :param connections: See :py:class:`RRDCachedClient`.
+        :param timeout: See :py:class:`RRDCachedClient`.
+        :param batch: When set to True, updates with more than one
+                      sample (e.g. by ``update_many``) are sent in
+                      ``BATCH`` mode, one ``UPDATE`` per sample.
+                      Otherwise they are sent as a single ``UPDATE``.
+        :param fallback: The implementation for all other commands.
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            from thrush import rrd, rrdcached
+
+            class MyRRD(rrd.RRD):
+                _impl = rrdcached.RRDCached("unix:/var/run/rrdcached.sock")
+
+                ds = rrd.Gauge(heartbeat=600)
+                rra = rrd.Max(xff=0.5, steps=1, rows=24)
+    """
+    def __init__(self, address, connections=4, timeout=None, batch=True,
+                 fallback=_rrdtool_impl):
+        self.client = RRDCachedClient(address, connections, timeout)
+        self.batch = batch
+        self.fallback = fallback
+
+    def __call__(self, filename, command, options, wait=True):
+        options = list(options)
+        if command == "update" and "--" in options:
+            return self._update(filename, options[options.index("--") + 1:])
+        if command == "fetch" and "--resolution" not in options:
+            return self._fetch(filename, options)
+        if command == "first" and options[:1] == ["--rraindex"]:
+            return RRDLines(["%d" % self.client.first(filename, options[1])])
+        if command in _LOCAL_COMMANDS:
+            return self.fallback(filename, command, options, wait=wait)
+        return self.fallback(
+            filename, command, ["--daemon", self.client.address] + options,
+            wait=wait
+        )
+
+    def _update(self, filename, samples):
+        if not self.batch or len(samples) < 2:
+            self.client.update(filename, *samples)
+            return RRDLines([])
+
+        path = self.client.path(filename)
+        errors = self.client.batch([
+            ["UPDATE", path, sample] for sample in samples
+        ])
+        if errors:
+            raise RRDError(-1, "; ".join(
+                "%s: %s" % (samples[index], message)
+                for index, message in errors
+            ))
+        return RRDLines([])
+
+    def _fetch(self, filename, options):
+        arguments = dict(zip(options[1::2], options[2::2]))
+        dsnames, rows = self.client.fetch(
+            filename, options[0], arguments.get("--start"),
+            arguments.get("--end")
+        )
+        return RRDLines([" ".join(dsnames), ""] + rows)
@@ -0,0 +1,293 @@
+#-*- coding: utf-8 -*-
+
+"""
+    :copyright: (c) 2013 by Tobias Heinzen
+    :license: BSD, see LICENSE for more details
+"""
+
+import array
+import locale
+from xml.etree import ElementTree
+
+from thrush.rrd import RRDError, DataSource, numpy, _TIMESTAMP_TYPECODE, \
+    _float_or_nan, _convert_to_timestamp, _convert_to_argument, \
+    _argument_limit, _arguments_length, _escape_def, _execute
+
+try:
+    range = xrange
+except NameError:
+    pass
+
+
+class RRDXport(object):
+    """
+        .. versionadded:: 0.4
+
+        The result of :py:func:`thrush.xport.xport`. All columns share
+        the same time grid.
+
+        .. attribute:: start
+
+            The seconds since the epoch of the first row.
+
+        .. attribute:: end
+
+            The seconds since the epoch of the last row.
+
+        .. attribute:: step
+
+            The seconds between two rows.
+
+        .. attribute:: legend
+
+            The names of the exported columns in the requested order.
+
+        .. attribute:: timestamps
+
+            An ``array`` containing the seconds since the epoch of
+            every row.
+
+        .. attribute:: columns
+
+            A dictionary containing an ``array`` of floats for every
+            column. Unknown values are NaN.
+    """
+    def __init__(self):
+        self.start = self.end = self.step = None
+        self.legend = []
+        self.timestamps = array.array(_TIMESTAMP_TYPECODE)
+        self.columns = {}
+
+    def _merge(self, other):
+        if self.step is None:
+            self.start, self.end, self.step = other.start, other.end, \
+                other.step
+            self.timestamps = other.timestamps
+        elif (self.start, self.step, len(self.timestamps)) != \
+                (other.start, other.step, len(other.timestamps)):
+            raise RRDError(-1, "xport returned different time grids")
+        self.legend.extend(other.legend)
+        self.columns.update(other.columns)
+
+    def to_arrays(self):
+        """
+            Converts the result into arrays. This requires NumPy_.
+
+            :returns: A tuple ``(timestamps, values)`` like
+                      :py:meth:`thrush.rrd.RRDFetchResult.to_arrays`,
+                      where *values* is keyed by column name.
+
+            .. _NumPy: http://www.numpy.org
+        """
+        if numpy is None:
+            raise ImportError("to_arrays() requires numpy")
+        return numpy.array(self.timestamps, dtype=numpy.int64), dict(
+            (name, numpy.frombuffer(column, dtype=numpy.float64).copy())
+            for name, column in self.columns.items()
+        )
+
+
+class _XportParser(object):
+    # a target for ElementTree.XMLParser, that collects the output
+    # of xport into arrays while it is being fed.
+    def __init__(self):
+        self.result = RRDXport()
+        self._text = []
+        self._meta = {}
+        self._row = []
+        self._decimal_point = locale.localeconv()['decimal_point']
+
+    def start(self, tag, attrib):
+        self._text = []
+        if tag == "row":
+            self._row = []
+
+    def data(self, data):
+        self._text.append(data)
+
+    def end(self, tag):
+        text = "".join(self._text).strip()
+        result = self.result
+        if tag in ("start", "end", "step"):
+            self._meta[tag] = int(text)
+        elif tag == "entry":
+            result.legend.append(text)
+            result.columns[text] = array.array('d')
+        elif tag == "t":
+            result.timestamps.append(int(text))
+        elif tag == "v":
+            if self._decimal_point != ".":
+                text = text.replace(self._decimal_point, ".")
+            self._row.append(_float_or_nan(text))
+        elif tag == "row":
+            if len(self._row) != len(result.legend):
+                raise RRDError(-1, "unexpected output of xport")
+            for name, value in zip(result.legend, self._row):
+                result.columns[name].append(value)
+
+    def close(self):
+        result = self.result
+        result.start = self._meta.get("start")
+        result.end = self._meta.get("end")
+        result.step = self._meta.get("step")
+
+        # older versions do not print the time of every row
+        rows = len(result.columns[result.legend[0]]) if result.legend else 0
+        if not result.timestamps and rows and result.step:
+            result.timestamps.extend(
+                result.start + i * result.step for i in range(rows)
+            )
+        return result
+
+
+def _xport_definition(vname, rrd, ds, cf):
+    if isinstance(ds, DataSource):
+        dsname = ds.name
+    elif ds in rrd._meta['datasources']:
+        dsname = rrd._meta['datasources'][ds].name
+    else:
+        raise ValueError("unknown datasource '%s' of %s" % (
+            ds, type(rrd).__name__))
+    return "DEF:%s=%s:%s:%s" % (
+        vname, _escape_def(rrd.filename), dsname, getattr(cf, 'cf', cf)
+    )
+
+
+def _xport_groups(statements, dependencies, order, columns, limit):
+    # splits the columns into groups, whose statements fit into the
+    # argument vector. each group contains every definition its
+    # columns depend on, in the order they were defined.
+    position = dict((vname, i) for i, vname in enumerate(order))
+    groups, group, needed = [], [], []
+    for column in columns:
+        required = []
+        pending = [column]
+        while pending:
+            vname = pending.pop()
+            if vname not in required:
+                required.append(vname)
+                pending.extend(dependencies[vname])
+
+        merged = sorted(set(needed + required), key=position.get)
+        arguments = [statements[vname] for vname in merged] + [
+            "XPORT:%s:%s" % (name, name) for name in group + [column]
+        ]
+        if group and _arguments_length(arguments) > limit:
+            groups.append((group, needed))
+            group, merged = [], sorted(required, key=position.get)
+        group.append(column)
+        needed = merged
+    if group:
+        groups.append((group, needed))
+    return groups
+
+
+def xport(defs, cdefs=(), columns=None, start="end-1day", end="now",
+          step=None, maxrows=None):
+    """
+        .. versionadded:: 0.4
+
+        Exports data of many RRD files at once, consolidated onto the
+        same time grid. This implements the rrdxport_ command and
+        executes as few ``rrdtool`` processes as possible, usually a
+        single one. If the arguments do not fit into a single command,
+        the columns are split up among several commands.
+
+        The commands are executed by the implementation of the RRD
+        class of the first definition.
+
+        :param defs: An iterable of ``(vname, rrd, ds, cf)`` tuples.
+                     *vname* is the name of the variable, *rrd* a RRD
+                     object, *ds* the datasource either by its
+                     attribute name or as object and *cf* either the
+                     string representation of a consolidation function
+                     or a RRA object.
+        :param cdefs: An iterable of ``(vname, rpn_expression)`` tuples
+                      defining calculated variables.
+        :param columns: The names of the variables to export. Defaults
+                        to all variables in the order they are defined.
+        :param start: See ``fetch``.
+        :param end: See ``fetch``.
+        :param step: The desired seconds between two rows.
+        :param maxrows: The maximal number of rows.
+
+        :returns: :py:class:`thrush.xport.RRDXport`
+
+        :raises: :py:class:`thrush.rrd.RRDError`
+
+        *Example*:
+
+        .. sourcecode:: python
+
+            from thrush.xport import xport
+
+            result = xport(
+                [("a", myrrd, "ds", "MAX"), ("b", other, "ds", "MAX")],
+                cdefs=[("total", "a,b,+")],
+                start="end-1h"
+            )
+            print result.timestamps[0], result.columns["total"][0]
+
+        .. _rrdxport: http://oss.oetiker.ch/rrdtool/doc/rrdxport.en.html
+    """
+    defs, cdefs = list(defs), list(cdefs)
+    if not defs:
+        raise ValueError("xport needs at least one definition")
+
+    statements, dependencies, order = {}, {}, []
+    for vname, rrd, ds, cf in defs:
+        statements[vname] = _xport_definition(vname, rrd, ds, cf)
+        dependencies[vname] = []
+        order.append(vname)
+    for vname, rpn in cdefs:
+        statements[vname] = "CDEF:%s=%s" % (vname, rpn)
+        dependencies[vname] = [
+            token for token in rpn.split(",") if token in statements
+        ]
+        order.append(vname)
+    columns = order if columns is None else list(columns)
+    for column in columns:
+        if column not in statements:
+            raise ValueError("unknown variable '%s'" % column)
+
+    start, end = _convert_to_timestamp(start), _convert_to_timestamp(end)
+    options = []
+    if maxrows is not None:
+        options += ["--maxrows", _convert_to_argument(maxrows)]
+    first = defs[0][1]
+    limit = _argument_limit(first._meta['implementation']) - _arguments_length(
+        ["rrdtool", "xport", "--start", start, "--end", end,
+         "--step", "9999999999"] + options
+    )
+
+    result = RRDXport()
+    groups = _xport_groups(statements, dependencies, order, columns, limit)
+    for group, needed in groups:
+        if result.step is None:
+            arguments = ["--start", start, "--end", end] + options
+            if step is not None:
+                arguments += ["--step", _convert_to_argument(step)]
+        else:
+            # all further commands must use the grid of the first one.
+            # the first row is one step after the start.
+            arguments = [
+                "--start", str(result.start - result.step),
+                "--end", str(result.end), "--step", str(result.step)
+            ] + options
+        arguments += [statements[vname] for vname in needed[1:]]
+        arguments += ["XPORT:%s:%s" % (name, name) for name in group]
+
+        # the first statement takes the place of the filename, as
+        # xport does not have one.
+        parser = ElementTree.XMLParser(target=_XportParser())
+        stdout = _execute(first, "xport", arguments, wait=False,
+                          filename=statements[needed[0]])
+        try:
+            for line in stdout:
+                parser.feed(line + "\n")
+            result._merge(parser.close())
+        except ElementTree.ParseError as e:
+            raise RRDError(-1, "unexpected output of xport: %s" % e)
+        finally:
+            stdout.close()
+    return result